@@ -0,0 +1,228 @@
+"""
+Compares the launch of the leader and the mpmd perf wrappers at increasing
+node counts, using fake `mpirun`, `srun`, `perf` and `hostname` commands so it
+runs on a single machine.
+
+For each node count, the launch line of each wrapper is written into a job
+script as ReFrame would, and the script is run with the fake commands first
+on the `PATH`. Reported are the length of the launch command, the time spent
+on the launching node before any rank starts (the hostfile step and the
+command line itself), and the time the wrapper adds to the ranks of one node,
+for which the fake `mpirun` only starts the ranks of the first node with the
+local rank set as a real launcher would. Nodes start in parallel, so the
+launch latency is the sum of the two.
+
+This does not model the MPI launcher's own start-up, which is the same for
+both wrappers.
+
+Usage:
+
+    python bench/perf_launch_latency.py [--nodes 8 64 256 512] [--ranks-per-node 2]
+"""
+
+import os
+import sys
+import time
+import shutil
+import argparse
+import tempfile
+import subprocess
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from harness.perf import (
+    PerfLauncherWrapper,
+    PerfLeaderLauncherWrapper,
+    PERF_OUTPUT_FORMAT,
+)
+
+# runtime of the fake benchmark, included in the launch times
+APP_SECONDS = 1.0
+
+FAKE_MPIRUN = r"""#!/usr/bin/env python3
+# either `-np N cmd` or mpmd `--host H -n 1 cmd : [...] -np N cmd`. Only the
+# ranks of `node0` are started, and none if FAKE_SPAWN is 0
+import os, sys, subprocess
+
+ppn = int(os.environ["FAKE_RANKS_PER_NODE"])
+if os.environ.get("FAKE_SPAWN") == "0":
+    sys.exit(0)
+
+args = [a for a in sys.argv[1:] if a not in ("-l", "-ordered-output")]
+blocks, current = [], []
+for a in args:
+    if a == ":":
+        blocks.append(current)
+        current = []
+    else:
+        current.append(a)
+blocks.append(current)
+
+procs = []
+for block in blocks:
+    host, n = None, 1
+    while block and block[0].startswith("-"):
+        if block[0] == "--host":
+            host = block[1]
+        elif block[0] in ("-n", "-np"):
+            n = int(block[1])
+        block = block[2:]
+
+    # ranks without a host fill up the nodes in order
+    per_node = ppn if len(blocks) == 1 else ppn - 1
+    for r in range(n):
+        if (host or f"node{r // per_node}") != "node0":
+            continue
+        env = dict(os.environ, SLURM_LOCALID=str(len(procs)), FAKE_HOST="node0")
+        procs.append(subprocess.Popen(block, env=env))
+
+sys.exit(max([p.wait() for p in procs] or [0]))
+"""
+
+FAKE_SRUN = r"""#!/usr/bin/env python3
+# only what the mpmd hostfile step needs: `srun [...] -nN [...] hostname`
+import sys
+n = next(int(a[2:]) for a in sys.argv[1:] if a.startswith("-n") and a[2:].isdigit())
+print("\n".join(f"node{i}" for i in range(n)))
+"""
+
+FAKE_PERF = r"""#!/bin/bash
+# `perf stat [-o file] [...] [cmd]`: writes an interval per event at the end,
+# either after running `cmd` or when interrupted
+shift
+out=/dev/stderr
+events=()
+while [ "$#" -gt 0 ]; do
+    case "$1" in
+        -o) out="$2"; shift 2 ;;
+        -e) events+=("$2"); shift 2 ;;
+        -I) shift 2 ;;
+        -*) shift ;;
+        *) break ;;
+    esac
+done
+
+emit() {
+    for e in "${events[@]}"; do
+        echo "     1.000 S0        1      10.00 Joules $e" >> "$out"
+    done
+    exit 0
+}
+
+if [ "$#" -gt 0 ]; then
+    "$@"
+    emit
+fi
+trap emit INT
+while true; do sleep 0.05; done
+"""
+
+FAKE_HOSTNAME = """#!/bin/bash
+echo "${FAKE_HOST:-node0}"
+"""
+
+
+def _write_fakes(bindir: str):
+    for name, text in (
+        ("mpirun", FAKE_MPIRUN),
+        ("srun", FAKE_SRUN),
+        ("perf", FAKE_PERF),
+        ("hostname", FAKE_HOSTNAME),
+    ):
+        path = os.path.join(bindir, name)
+        with open(path, "w") as f:
+            f.write(text)
+        os.chmod(path, 0o755)
+
+
+class _FakeTarget:
+    def __init__(self, num_tasks):
+        self.num_tasks = num_tasks
+
+    def command(self, job):
+        return ["mpirun", "-np", str(self.num_tasks)]
+
+
+def job_script(wrapper_cls, nodes: int, ppn: int) -> tuple:
+    # long enough for every perf to have started before the ranks exit
+    executable = "sleep"
+    executable_opts = [str(APP_SECONDS)]
+    wrapper = wrapper_cls(
+        _FakeTarget(nodes * ppn),
+        ["power/energy-pkg/", "power/energy-ram/"],
+        executable,
+        executable_opts,
+        nodes,
+    )
+    launch = " ".join(wrapper.command(None) + [executable] + executable_opts)
+    lines = ["#!/bin/bash", *wrapper.additional_prerun_cmds(), launch]
+    return "\n".join(lines) + "\n", len(launch)
+
+
+def _run_script(script: str, stagedir: str, env: dict) -> float:
+    path = os.path.join(stagedir, "job.sh")
+    with open(path, "w") as f:
+        f.write(script)
+
+    start = time.perf_counter()
+    subprocess.run(
+        ["bash", path], cwd=stagedir, env=env, check=True, stderr=subprocess.DEVNULL
+    )
+    return time.perf_counter() - start
+
+
+def run(wrapper_cls, nodes: int, ppn: int, bindir: str) -> tuple:
+    """
+    Returns the length of the launch command, the time spent on the launching
+    node before `mpirun` starts any ranks, and the time the wrapper adds to the
+    ranks of a single node, which all nodes pay in parallel.
+    """
+    script, length = job_script(wrapper_cls, nodes, ppn)
+    env = dict(
+        os.environ,
+        PATH=bindir + os.pathsep + os.environ["PATH"],
+        FAKE_RANKS_PER_NODE=str(ppn),
+    )
+
+    with tempfile.TemporaryDirectory() as stagedir:
+        head = _run_script(script, stagedir, dict(env, FAKE_SPAWN="0"))
+
+    with tempfile.TemporaryDirectory() as stagedir:
+        node = _run_script(script, stagedir, env) - head - APP_SECONDS
+
+        if wrapper_cls is PerfLeaderLauncherWrapper:
+            path = os.path.join(stagedir, PERF_OUTPUT_FORMAT.format(host="node0"))
+            assert os.path.isfile(path), "no perf output from the leader"
+
+    return length, head, node
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--nodes", type=int, nargs="+", default=[8, 64, 256, 512])
+    parser.add_argument("--ranks-per-node", type=int, default=2)
+    args = parser.parse_args(argv)
+
+    bindir = tempfile.mkdtemp()
+    try:
+        _write_fakes(bindir)
+        print(
+            f"{'nodes':>6} {'mode':>7} {'command / bytes':>16}"
+            f" {'head / s':>9} {'per node / s':>13} {'launch / s':>11}"
+        )
+        for nodes in args.nodes:
+            for mode, cls in (
+                ("leader", PerfLeaderLauncherWrapper),
+                ("mpmd", PerfLauncherWrapper),
+            ):
+                length, head, node = run(cls, nodes, args.ranks_per_node, bindir)
+                print(
+                    f"{nodes:>6} {mode:>7} {length:>16}"
+                    f" {head:>9.3f} {node:>13.3f} {head + node:>11.3f}"
+                )
+    finally:
+        shutil.rmtree(bindir)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,136 @@
+"""
+Measures the latency and peak memory of the post-processing of a run as the
+number of nodes, sockets, perf events and perf samples grow, using the offline
+test bed of `testbed.py`.
+
+Each stage is timed on its own, in the order the performance stage of ReFrame
+runs them: parsing and indexing the perf output, evaluating the perf energy
+variables, fetching and integrating the BMC power of every node, and writing
+the time series collected along the way. The peak memory is that of a second,
+separate run under `tracemalloc`, as tracing slows everything down.
+
+Usage:
+
+    python bench/postprocess_scaling.py [--nodes 1 4 16] [--sockets 2] [--events 1 3] [--samples 360 3600]
+"""
+
+import os
+import sys
+import time
+import shutil
+import argparse
+import itertools
+import tempfile
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import testbed
+
+INTERVAL_MS = 10000
+
+
+def _run(sacct: str, nodes, sockets, events, samples, mode) -> testbed.OfflineRun:
+    stagedir = tempfile.mkdtemp()
+    duration = samples * INTERVAL_MS / 1000
+    # long enough ago that the whole run is in the past
+    start = float(int(time.time() - duration) - 7200)
+    run = testbed.OfflineRun(
+        stagedir,
+        nodes,
+        sockets,
+        testbed.EVENTS[:events],
+        samples,
+        INTERVAL_MS,
+        start=start,
+        perf_launch_mode=mode,
+    )
+    testbed.add_sacct_job(sacct, testbed.JOB_ID, run.start, run.end)
+    return run
+
+
+def _stages(run: testbed.OfflineRun) -> dict:
+    import reframe.utility.osext as osext
+    import reframe.utility.sanity as sn
+
+    times = {}
+
+    def _stage(name, f):
+        start = time.perf_counter()
+        result = f()
+        times[name] = time.perf_counter() - start
+        return result
+
+    run._bmc_instrument_scheduler_times()
+    with osext.change_dir(run.stagedir):
+        _stage("parse", run._perf_instrument_intervals)
+
+        run._perf_instrument_set_variables()
+        perf = dict(run.perf_variables)
+        _stage("perf", lambda: [sn.evaluate(v) for v in perf.values()])
+
+        run.perf_variables = {}
+        run._bmc_instrument_set_performance_variables()
+        bmc = dict(run.perf_variables)
+        _stage("BMC", lambda: [sn.evaluate(v) for v in bmc.values()])
+
+        path = os.path.join(run.stagedir, "timeseries.packed.npz")
+        _stage("export", lambda: run.time_series.to_packed(path))
+
+    return times
+
+
+def _peak_memory(run: testbed.OfflineRun) -> int:
+    tracemalloc.start()
+    try:
+        run.performance()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return peak
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--nodes", type=int, nargs="+", default=[1, 4, 16])
+    parser.add_argument("--sockets", type=int, nargs="+", default=[testbed.SOCKETS])
+    parser.add_argument("--events", type=int, nargs="+", default=[1, 3])
+    parser.add_argument("--samples", type=int, nargs="+", default=[360, 3600])
+    parser.add_argument("--mode", choices=["leader", "mpmd"], default="leader")
+    parser.add_argument("--no-memory", action="store_true")
+    args = parser.parse_args(argv)
+
+    stages = ["parse", "perf", "BMC", "export"]
+    print(
+        f"{'nodes':>5} {'sockets':>7} {'events':>6} {'samples':>7} {'lines':>9}"
+        + "".join(f" {s + ' / s':>10}" for s in stages)
+        + f" {'total / s':>10} {'peak / MiB':>10}"
+    )
+
+    with testbed.offline_cluster() as (sacct, _):
+        grid = itertools.product(args.nodes, args.sockets, args.events, args.samples)
+        for nodes, sockets, events, samples in grid:
+            run = _run(sacct, nodes, sockets, events, samples, args.mode)
+            try:
+                times = _stages(run)
+            finally:
+                shutil.rmtree(run.stagedir)
+
+            peak = float("nan")
+            if not args.no_memory:
+                run = _run(sacct, nodes, sockets, events, samples, args.mode)
+                try:
+                    peak = _peak_memory(run) / 2**20
+                finally:
+                    shutil.rmtree(run.stagedir)
+
+            lines = nodes * sockets * events * samples
+            print(
+                f"{nodes:>5} {sockets:>7} {events:>6} {samples:>7} {lines:>9}"
+                + "".join(f" {times[s]:>10.3f}" for s in stages)
+                + f" {sum(times.values()):>10.3f} {peak:>10.1f}"
+            )
+
+
+if __name__ == "__main__":
+    sys.exit(main())
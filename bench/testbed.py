@@ -0,0 +1,396 @@
+"""
+An offline stand-in for the cluster, so that the post-processing of the
+harness can be run end to end on any machine: a fake Prometheus answering the
+BMC power query, a fake `sacct` for the job times, `perf stat -I` output of
+any number of hosts, sockets and events, and a SPEChpc `spectimes.txt`.
+
+`OfflineRun` stands in for a finished test. It has the attributes that the
+`SPEChpcBase`, `PerfInstrument` and `BMCInstrument` hooks and performance
+functions read, and borrows those methods, so running it goes through the same
+code as the performance stage of ReFrame, from asking the scheduler for the job
+times through to the integrated energies.
+
+The end-to-end checks are in `tests/test_testbed.py`, and
+`postprocess_scaling.py` uses the test bed to benchmark the post-processing.
+"""
+
+import os
+import re
+import sys
+import json
+import shutil
+import tempfile
+import datetime
+import time
+import threading
+import contextlib
+import types
+import urllib.parse
+import http.server
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+SOCKETS = 2
+EVENTS = ["power/energy-pkg/", "power/energy-ram/", "power/energy-cores/"]
+# as written by the harness and expected by the database
+DATETIME_FORMAT = "%Y-%m-%dT%H:%M:%S"
+JOB_ID = "4242"
+JOB_NAME = "rfm_OfflineRun"
+PARTITION = "sapphire"
+
+ALIAS_REGEX = re.compile(r'alias(=~?)"((?:[^"\\]|\\.)*)"')
+
+
+def node_power(node: str) -> float:
+    """
+    The constant power in watts that the fake BMC of a node reads, so that the
+    energy over any window is known exactly.
+    """
+    return 300.0 + sum(map(ord, node)) % 100
+
+
+def _format_date(t: float) -> str:
+    return datetime.datetime.fromtimestamp(t).strftime(DATETIME_FORMAT)
+
+
+def _parse_date(s: str) -> float:
+    return datetime.datetime.strptime(s, DATETIME_FORMAT).timestamp()
+
+
+class FakePrometheus:
+    """
+    Answers the `query_range` requests of the BMC power query with one series
+    per node matched by the `alias` selector, sampled every `step` from
+    `start` to `end` at `node_power`. Use as a context manager, which sets
+    `SRFM_PROMETHEUS_ADDRESS` and `SRFM_PROMETHEUS_TOKEN` for the harness.
+    """
+
+    def __init__(self, power=node_power):
+        self.power = power
+        self.requests = 0
+        self._server = None
+        self._environ = {}
+
+    def _result(self, form: dict) -> dict:
+        query = form["query"][0]
+        start = _parse_date(form["start"][0])
+        end = _parse_date(form["end"][0])
+        step = float(form["step"][0].rstrip("s"))
+
+        # unescape the string literal, and then the regex of the node names
+        match = ALIAS_REGEX.search(query)
+        selector = re.sub(r"\\(.)", r"\1", match.group(2))
+        if match.group(1) == "=~":
+            nodes = [re.sub(r"\\(.)", r"\1", n) for n in selector.split("|")]
+        else:
+            nodes = [selector]
+
+        times = np.arange(start, end + step / 2, step)
+        return {
+            "status": "success",
+            "data": {
+                "resultType": "matrix",
+                "result": [
+                    {
+                        "metric": {"alias": node},
+                        # prometheus gives the values as strings
+                        "values": [[t, str(self.power(node))] for t in times],
+                    }
+                    for node in nodes
+                ],
+            },
+        }
+
+    def _handler(self):
+        fake = self
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            def do_POST(self):
+                length = int(self.headers.get("Content-Length", 0))
+                form = urllib.parse.parse_qs(self.rfile.read(length).decode())
+                fake.requests += 1
+
+                body = json.dumps(fake._result(form)).encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        return Handler
+
+    def __enter__(self):
+        self._server = http.server.ThreadingHTTPServer(
+            ("127.0.0.1", 0), self._handler()
+        )
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+
+        host, port = self._server.server_address
+        self.address = f"{host}:{port}"
+        for name, value in (
+            ("SRFM_PROMETHEUS_ADDRESS", self.address),
+            ("SRFM_PROMETHEUS_TOKEN", "offline"),
+        ):
+            self._environ[name] = os.environ.get(name, None)
+            os.environ[name] = value
+        return self
+
+    def __exit__(self, *args):
+        self._server.shutdown()
+        self._server.server_close()
+        for name, value in self._environ.items():
+            if value is None:
+                os.environ.pop(name, None)
+            else:
+                os.environ[name] = value
+
+
+def write_fake_sacct(directory: str) -> str:
+    """
+    Writes an executable `sacct` into `directory` that reports the jobs in
+    `sacct_jobs.json` next to it in the format of
+    `sacct --format=jobid,start,end,elapsed`. Put `directory` first on the
+    `PATH` to use it, and add jobs with `add_sacct_job`.
+    """
+    jobs = os.path.join(directory, "sacct_jobs.json")
+    with open(jobs, "w") as f:
+        json.dump({}, f)
+
+    script = f"""#!{sys.executable}
+import sys, json
+rows = json.load(open({jobs!r}))
+jobs = [a.split("=", 1)[1] for a in sys.argv[1:] if a.startswith("--jobs=")]
+print("JobID                     Start                 End    Elapsed")
+print("------------ ------------------- ------------------- ----------")
+for jobid in jobs:
+    if jobid in rows:
+        start, end, elapsed = rows[jobid]
+        h, m, s = elapsed // 3600, elapsed // 60 % 60, elapsed % 60
+        for step in (jobid, jobid + ".batch"):
+            print(f"{{step:<12}} {{start}} {{end}} {{h:02d}}:{{m:02d}}:{{s:02d}}")
+"""
+    path = os.path.join(directory, "sacct")
+    with open(path, "w") as f:
+        f.write(script)
+    os.chmod(path, 0o755)
+    return path
+
+
+def add_sacct_job(directory: str, jobid: str, start: float, end: float):
+    """
+    Makes the fake `sacct` in `directory` report a job with the given unix
+    times.
+    """
+    jobs = os.path.join(directory, "sacct_jobs.json")
+    with open(jobs) as f:
+        rows = json.load(f)
+    rows[jobid] = (_format_date(start), _format_date(end), int(end - start))
+    with open(jobs, "w") as f:
+        json.dump(rows, f)
+
+
+def perf_stat_output(
+    events: list,
+    sockets: int,
+    samples: int,
+    interval_ms: int = 10000,
+    rank: int = None,
+    seed: int = 0,
+) -> tuple:
+    """
+    The stderr of `perf stat -I <interval_ms> --per-socket -a -e <events>` with
+    `samples` intervals, interleaved with some output of the benchmark, with
+    each line prefixed by `[rank]` as the MPI launcher does if `rank` is
+    given. Returns the text and the total of each `(socket, event)`.
+    """
+    rng = np.random.default_rng(seed)
+    values = np.round(rng.uniform(50, 150, (samples, sockets, len(events))), 2)
+    prefix = "" if rank is None else f"[{rank}] "
+
+    lines = [f"{prefix}#           time socket cpus             counts unit events"]
+    for i in range(samples):
+        t = (i + 1) * interval_ms / 1000 + 0.000123
+        for s in range(sockets):
+            for e, event in enumerate(events):
+                lines.append(
+                    f"{prefix}{t:>15.9f} S{s:<4} {56:>4} {values[i, s, e]:>18.2f}"
+                    f" Joules {event}"
+                )
+        if i % 100 == 0:
+            lines.append(f"{prefix} Iteration {i} residual 1.0e-{i % 7}")
+
+    totals = {
+        (s, event): float(values[:, s, e].sum())
+        for s in range(sockets)
+        for (e, event) in enumerate(events)
+    }
+    return "\n".join(lines) + "\n", totals
+
+
+def spectimes_text(core: float, init: float = 1.0, verified: bool = True) -> str:
+    """
+    A `spectimes.txt` with the given phase times.
+    """
+    return "\n".join(
+        [
+            "=" * 40,
+            f" Verification: {'PASSED' if verified else 'FAILED'}",
+            f" Init time:  {init:.6f}",
+            f" Core time:  {core:.6f}",
+            f" Total time: {init + core:.6f}",
+            "=" * 40,
+            "",
+        ]
+    )
+
+
+class OfflineRun:
+    """
+    A finished test on `nodes` hosts, with its perf output, spectimes and job
+    times written to `stagedir`. Call `performance` to run the performance
+    stage hooks of the instruments, which returns the evaluated performance
+    variables.
+    """
+
+    def __init__(
+        self,
+        stagedir: str,
+        nodes: int = 1,
+        sockets: int = SOCKETS,
+        events: list = EVENTS,
+        samples: int = 60,
+        interval_ms: int = 10000,
+        start: float = None,
+        perf_launch_mode: str = "leader",
+    ):
+        # late, so that the fakes can be set up before the harness reads its
+        # environment
+        import harness.base as base
+        import harness.perf as perf
+        import harness.database as database
+        from harness.timeseries import TimeSeriesStore
+
+        self._borrow(
+            base.SPEChpcBase, "extract_spechpc_time", "set_performance_variables"
+        )
+        self._borrow(perf.PerfInstrument, "_perf_instrument")
+        self._borrow(database.BMCInstrument, "_bmc_instrument", "_read_cooldown")
+
+        self.stagedir = stagedir
+        self.num_nodes = nodes
+        self.perf_events = list(events)
+        self.perf_launch_mode = perf_launch_mode
+        self.spectimes_path = "spectimes.txt"
+        self.stderr = "rfm_job.err"
+        self.time_series = TimeSeriesStore()
+        self.perf_variables = {}
+
+        self.cooldown_adaptive = False
+        self.cooldown_seconds = 60
+        self.cooldown_duration = None
+        self.database_query_node_names = None
+        self.partition_name = PARTITION
+        self.current_partition = types.SimpleNamespace(
+            name=PARTITION, processor=types.SimpleNamespace(num_sockets=sockets)
+        )
+        self.job = types.SimpleNamespace(
+            jobid=JOB_ID,
+            name=JOB_NAME,
+            nodelist=[f"cpu-p-{i + 1:03d}" for i in range(nodes)],
+            scheduler=types.SimpleNamespace(registered_name="slurm"),
+        )
+
+        duration = samples * interval_ms / 1000
+        # a whole second, as the scheduler reports them, and long enough ago
+        # that the window is closed
+        self.start = start if start is not None else float(int(time.time()) - 7200)
+        # the job ends after the cooldown
+        self.end = self.start + duration + 5 + self.cooldown_seconds
+        self.job_start_time = _format_date(self.start)
+
+        self.expected = {}
+        self._write_outputs(sockets, samples, interval_ms, duration)
+
+    def _borrow(self, cls, *prefixes):
+        for name, value in vars(cls).items():
+            if callable(value) and name.startswith(prefixes):
+                setattr(self, name, types.MethodType(value, self))
+
+    def _write_outputs(self, sockets, samples, interval_ms, duration):
+        with open(os.path.join(self.stagedir, self.spectimes_path), "w") as f:
+            f.write(spectimes_text(duration))
+
+        leader = self.num_nodes > 1 and self.perf_launch_mode == "leader"
+        stderr = []
+        for i, host in enumerate(self.job.nodelist):
+            text, totals = perf_stat_output(
+                self.perf_events,
+                sockets,
+                samples,
+                interval_ms,
+                rank=None if (leader or self.num_nodes == 1) else i,
+                seed=i,
+            )
+            if leader:
+                path = os.path.join(self.stagedir, f"perf.{host}.txt")
+                with open(path, "w") as f:
+                    f.write(text)
+            else:
+                stderr.append(text)
+
+            for (socket, event), total in totals.items():
+                if self.num_nodes == 1:
+                    self.expected[f"/{socket}/{event}"] = total
+                else:
+                    self.expected[f"/{host}/{socket}/{event}"] = total
+
+        with open(os.path.join(self.stagedir, self.stderr), "w") as f:
+            f.write("".join(stderr))
+
+        # the BMC energy is taken between the job start and the end of the run
+        run_seconds = self.end - self.cooldown_seconds - self.start
+        for host in self.job.nodelist:
+            self.expected[f"BMC/{host}"] = node_power(host) * run_seconds
+        self.expected["Core time"] = duration
+
+    def performance(self) -> dict:
+        """
+        Runs the hooks of the end of the run and the performance stage, and
+        returns the evaluated performance variables.
+        """
+        import reframe.utility.osext as osext
+        import reframe.utility.sanity as sn
+
+        self._bmc_instrument_scheduler_times()
+
+        # ReFrame evaluates the performance functions in the stage directory
+        with osext.change_dir(self.stagedir):
+            self.set_performance_variables()
+            self._perf_instrument_set_variables()
+            self._bmc_instrument_set_performance_variables()
+            return {k: sn.evaluate(v) for (k, v) in self.perf_variables.items()}
+
+
+@contextlib.contextmanager
+def offline_cluster():
+    """
+    Starts the fake Prometheus and puts a fake `sacct` on the `PATH`, yielding
+    the directory of `sacct` and the Prometheus. The harness reads the address
+    of the database when it is first imported, so this has to be entered
+    before that, and only once per process.
+    """
+    directory = tempfile.mkdtemp()
+    path = os.environ.get("PATH", "")
+    try:
+        write_fake_sacct(directory)
+        os.environ["PATH"] = directory + os.pathsep + path
+        with FakePrometheus() as prometheus:
+            yield directory, prometheus
+    finally:
+        os.environ["PATH"] = path
+        shutil.rmtree(directory)
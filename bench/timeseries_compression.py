@@ -0,0 +1,132 @@
+"""
+Compares the size and the write and read throughput of the time series
+export formats on a synthetic 12 hour run, and times the downsampling of every
+column for plotting.
+
+The run has, for every node, perf energy events of each socket at 10 s
+intervals as printed by perf (two decimals), integer BMC power readings every
+second with the odd gap, and the cumulative RAPL energies of `rapl.py sample`
+at 0.1 s.
+
+Usage:
+
+    python bench/timeseries_compression.py [--hours 12] [--nodes 4] [--points 2000]
+"""
+
+import os
+import sys
+import time
+import shutil
+import argparse
+import tempfile
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from harness.timeseries import TimeSeriesStore
+
+START_TIME = 1.7e9
+SOCKETS = 2
+PERF_EVENTS = ["power/energy-pkg/", "power/energy-ram/", "power/energy-cores/"]
+
+
+def synthetic_store(hours: float, nodes: int, seed: int = 0) -> TimeSeriesStore:
+    rng = np.random.default_rng(seed)
+    seconds = hours * 3600
+    store = TimeSeriesStore()
+
+    for n in range(nodes):
+        node = f"node-{n:03d}"
+        # phases of the run, as changes in the mean power
+        phase = lambda t: 1.0 + 0.2 * (np.sin(2 * np.pi * t / 1800) > 0)
+
+        t = START_TIME + np.arange(0.0, seconds, 10.0)
+        for socket in range(SOCKETS):
+            for k, event in enumerate(PERF_EVENTS):
+                joules = 10.0 * (150 / (k + 1)) * phase(t) + rng.normal(0, 20, len(t))
+                store.add(f"perf/{node}", f"{socket}/{event}", t, np.round(joules, 2))
+
+        t = START_TIME + np.arange(0.0, seconds, 1.0)
+        t = t[rng.random(len(t)) > 0.01]
+        watts = np.round(400 * phase(t) + rng.normal(0, 8, len(t)))
+        store.add(f"BMC/{node}", "power", t, watts)
+
+        t = START_TIME + np.arange(0.0, seconds, 0.1) + rng.normal(0, 1e-4)
+        for socket in range(SOCKETS):
+            power = 180 * phase(t) + rng.normal(0, 5, len(t))
+            # the counters are in microjoules
+            uj = np.cumsum(np.round(power * 0.1 * 1e6))
+            store.add(f"RAPL/{node}", f"package-{socket}", t, uj / 1e6)
+
+    return store
+
+
+def _time(f, repeats: int = 3):
+    best = float("inf")
+    for _ in range(repeats):
+        start = time.perf_counter()
+        result = f()
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def _same(a: TimeSeriesStore, b: TimeSeriesStore) -> bool:
+    return all(
+        np.array_equal(x[2], y[2]) and np.array_equal(x[3], y[3], equal_nan=True)
+        for (x, y) in zip(a.items(), b.items())
+    )
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--hours", type=float, default=12.0)
+    parser.add_argument("--nodes", type=int, default=4)
+    parser.add_argument("--points", type=int, default=2000)
+    args = parser.parse_args(argv)
+
+    store = synthetic_store(args.hours, args.nodes)
+    raw = store.nbytes
+    columns = sum(1 for _ in store.items())
+    print(f"{columns} columns, {raw / 2**20:.1f} MiB in memory")
+
+    writers = {
+        "npz": lambda s, p: s.to_npz(p, compressed=False),
+        "npz (zip)": lambda s, p: s.to_npz(p),
+        "packed": lambda s, p: s.to_packed(p),
+    }
+
+    directory = tempfile.mkdtemp()
+    try:
+        print(
+            f"{'format':<10} {'size / MiB':>10} {'ratio':>6} {'write MB/s':>10} {'read MB/s':>9}"
+        )
+        for name, write in writers.items():
+            path = os.path.join(directory, name.replace(" ", "_") + ".npz")
+            written, _ = _time(lambda: write(store, path))
+            read, loaded = _time(lambda: TimeSeriesStore.from_npz(path))
+            assert _same(store, loaded), f"{name} is not lossless"
+
+            size = os.path.getsize(path)
+            print(
+                f"{name:<10} {size / 2**20:>10.2f} {raw / size:>6.1f}"
+                f" {raw / written / 1e6:>10.0f} {raw / read / 1e6:>9.0f}"
+            )
+    finally:
+        shutil.rmtree(directory)
+
+    def _downsample_all():
+        return sum(
+            len(store.downsampled(source, column, args.points)[0])
+            for (source, column, _, _) in store.items()
+        )
+
+    seconds, points = _time(_downsample_all)
+    print(
+        f"downsampling every column to {args.points} points: {seconds:.3f} s"
+        f" ({points} points kept)"
+    )
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,144 @@
+"""
+Times the bulk import of synthetic ReFrame reports into the results warehouse,
+and typical queries against it, compared to loading and scanning the reports
+themselves.
+
+Usage:
+
+    python bench/warehouse_query.py [--runs 10000] [--runs-per-report 50]
+"""
+
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import argparse
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import harness.report as report
+from harness.warehouse import Warehouse
+
+BENCHMARKS = ["Lbm_t", "Soma_t", "Tealeaf_t", "Clvleaf_t", "Pot3d_t", "Hpgmgfv_Exa_t"]
+PARTITIONS = {
+    "sapphire": [800.0 + 100.0 * i for i in range(17)],
+    "icelake": [800.0 + 100.0 * i for i in range(15)],
+    "cascadelake": [1000.0 + 100.0 * i for i in range(13)],
+}
+NODES_PER_PARTITION = 64
+START_TIME = 1.7e9
+
+
+def _testcase(rng: random.Random, i: int) -> dict:
+    partition = rng.choice(list(PARTITIONS))
+    frequency = rng.choice(PARTITIONS[partition])
+    benchmark = rng.choice(BENCHMARKS)
+    node = f"{partition[:3]}-{rng.randrange(NODES_PER_PARTITION):03d}"
+    prefix = f"cluster:{partition}:"
+
+    def _perf(value, unit):
+        return [value, 0, None, None, unit, "pass"]
+
+    return {
+        "name": f"{benchmark} %cpu_frequency_index={i % 17}",
+        "display_name": f"{benchmark}%cpu_frequency_index={i % 17}",
+        "system": "cluster",
+        "partition": partition,
+        "result": "success",
+        "job_completion_time_unix": START_TIME + 60.0 * i,
+        "nodelist": [node],
+        "num_nodes": 1,
+        "cpu_frequency": frequency,
+        "perfvalues": {
+            prefix + "Core time": _perf(rng.uniform(10, 100), "s"),
+            prefix + "Total time": _perf(rng.uniform(11, 110), "s"),
+            prefix + f"BMC/{node}": _perf(rng.uniform(1e4, 1e5), "J"),
+            prefix + f"BMC/{node}/uncertainty": _perf(rng.uniform(10, 100), "J"),
+            prefix + "/0/power/energy-pkg/": _perf(rng.uniform(1e3, 1e4), "J"),
+            prefix + "/1/power/energy-pkg/": _perf(rng.uniform(1e3, 1e4), "J"),
+        },
+    }
+
+
+def write_reports(directory: str, runs: int, per_report: int) -> list:
+    rng = random.Random(0)
+    paths = []
+    for start in range(0, runs, per_report):
+        testcases = [
+            _testcase(rng, i) for i in range(start, min(start + per_report, runs))
+        ]
+        path = os.path.join(directory, f"report-{start // per_report}.json")
+        with open(path, "w") as f:
+            json.dump({"runs": [{"testcases": testcases}]}, f)
+        paths.append(path)
+    return paths
+
+
+def scan_reports(paths: list) -> int:
+    # the query without a warehouse
+    matched = 0
+    for path in paths:
+        for tc in report.iter_testcases(report.load_report(path)):
+            if (
+                tc["name"].startswith("Lbm_t ")
+                and tc["partition"] == "sapphire"
+                and 1200 <= tc["cpu_frequency"] <= 1600
+            ):
+                report.perf_values(tc)
+                matched += 1
+    return matched
+
+
+def _time(f, repeats: int = 1):
+    best = float("inf")
+    for _ in range(repeats):
+        start = time.perf_counter()
+        result = f()
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--runs", type=int, default=10000)
+    parser.add_argument("--runs-per-report", type=int, default=50)
+    args = parser.parse_args(argv)
+
+    directory = tempfile.mkdtemp()
+    try:
+        paths = write_reports(directory, args.runs, args.runs_per_report)
+
+        with Warehouse(os.path.join(directory, "warehouse")) as w:
+            imported, _ = _time(lambda: sum(w.import_report(p) for p in paths))
+            print(f"import of {args.runs} runs: {imported:.3f} s")
+
+            queries = {
+                "benchmark, partition, frequency": lambda: w.query(
+                    benchmark="Lbm_t", partition="sapphire", frequency=(1200, 1600)
+                ),
+                "... one metric": lambda: w.query(
+                    benchmark="Lbm_t",
+                    partition="sapphire",
+                    frequency=(1200, 1600),
+                    metrics=["Core time"],
+                ),
+                "node": lambda: w.query(node="sap-007"),
+                "one day": lambda: w.query(
+                    since=START_TIME, until=START_TIME + 24 * 3600
+                ),
+            }
+            for name, query in queries.items():
+                seconds, runs = _time(query, repeats=5)
+                print(f"query by {name}: {seconds * 1e3:.2f} ms ({len(runs)} runs)")
+
+        seconds, matched = _time(lambda: scan_reports(paths))
+        print(f"scan of {len(paths)} reports: {seconds * 1e3:.2f} ms ({matched} runs)")
+    finally:
+        shutil.rmtree(directory)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,7 +1,15 @@
 from harness.build import SPEChpcBuild, build_SPEChpc_benchmark_Base
-from harness.perf import PerfEvents, PerfInstrument
+from harness.suite import SPEChpcSuiteBuild, build_SPEChpc_suite_Base
+from harness.perf import PerfEvents, PerfInstrument, SetupPerfEvents
+from harness.sampler import RAPLInstrument
+from harness.phases import PhaseEnergy
+from harness.warehouse import WarehouseSink
+from harness.repetition import AdaptiveRepetition
+from harness.quality import RunQuality
+from harness.references import HistoricalReferences
 from harness.database import (
     fetch_pdu_measurements,
+    fetch_pdu_measurements_batched,
     DATABASE_QUERY_ENABLED,
     BMCInstrument,
 )
@@ -10,10 +18,12 @@ from harness.base import SPEChpcBase
 from harness.frequency import (
     FrequencySweepAll,
     FrequencySweepChosen,
+    FrequencySweepBatched,
     FrequencyCPUGovenor,
 )
 
 from harness.powercap import PowercapSweepAll
+from harness.planner import FrequencyPowercapSweep
 
 # small
 
@@ -61,3 +71,29 @@ class build_Sph_Exa_t(build_SPEChpc_benchmark_Base):
 
 class build_Hpgmgfv_Exa_t(build_SPEChpc_benchmark_Base):
     spechpc_benchmark = "534.hpgmgfv_t"
+
+
+# suites
+
+
+TINY_BENCHMARKS = [
+    "505.lbm_t",
+    "513.soma_t",
+    "518.tealeaf_t",
+    "519.clvleaf_t",
+    "528.pot3d_t",
+    "532.sph_exa_t",
+    "534.hpgmgfv_t",
+    "535.weather_t",
+]
+
+
+class build_Tiny_suite(build_SPEChpc_suite_Base):
+    spechpc_benchmarks = TINY_BENCHMARKS
+    spechpc_additional_inputs = {
+        "505.lbm_t": ["control"],
+        "518.tealeaf_t": ["tea.in", "tea.problems"],
+        "519.clvleaf_t": ["clover.in"],
+        "528.pot3d_t": ["pot3d1.dat", "br_input_small.h5"],
+    }
+    spechpc_no_control_file = ["518.tealeaf_t", "519.clvleaf_t"]
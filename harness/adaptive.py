@@ -0,0 +1,430 @@
+"""
+Adaptive search for the frequency that minimises an objective (energy, EDP, or
+time under an energy budget) of a benchmark, running it one frequency at a
+time instead of sweeping every frequency of the partition.
+
+Usage:
+
+    python -m harness.adaptive --backend fake --partition icelake --objective edp
+
+    python -m harness.adaptive --backend reframe --partition icelake \\
+        --system csd3-power-scaling --test Lbm_t --checkpath spechpc.py
+
+The ReFrame backend selects a single variant of a `FrequencySweepAll` test per
+run, so any test using that mixin can be searched without changes.
+"""
+
+import os
+import sys
+import math
+import logging
+import argparse
+import tempfile
+import subprocess
+import collections
+
+import numpy as np
+
+from harness.frequency import partition_frequencies
+import harness.report as report
+
+logger = logging.getLogger(__name__)
+
+INVPHI = (math.sqrt(5) - 1) / 2
+
+# relative time penalty per unit of relative energy over the budget
+BUDGET_PENALTY = 10.0
+
+STRATEGIES = ("golden", "parabolic")
+
+Measurement = collections.namedtuple("Measurement", ["time", "energy"])
+"""
+The runtime in seconds and the total energy in joules of a single run.
+"""
+
+Evaluation = collections.namedtuple(
+    "Evaluation", ["frequency", "measurement", "objective"]
+)
+
+
+class SearchResult:
+    def __init__(self, best: Evaluation, evaluations: list):
+        self.best = best
+        # in the order they were run
+        self.evaluations = evaluations
+
+    @property
+    def num_runs(self) -> int:
+        return len(self.evaluations)
+
+
+def energy_objective(m: Measurement) -> float:
+    return m.energy
+
+
+def edp_objective(m: Measurement) -> float:
+    return m.energy * m.time
+
+
+def time_under_budget_objective(budget: float):
+    """
+    Minimise the runtime while keeping the energy below `budget` joules. Runs
+    over the budget are penalised in proportion to how far over they are, so
+    that the objective stays unimodal for the search.
+    """
+
+    def _objective(m: Measurement) -> float:
+        over = max(0.0, m.energy / budget - 1.0)
+        return m.time * (1.0 + BUDGET_PENALTY * over)
+
+    return _objective
+
+
+def make_objective(name: str, budget=None):
+    if name == "energy":
+        return energy_objective
+    if name == "edp":
+        return edp_objective
+    if name == "time_under_budget":
+        if budget is None:
+            raise ValueError("The time_under_budget objective needs a budget")
+        return time_under_budget_objective(budget)
+    raise ValueError(f"Unknown objective {name}")
+
+
+class _Evaluator:
+    # memoises the runs, since each one is a full benchmark job
+    def __init__(self, backend, frequencies, objective):
+        self.backend = backend
+        self.frequencies = frequencies
+        self.objective = objective
+        self.cache = {}
+        self.evaluations = []
+
+    def __call__(self, i: int) -> float:
+        if i not in self.cache:
+            f = self.frequencies[i]
+            logger.info("Running at %g MHz", f)
+            m = self.backend.run(f)
+            e = Evaluation(f, m, self.objective(m))
+            logger.info("%g MHz: %s, objective %g", f, m, e.objective)
+            self.cache[i] = e
+            self.evaluations.append(e)
+        return self.cache[i].objective
+
+    def best(self, lo: int = None, hi: int = None) -> Evaluation:
+        lo = 0 if lo is None else lo
+        hi = len(self.frequencies) - 1 if hi is None else hi
+        inside = [e for (i, e) in self.cache.items() if lo <= i <= hi]
+        return min(inside or self.cache.values(), key=lambda e: e.objective)
+
+
+def _golden(ev: _Evaluator, tolerance: float):
+    fs = ev.frequencies
+    a, b = 0, len(fs) - 1
+    c = b - round(INVPHI * (b - a))
+    d = a + round(INVPHI * (b - a))
+
+    # the interior points move on the index grid, so one of them is re-used in
+    # every iteration as in the continuous search
+    while fs[b] - fs[a] > tolerance:
+        if c >= d:
+            # too few grid points left for the interior points to move apart,
+            # so just run what is left
+            for i in range(a, b + 1):
+                ev(i)
+            break
+
+        if ev(c) <= ev(d):
+            b, d = d, c
+            c = b - round(INVPHI * (b - a))
+        else:
+            a, c = c, d
+            d = a + round(INVPHI * (b - a))
+
+    return ev.best(a, b)
+
+
+def _parabolic(ev: _Evaluator, tolerance: float):
+    fs = ev.frequencies
+    n = len(fs)
+    for i in (0, n // 2, n - 1):
+        ev(i)
+
+    def _settled(best: int, other: int) -> bool:
+        # whether every grid point between the two is within the tolerance
+        if other == best:
+            return True
+        inner = other + 1 if other < best else other - 1
+        return abs(fs[inner] - fs[best]) <= tolerance
+
+    while True:
+        points = sorted(ev.cache)
+        k = points.index(min(points, key=lambda i: ev.cache[i].objective))
+        best = points[k]
+        lo = points[max(k - 1, 0)]
+        hi = points[min(k + 1, len(points) - 1)]
+
+        # for a unimodal objective the optimum is between the runs either side
+        # of the best one, so stop once it cannot be further than the tolerance
+        if _settled(best, lo) and _settled(best, hi):
+            break
+
+        # fit the best point and its evaluated neighbours
+        k = min(max(k, 1), len(points) - 2)
+        idx = points[k - 1 : k + 2]
+
+        x = np.array([fs[i] for i in idx])
+        y = np.array([ev.cache[i].objective for i in idx])
+        a, b, _ = np.polyfit(x, y, 2)
+
+        if a > 0:
+            vertex = -b / (2 * a)
+        else:
+            # not convex here, so move towards the better end
+            vertex = x[np.argmin(y)]
+        vertex = np.clip(vertex, x[0], x[-1])
+
+        nearest = min(range(n), key=lambda i: abs(fs[i] - vertex))
+        if nearest in ev.cache:
+            # the model agrees with the runs so far, so close the bracket with
+            # the grid point next to the best one, on the side of the vertex
+            below = vertex < fs[best]
+            if _settled(best, hi) or (below and not _settled(best, lo)):
+                nearest = best - 1
+            else:
+                nearest = best + 1
+        ev(nearest)
+
+    return ev.best()
+
+
+def adaptive_search(
+    backend,
+    frequencies,
+    objective=energy_objective,
+    tolerance: float = 100.0,
+    strategy: str = "golden",
+) -> SearchResult:
+    """
+    Searches `frequencies` (in MHz) for the one that minimises `objective`,
+    assuming the objective is unimodal in the frequency. Each evaluation calls
+    `backend.run(frequency)`, which must return a `Measurement`.
+
+    The `golden` strategy is a golden-section search on the frequency grid,
+    which stops once the bracket is within `tolerance` MHz. The `parabolic`
+    strategy fits a parabola through the best point and its neighbours and
+    runs the grid point nearest the vertex, stopping once the grid points
+    between the best run and its neighbours are all within `tolerance` MHz of
+    it. It usually needs fewer runs, but only on smooth objectives (not
+    `time_under_budget`).
+    """
+    frequencies = sorted(set(frequencies))
+    if not frequencies:
+        raise ValueError("No frequencies to search")
+
+    ev = _Evaluator(backend, frequencies, objective)
+    if len(frequencies) < 3:
+        for i in range(len(frequencies)):
+            ev(i)
+        return SearchResult(ev.best(), ev.evaluations)
+
+    if strategy == "golden":
+        best = _golden(ev, tolerance)
+    elif strategy == "parabolic":
+        best = _parabolic(ev, tolerance)
+    else:
+        raise ValueError(f"Unknown strategy {strategy}")
+
+    return SearchResult(best, ev.evaluations)
+
+
+class FakeRunBackend:
+    """
+    An analytic model of a benchmark for testing the search without a cluster.
+
+    The runtime scales as `time * (compute / x + (1 - compute))` for relative
+    frequency `x`, and the power as `static + dynamic * x**3`, with optional
+    multiplicative Gaussian noise.
+    """
+
+    def __init__(
+        self,
+        max_frequency: float,
+        time: float = 100.0,
+        compute: float = 0.7,
+        static: float = 200.0,
+        dynamic: float = 250.0,
+        noise: float = 0.0,
+        seed=None,
+    ):
+        self.max_frequency = max_frequency
+        self.time = time
+        self.compute = compute
+        self.static = static
+        self.dynamic = dynamic
+        self.noise = noise
+        self.rng = np.random.default_rng(seed)
+        self.runs = []
+
+    def model(self, frequency: float) -> Measurement:
+        x = frequency / self.max_frequency
+        t = self.time * (self.compute / x + (1.0 - self.compute))
+        p = self.static + self.dynamic * x**3
+        return Measurement(t, p * t)
+
+    def run(self, frequency: float) -> Measurement:
+        m = self.model(frequency)
+        if self.noise > 0:
+            t, e = m.time, m.energy
+            t *= 1 + self.noise * self.rng.standard_normal()
+            e *= 1 + self.noise * self.rng.standard_normal()
+            m = Measurement(t, e)
+        self.runs.append(frequency)
+        return m
+
+
+class ReframeRunBackend:
+    """
+    Runs a single frequency of a `FrequencySweepAll` test with ReFrame, and
+    reads the runtime and total energy back from the run report.
+    """
+
+    def __init__(
+        self,
+        checkpath: str,
+        test_name: str,
+        system: str,
+        partition: str,
+        config: str = "system.py",
+        energy_source: str = "bmc",
+        time_key: str = "Core time",
+        reframe: str = "reframe",
+        reframe_args=None,
+    ):
+        self.checkpath = checkpath
+        self.test_name = test_name
+        self.system = system
+        self.partition = partition
+        self.config = config
+        self.energy_source = energy_source
+        self.time_key = time_key
+        self.reframe = reframe
+        self.reframe_args = reframe_args or []
+        self.frequencies = partition_frequencies(partition)
+
+    def _command(self, index: int, report_file: str) -> list:
+        return [
+            self.reframe,
+            "-C",
+            self.config,
+            "-c",
+            self.checkpath,
+            "--system",
+            f"{self.system}:{self.partition}",
+            "-n",
+            rf"^{self.test_name}%cpu_frequency_index={index}(?!\d)",
+            "--report-file",
+            report_file,
+            *self.reframe_args,
+            "-r",
+        ]
+
+    def run(self, frequency: float) -> Measurement:
+        index = self.frequencies.index(frequency)
+
+        with tempfile.TemporaryDirectory() as tmpdir:
+            report_file = os.path.join(tmpdir, "report.json")
+            cmd = self._command(index, report_file)
+            logger.debug("Running %s", " ".join(cmd))
+            proc = subprocess.run(cmd)
+
+            if not os.path.isfile(report_file):
+                raise RuntimeError(
+                    f"ReFrame did not write a report (exit code {proc.returncode})"
+                )
+            testcases = list(report.iter_testcases(report.load_report(report_file)))
+
+        if len(testcases) != 1:
+            raise RuntimeError(
+                f"Expected one successful test case at {frequency:g} MHz, got {len(testcases)}"
+            )
+
+        values = report.perf_values(testcases[0])
+        total = report.total_energy(values, self.energy_source)
+        if total is None:
+            raise RuntimeError(f"No {self.energy_source} energy in the report")
+
+        return Measurement(values[self.time_key], total)
+
+
+def _parse_args(argv):
+    parser = argparse.ArgumentParser(
+        prog="python -m harness.adaptive",
+        description="Search for the optimal CPU frequency of a benchmark.",
+    )
+    parser.add_argument("--backend", choices=("fake", "reframe"), default="fake")
+    parser.add_argument("--partition", required=True)
+    parser.add_argument(
+        "--objective", choices=("energy", "edp", "time_under_budget"), default="energy"
+    )
+    parser.add_argument("--budget", type=float, help="energy budget in joules")
+    parser.add_argument("--strategy", choices=STRATEGIES, default="golden")
+    parser.add_argument(
+        "--tolerance", type=float, default=100.0, help="in MHz (default: 100)"
+    )
+    # reframe backend
+    parser.add_argument("--system")
+    parser.add_argument("--test")
+    parser.add_argument("--checkpath", default="spechpc.py")
+    parser.add_argument("--config", default="system.py")
+    parser.add_argument("--energy-source", choices=report.ENERGY_SOURCES, default="bmc")
+    # fake backend
+    parser.add_argument("--noise", type=float, default=0.0)
+    parser.add_argument("--seed", type=int)
+    parser.add_argument(
+        "reframe_args", nargs="*", help="passed on to reframe (after `--`)"
+    )
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = _parse_args(argv)
+    logging.basicConfig(level=logging.INFO)
+
+    frequencies = partition_frequencies(args.partition)
+    objective = make_objective(args.objective, args.budget)
+
+    if args.backend == "fake":
+        backend = FakeRunBackend(max(frequencies), noise=args.noise, seed=args.seed)
+    else:
+        if not (args.system and args.test):
+            raise SystemExit("The reframe backend needs --system and --test")
+        backend = ReframeRunBackend(
+            args.checkpath,
+            args.test,
+            args.system,
+            args.partition,
+            config=args.config,
+            energy_source=args.energy_source,
+            reframe_args=args.reframe_args,
+        )
+
+    result = adaptive_search(
+        backend, frequencies, objective, args.tolerance, args.strategy
+    )
+
+    print(f"{'MHz':>8} {'time / s':>12} {'energy / J':>14} {'objective':>14}")
+    for e in result.evaluations:
+        print(
+            f"{e.frequency:>8g} {e.measurement.time:>12.3f}"
+            f" {e.measurement.energy:>14.1f} {e.objective:>14.6g}"
+        )
+    print(
+        f"Best: {result.best.frequency:g} MHz after {result.num_runs}"
+        f" of {len(frequencies)} runs"
+    )
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,3 +1,4 @@
+import os
 import logging
 
 import reframe as rfm
@@ -9,12 +10,19 @@ import numpy as np
 
 import harness
 import harness.utils as utils
+from harness.timeseries import TimeSeriesStore
 
 logger = logging.getLogger(__name__)
 
 
+# `packed` is the `npz` layout with every array losslessly compressed
+TIME_SERIES_FORMATS = {"npz": ".npz", "packed": ".packed.npz", "parquet": ".parquet"}
+
+
 class SPEChpcBase(rfm.RunOnlyRegressionTest):
-    time_series = variable(dict, value={})
+    time_series = variable(TimeSeriesStore, value=TimeSeriesStore())
+    # one of `TIME_SERIES_FORMATS`, or empty to not export the time series
+    time_series_format = variable(str, value="npz")
 
     valid_systems = ["*"]
     valid_prog_environs = ["*"]
@@ -30,27 +38,44 @@ class SPEChpcBase(rfm.RunOnlyRegressionTest):
     # the output file path needed to test the sanity of the benchmark run
     spectimes_path = "spectimes.txt"
 
+    # when the `spechpc_binary` fixture is a suite build, the benchmark to run
+    spechpc_benchmark = variable(str, type(None), value=None)
+
+    def spechpc_build(self):
+        """
+        Returns the build products of the benchmark, from either a single
+        benchmark or a suite build fixture.
+        """
+        if self.spechpc_benchmark:
+            return self.spechpc_binary.binary(self.spechpc_benchmark)
+        return self.spechpc_binary
+
     @blt.run_before("run")
     def configure_pre_post_commands(self):
+        build = self.spechpc_build()
+
         # learn things about the partition we're running on
-        self.num_tasks = self.spechpc_binary.num_runtime_ranks
+        # the binary may be shared between node counts, so the ranks come
+        # from this test rather than from the build
+        # TODO: currently assume the ranks are fully allocated across the nodes
+        self.num_tasks = self.current_partition.processor.num_cpus * self.num_nodes
+        build.check_num_ranks(self.num_tasks)
         self.partition_name = self.current_partition.name
 
-        self.executable = self.spechpc_binary.executable
+        self.executable = build.executable
         self.prerun_cmds = [
             # fetch the executable from the fixture
-            f"cp {self.spechpc_binary.executable_path} {self.executable}",
+            f"cp {build.executable_path} {self.executable}",
         ]
 
         # copy over possible additional files
         self.prerun_cmds += [
-            f"cp {self.spechpc_binary.relpath(f)} {f}"
-            for f in self.spechpc_binary.additional_inputs
+            f"cp {build.relpath(f)} {f}" for f in build.additional_inputs
         ]
 
         if not self.executable_opts:
             # read the executable args from the build directory
-            self.executable_opts = self.spechpc_binary.read_executable_opts()
+            self.executable_opts = build.read_executable_opts(self.num_tasks)
 
         # get a rough start time estimate. may be refined later
         self.job_start_time = utils.time_now(True)
@@ -71,6 +96,28 @@ class SPEChpcBase(rfm.RunOnlyRegressionTest):
             "Total time": self.extract_spechpc_time("Total time"),
         }
 
+    @blt.run_after("performance")
+    def export_time_series(self):
+        if (not self.time_series_format) or (len(self.time_series) == 0):
+            return
+
+        if self.time_series_format not in TIME_SERIES_FORMATS:
+            raise ValueError(f"Unknown time series format {self.time_series_format}")
+
+        filename = "time_series" + TIME_SERIES_FORMATS[self.time_series_format]
+        path = os.path.join(self.stagedir, filename)
+        logger.debug("Exporting time series to %s", path)
+
+        if self.time_series_format == "parquet":
+            self.time_series.to_parquet(path)
+        elif self.time_series_format == "packed":
+            self.time_series.to_packed(path)
+        else:
+            self.time_series.to_npz(path)
+
+        # copied to the output directory alongside the report
+        self.keep_files.append(filename)
+
     @blt.sanity_function
     def assert_passed(self):
         return sn.assert_found(r"Verification: PASSED", self.spectimes_path)
@@ -1,8 +1,10 @@
 import os
 import logging
 import pathlib
+import hashlib
 
 import reframe.utility.typecheck as typ
+import reframe.utility.osext as osext
 
 import reframe as rfm
 import reframe.core.builtins as blt
@@ -17,6 +19,108 @@ GENERATED_CONFIG_NAME = "spechpc_config.cfg"
 GENERATED_CONFIG_IN = "spechpc_config.cfg.in"
 CONTORL_FILENAME = "control"
 
+# name of the per-build SPEChpc tree in the stage directory
+ISOLATED_TREE_NAME = "spechpc"
+# lock file of a SPEChpc tree that builds write into, i.e. the per-partition
+# trees of `spechpc_isolated_tree = False`, named by the hash of its path.
+# cloning only reads the shared installation, which nothing writes into, so
+# takes no lock. the locks are kept in the build cache or next to the stage
+# directories, so the SPEChpc installations do not need to be writable
+SPECHPC_LOCK_FORMAT = ".srfm.{}.lock"
+SPECHPC_LOCK_FD = 9
+# parts of the tree that `runhpc` and `specmake` create or write into, and
+# which therefore may never be shared between builds
+PRIVATE_TREE_PATHS = [
+    "config",
+    "result",
+    "tmp",
+    "benchspec/HPC/*/build",
+    "benchspec/HPC/*/run",
+    "benchspec/HPC/*/exe",
+]
+# parts of the tree that `runhpc` may rewrite in place, which are copied into
+# the clone rather than hardlinked, so that the writes do not go through to
+# the shared tree
+COPIED_TREE_PATHS = ["config", "bin", "shrc", "cshrc"]
+
+# written into the stage directory, with the define that matched, if the build
+# configuration bakes the number of ranks into the binary, in which case it may
+# not be re-used for other rank counts
+RANK_DEPENDENT_MARKER = "rank_dependent"
+# sub-directory of the stage directory holding the control file set up for
+# another number of ranks
+RANKS_DIR_FORMAT = "ranks.{}"
+
+# persistent cache of build products, shared between reframe sessions
+SRFM_BUILD_CACHE_DIR = os.environ.get("SRFM_BUILD_CACHE_DIR", None)
+# written last into a cache entry, so that partial entries are never used
+BUILD_CACHE_COMPLETE = ".complete"
+# shell variable of the build script holding the cache entry
+BUILD_CACHE_ENTRY_VAR = "SRFM_BUILD_CACHE_ENTRY"
+
+if SRFM_BUILD_CACHE_DIR:
+    logger.info("Using SPEChpc build cache in %s", SRFM_BUILD_CACHE_DIR)
+
+
+def check_num_ranks(
+    benchmark: str,
+    stagedir: str,
+    built_ranks: int,
+    reuse_ranks: typ.List[int],
+    num_ranks: int,
+):
+    """
+    Raises a `ValueError` unless a binary built for `built_ranks` may be run
+    with `num_ranks`. Other rank counts have to be declared on the build in
+    `reuse_ranks`, and the build must not have found the number of ranks in
+    the generated flags.
+    """
+    if num_ranks == built_ranks:
+        return
+
+    if num_ranks not in reuse_ranks:
+        raise ValueError(
+            f"{benchmark} was built for {built_ranks} ranks and is not declared"
+            f" rank-independent for {num_ranks} ranks. Add the number of nodes"
+            " to `spechpc_reuse_num_nodes` on the build, or set"
+            " `spechpc_num_nodes`."
+        )
+
+    marker = os.path.join(stagedir, RANK_DEPENDENT_MARKER)
+    if os.path.isfile(marker):
+        define = pathlib.Path(marker).read_text().strip()
+        raise ValueError(
+            f"{benchmark} is declared rank-independent, but its Makefile.spec"
+            f" defines {define}, so it needs the number of ranks at compile time"
+        )
+
+    logger.info(
+        "Re-using %s built for %d ranks with %d ranks: declared in"
+        " `spechpc_reuse_num_nodes`, and no rank define in Makefile.spec",
+        benchmark,
+        built_ranks,
+        num_ranks,
+    )
+
+
+def read_control_file(directory: str) -> typ.List[str]:
+    """
+    Reads the executable's default arguments from the SPEChpc generated
+    control file in `directory`.
+    """
+    cmdpath = os.path.join(directory, CONTORL_FILENAME)
+    logger.debug("Reading SPEChpc benchmark arguments from file: %s", cmdpath)
+
+    exec_opts = pathlib.Path(cmdpath).read_text().split()
+    # some of the benchmarks include comments in their default
+    # arguments, so here we just trim at the first comment to make this work
+    if "#" in exec_opts:
+        logger.debug("Trimming comments from executable arguments")
+        exec_opts = exec_opts[0 : exec_opts.index("#")]
+
+    logger.debug("Arguments read: %s", exec_opts)
+    return exec_opts
+
 
 class SPEChpcBuild(BuildSystem):
     """
@@ -36,9 +140,17 @@ class SPEChpcBuild(BuildSystem):
     spechpc_flags = variable(typ.List[str], value=["--fake", "--loose"])
     spechpc_benchmark = variable(str)
     partition_name = variable(str)
+    # the partition and modules of the build, as the binaries are built for
+    # the CPU of the build node (`-xHOST`) and with the loaded compilers
+    partition_fullname = variable(str, type(None), value=None)
+    build_modules = variable(typ.List[str], value=[])
+    # other numbers of ranks the binary is re-used for, whose control files are
+    # set up as part of the build
+    spechpc_reuse_ranks = variable(typ.List[int], value=[])
 
     use_control_file: bool = True
     additional_inputs = None
+    isolated_tree: bool = True
 
     """
     The absolute path of the stage directory. Must be set before the compile
@@ -74,6 +186,16 @@ class SPEChpcBuild(BuildSystem):
                 " `build_system.executable = name`"
             )
 
+    def _compilers(self, environ) -> typ.List[str]:
+        # get the compilers from the environment
+
+        # todo: let reframe pick the defaults!
+        return [
+            self._cc(environ) or "mpiicc",
+            self._cxx(environ) or "mpiicpc",
+            self._ftn(environ) or "mpiifort",
+        ]
+
     def _generate_spechpc_config(self, environ) -> str:
         """
         Returns the relative path to generated config file in the staging
@@ -82,13 +204,7 @@ class SPEChpcBuild(BuildSystem):
         config_path_in = os.path.join(self.stagedir, GENERATED_CONFIG_IN)
         config_path_out = os.path.join(".", GENERATED_CONFIG_NAME)
 
-        # get the compilers from the environment
-
-        # todo: let reframe pick the defaults!
-
-        cc = self._cc(environ) or "mpiicc"
-        cxx = self._cxx(environ) or "mpiicpc"
-        fcn = self._ftn(environ) or "mpiifort"
+        cc, cxx, fcn = self._compilers(environ)
 
         # read the template
         content_in = pathlib.Path(config_path_in).read_text()
@@ -103,26 +219,116 @@ class SPEChpcBuild(BuildSystem):
         pathlib.Path(config_path_out).write_text(content_out)
         return config_path_out
 
-    def _create_spechpc_build_command(self) -> str:
+    def _benchmarks(self) -> typ.List[str]:
+        return [self.spechpc_benchmark]
+
+    def _create_spechpc_build_command(self, benchmarks=None, num_ranks=None) -> str:
         cmd = ["runhpc"]
         cmd += self.spechpc_flags
         cmd += ["--size", "ref"]
         cmd += ["--tune", self.spechpc_tune]
         cmd += ["--config", self.spechpc_config]
-        cmd += ["--ranks", str(self.spechpc_num_ranks)]
-        cmd += [self.spechpc_benchmark]
+        cmd += ["--ranks", str(num_ranks or self.spechpc_num_ranks)]
+        cmd += benchmarks or self._benchmarks()
         return " ".join(cmd)
 
+    def _detect_rank_dependence(self, marker_dir: str) -> str:
+        """
+        Must be run from the benchmark build directory. The only way for the
+        number of ranks to end up in the binary is through a preprocessor
+        define in the generated flags, so look for one and keep it in the
+        marker.
+        """
+        marker = os.path.join(marker_dir, RANK_DEPENDENT_MARKER)
+        return (
+            f'grep -o -E -- "-D[A-Za-z0-9_]+={self.spechpc_num_ranks}\\b"'
+            f' Makefile.spec > "{marker}" || rm -f "{marker}"'
+        )
+
+    def _reuse_ranks_cmds(
+        self, tree: str, benchmark: str, outdir: str
+    ) -> typ.List[str]:
+        """
+        Commands that set up the benchmark in `tree` for each of the other
+        numbers of ranks, without compiling it, and copy the control files
+        to `RANKS_DIR_FORMAT` in `outdir`. Run in the build job, which has
+        the tree to itself.
+        """
+        run_dir = os.path.join(tree, "benchspec", "HPC", benchmark, "run")
+        cmds = []
+        for num_ranks in self.spechpc_reuse_ranks:
+            ranks_dir = os.path.join(outdir, RANKS_DIR_FORMAT.format(num_ranks))
+            cmds += [
+                f'cd "{tree}"',
+                # so that the run directory set up next is the only one
+                f'rm -rf "{run_dir}"',
+                self._create_spechpc_build_command([benchmark], num_ranks),
+                f'cd "{run_dir}"/run_*',
+                f'mkdir -p "{ranks_dir}"',
+                f'cp "{CONTORL_FILENAME}" "{ranks_dir}"',
+            ]
+        return cmds
+
     def _create_benchmark_build_dir(self) -> str:
         return os.path.join("benchspec", "HPC", self.spechpc_benchmark, "build")
 
+    def _lock_cmd(self, tree: str, mode: str) -> typ.List[str]:
+        lock_dir = SRFM_BUILD_CACHE_DIR or os.path.dirname(self.stagedir)
+        name = hashlib.sha256(os.path.realpath(tree).encode()).hexdigest()[:16]
+        lock_path = os.path.join(lock_dir, SPECHPC_LOCK_FORMAT.format(name))
+        return [
+            f'mkdir -p "{lock_dir}"',
+            f'exec {SPECHPC_LOCK_FD}>"{lock_path}"',
+            f"flock {mode} {SPECHPC_LOCK_FD}",
+        ]
+
+    def _unlock_cmd(self) -> typ.List[str]:
+        return [
+            f"flock --unlock {SPECHPC_LOCK_FD}",
+            f"exec {SPECHPC_LOCK_FD}>&-",
+        ]
+
+    def _clone_spechpc_tree(self, tree: str) -> typ.List[str]:
+        """
+        Clones the shared SPEChpc tree into the stage directory for this build
+        alone. Files are hardlinked where possible (falling back to reflink or
+        plain copies across filesystems). The parts that the build writes into
+        are removed, and the parts that `runhpc` may rewrite are replaced with
+        copies, so builds can run concurrently without touching the shared
+        tree.
+        """
+        private = " ".join(f'"{tree}"/{p}' for p in PRIVATE_TREE_PATHS)
+        copied = " ".join(COPIED_TREE_PATHS)
+        return [
+            f'rm -rf "{tree}"',
+            f'cp -al "{self.spechpc_dir}" "{tree}"'
+            f' || {{ rm -rf "{tree}" && cp -a --reflink=auto "{self.spechpc_dir}" "{tree}"; }}',
+            # unlink the private parts before anything can write through the
+            # hardlinks into the shared tree
+            f"rm -rf {private}",
+            f"for p in {copied}; do"
+            f' if [ -e "{self.spechpc_dir}/$p" ]; then'
+            f' rm -rf "{tree}/$p"'
+            f' && cp -a --reflink=auto "{self.spechpc_dir}/$p" "{tree}/$p"; fi; done',
+            f'mkdir -p "{tree}/config" "{tree}/result" "{tree}/tmp"',
+        ]
+
     def _setup_spechpc(self) -> typ.List[str]:
-        # each partition gets its own SPEChpc directory to avoid
-        # concurrency issues
-        spechpc_src_dir = self.spechpc_dir + "_" + self.partition_name
+        comp_step = []
+
+        if self.isolated_tree:
+            # each build gets its own SPEChpc directory
+            spechpc_src_dir = os.path.join(self.stagedir, ISOLATED_TREE_NAME)
+            comp_step += self._clone_spechpc_tree(spechpc_src_dir)
+        else:
+            # each partition gets its own SPEChpc directory, and builds within
+            # it are serialised
+            spechpc_src_dir = self.spechpc_dir + "_" + self.partition_name
+            comp_step += self._lock_cmd(spechpc_src_dir, "--exclusive")
+
         config_dir = os.path.join(spechpc_src_dir, "config")
 
-        comp_step = [
+        comp_step += [
             # copy over the configuration
             f'cp "{self.spechpc_config}" "{config_dir}"',
             # change to the spechpc directory
@@ -138,6 +344,7 @@ class SPEChpcBuild(BuildSystem):
             'cd "$BUILD_DIR"',
             # save the identifier for later
             "RUNID=$(basename $(pwd) | cut -d. -f2)",
+            self._detect_rank_dependence(self.stagedir),
             # do the build
             "specmake",
             # copy the binary back
@@ -154,13 +361,99 @@ class SPEChpcBuild(BuildSystem):
         if self.additional_inputs:
             comp_step += [f'cp "{f}" "{self.stagedir}"' for f in self.additional_inputs]
 
+        if self.use_control_file:
+            comp_step += self._reuse_ranks_cmds(
+                spechpc_src_dir, self.spechpc_benchmark, self.stagedir
+            )
+
         comp_step += [
             # finally, return to staging dir
             f'cd "{self.stagedir}"',
         ]
 
+        if not self.isolated_tree:
+            comp_step += self._unlock_cmd()
+
         return comp_step
 
+    def _build_products(self) -> typ.List[str]:
+        products = [self.executable]
+        if self.use_control_file:
+            products.append(CONTORL_FILENAME)
+            products += [
+                os.path.join(RANKS_DIR_FORMAT.format(n), CONTORL_FILENAME)
+                for n in self.spechpc_reuse_ranks
+            ]
+        if self.additional_inputs:
+            products += self.additional_inputs
+        return products
+
+    def _build_cache_key(self, environ) -> str:
+        """
+        Hash of everything that goes into the build products that is known
+        before the build: the contents of the SPEChpc configuration, the inputs
+        to `runhpc`, the SPEChpc installation, the partition built for, and the
+        modules and variables of the environment. The versions of the
+        compilers are only known once the modules are loaded, so they are
+        added to the key by the build script (see `_cache_entry_cmd`).
+        """
+        h = hashlib.sha256()
+        h.update(pathlib.Path(self.spechpc_config).read_bytes())
+
+        inputs = [
+            self.spechpc_benchmark,
+            self.partition_fullname or self.partition_name,
+            os.path.realpath(self.spechpc_dir),
+            *self.build_modules,
+            *environ.modules,
+            *(f"{k}={v}" for (k, v) in sorted(environ.env_vars.items())),
+            *self._compilers(environ),
+            str(self.spechpc_num_ranks),
+            *(str(n) for n in self.spechpc_reuse_ranks),
+            self.spechpc_tune,
+            *self.spechpc_flags,
+            *self._build_products(),
+        ]
+        for i in inputs:
+            h.update(b"\0" + i.encode())
+
+        return h.hexdigest()
+
+    def _cache_entry_cmd(self, environ) -> str:
+        # the compilers report the versions of whatever modules are loaded, so
+        # a module update is a cache miss
+        versions = "; ".join(f"{c} --version" for c in self._compilers(environ))
+        key = self._build_cache_key(environ)
+        return (
+            f'{BUILD_CACHE_ENTRY_VAR}="{SRFM_BUILD_CACHE_DIR}/{key}-'
+            f'$({{ {versions}; }} 2>&1 | sha256sum | cut -c 1-16)"'
+        )
+
+    def _restore_from_cache(self, entry: str) -> typ.List[str]:
+        return [
+            f'echo "Restoring {self.spechpc_benchmark} from build cache {entry}"',
+            # the products keep their paths relative to the entry
+            f'cd "{entry}"',
+            *[f'cp --parents "{f}" "{self.stagedir}"' for f in self._build_products()],
+            f'if [ -f "{os.path.join(entry, RANK_DEPENDENT_MARKER)}" ]; then'
+            f' cp "{os.path.join(entry, RANK_DEPENDENT_MARKER)}" "{self.stagedir}"; fi',
+            f'cd "{self.stagedir}"',
+        ]
+
+    def _populate_cache(self, entry: str) -> typ.List[str]:
+        return [
+            f'mkdir -p "{SRFM_BUILD_CACHE_DIR}"',
+            # stage into a temporary directory and rename, so concurrent
+            # builds of the same key never see a partial entry
+            f'CACHE_TMP="$(mktemp -d "{SRFM_BUILD_CACHE_DIR}/.tmp.XXXXXX")"',
+            *[f'cp --parents "{f}" "$CACHE_TMP"' for f in self._build_products()],
+            f'if [ -f "{RANK_DEPENDENT_MARKER}" ]; then'
+            f' cp "{RANK_DEPENDENT_MARKER}" "$CACHE_TMP"; fi',
+            f'touch "$CACHE_TMP/{BUILD_CACHE_COMPLETE}"',
+            # if someone else got there first, theirs is just as good
+            f'mv -T "$CACHE_TMP" "{entry}" 2>/dev/null || rm -rf "$CACHE_TMP"',
+        ]
+
     def emit_build_commands(self, environ):
         self._check_preconditions()
 
@@ -168,7 +461,22 @@ class SPEChpcBuild(BuildSystem):
             logger.debug("Generating SPEChpc configuration from system environment")
             self.spechpc_config = self._generate_spechpc_config(environ)
 
-        return self._setup_spechpc()
+        if not SRFM_BUILD_CACHE_DIR:
+            return self._setup_spechpc()
+
+        # whether the entry exists is only known once the build script has
+        # read the compiler versions
+        entry = f"${BUILD_CACHE_ENTRY_VAR}"
+        return [
+            self._cache_entry_cmd(environ),
+            f'if [ -f "{os.path.join(entry, BUILD_CACHE_COMPLETE)}" ]; then',
+            *self._restore_from_cache(entry),
+            "else",
+            f'echo "Build cache miss for {self.spechpc_benchmark}: {entry}"',
+            *self._setup_spechpc(),
+            *self._populate_cache(entry),
+            "fi",
+        ]
 
 
 class build_SPEChpc_benchmark_Base(rfm.CompileOnlyRegressionTest):
@@ -184,6 +492,13 @@ class build_SPEChpc_benchmark_Base(rfm.CompileOnlyRegressionTest):
     additional_inputs = variable(typ.List[str], value=[])
     use_control_file = variable(bool, value=True)
     spechpc_num_nodes = variable(int, value=1)
+    # other numbers of nodes the binary is re-used for, which declares that the
+    # build does not depend on the number of ranks. otherwise the run tests
+    # must have `spechpc_num_nodes` nodes
+    spechpc_reuse_num_nodes = variable(typ.List[int], value=[])
+    # build in a private clone of the SPEChpc tree, so that builds may run
+    # concurrently. otherwise builds share one tree per partition
+    spechpc_isolated_tree = variable(bool, value=True)
 
     @blt.run_before("compile")
     def set_build_variables(self):
@@ -196,19 +511,30 @@ class build_SPEChpc_benchmark_Base(rfm.CompileOnlyRegressionTest):
         # build system needs some additional info that reframe doesnt pass by
         # default
         self.build_system.spechpc_dir = self.spechpc_dir
-        # apparently SPEChpc needs to know the ranks at compile time
-        # so lets make sure that's known
+        # SPEChpc needs to know the ranks when setting up the build, though only
+        # few configurations bake them into the binary. the binary is only
+        # re-used for the other node counts declared on the build, and the
+        # control files for those are set up by the build too (see
+        # `check_num_ranks`)
         # TODO: currently assume the ranks are fully allocated across the nodes
-        self.num_runtime_ranks = (
-            self.current_partition.processor.num_cpus * self.spechpc_num_nodes
-        )
+        num_cpus = self.current_partition.processor.num_cpus
+        self.num_runtime_ranks = num_cpus * self.spechpc_num_nodes
+        self.reuse_ranks = [
+            num_cpus * n
+            for n in self.spechpc_reuse_num_nodes
+            if n != self.spechpc_num_nodes
+        ]
         self.build_system.spechpc_num_ranks = self.num_runtime_ranks
+        self.build_system.spechpc_reuse_ranks = self.reuse_ranks
         self.build_system.partition_name = self.current_partition.name
+        self.build_system.partition_fullname = self.current_partition.fullname
+        self.build_system.build_modules = list(self.modules)
         self.build_system.executable = self.executable
         self.build_system.stagedir = self.stagedir
         self.build_system.spechpc_benchmark = self.spechpc_benchmark
         self.build_system.additional_inputs = self.additional_inputs
         self.build_system.use_control_file = self.use_control_file
+        self.build_system.isolated_tree = self.spechpc_isolated_tree
 
     @blt.sanity_function
     def validate_build(self):
@@ -222,24 +548,24 @@ class build_SPEChpc_benchmark_Base(rfm.CompileOnlyRegressionTest):
     def relpath(self, path):
         return os.path.join(self.stagedir, path)
 
-    def read_executable_opts(self) -> typ.List[str]:
+    def check_num_ranks(self, num_ranks: int):
+        check_num_ranks(
+            self.spechpc_benchmark,
+            self.stagedir,
+            self.num_runtime_ranks,
+            self.reuse_ranks,
+            num_ranks,
+        )
+
+    def read_executable_opts(self, num_ranks=None) -> typ.List[str]:
         """
         Reads the executable's default arguments from the SPEChpc generated
-        control file.
+        control file, which the build set up for each number of ranks.
         """
         if not self.use_control_file:
             # no arguments
             return []
 
-        cmdpath = os.path.join(self.stagedir, CONTORL_FILENAME)
-        logger.debug("Reading SPEChpc benchmark arguments from file: %s", cmdpath)
-
-        exec_opts = pathlib.Path(cmdpath).read_text().split()
-        # some of the benchmarks include comments in their default
-        # arguments, so here we just trim at the first comment to make this work
-        if "#" in exec_opts:
-            logger.debug("Trimming comments from executable arguments")
-            exec_opts = exec_opts[0 : exec_opts.index("#")]
-
-        logger.debug("Arguments read: %s", exec_opts)
-        return exec_opts
+        if (num_ranks is None) or (num_ranks == self.num_runtime_ranks):
+            return read_control_file(self.stagedir)
+        return read_control_file(self.relpath(RANKS_DIR_FORMAT.format(num_ranks)))
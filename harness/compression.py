@@ -0,0 +1,80 @@
+import zlib
+import struct
+
+import numpy as np
+
+# arrays are self-describing: a header, then the zlib compressed byte planes
+HEADER = struct.Struct("<4sBBQ")
+HEADER_MAGIC = b"SRTS"
+HEADER_VERSION = 1
+
+# XOR of each value with the previous one, for measurements, which change
+# slowly so that successive values share their sign, exponent and leading
+# mantissa bits
+CODEC_XOR = 1
+# second differences of the bit patterns, for timestamps, which are evenly
+# spaced so that these are almost all zero
+CODEC_DELTA2 = 2
+
+DEFAULT_LEVEL = 6
+
+
+def _transform(bits: np.array, codec: int) -> np.array:
+    # the arithmetic wraps around, so every step is exactly invertible
+    if codec == CODEC_XOR:
+        out = bits.copy()
+        out[1:] ^= bits[:-1]
+        return out
+    if codec == CODEC_DELTA2:
+        signed = bits.view(np.int64)
+        delta = np.diff(signed, prepend=np.int64(0))
+        return np.diff(delta, prepend=np.int64(0)).view(np.uint64)
+    raise ValueError(f"Unknown codec {codec}")
+
+
+def _inverse(bits: np.array, codec: int) -> np.array:
+    if codec == CODEC_XOR:
+        return np.bitwise_xor.accumulate(bits)
+    if codec == CODEC_DELTA2:
+        return np.cumsum(np.cumsum(bits, dtype=np.uint64), dtype=np.uint64)
+    raise ValueError(f"Unknown codec {codec}")
+
+
+def encode(values, codec: int = CODEC_XOR, level: int = DEFAULT_LEVEL) -> bytes:
+    """
+    Compresses a float64 array losslessly, bit for bit including NaNs. The
+    values are transformed by `codec`, and the bytes of the result are
+    regrouped so that the nth byte of every value is stored together before
+    being compressed with zlib, as the high bytes are then mostly zero.
+    """
+    values = np.ascontiguousarray(values, dtype=np.float64)
+    bits = _transform(values.view(np.uint64), codec)
+    planes = bits.view(np.uint8).reshape(-1, 8).T
+    header = HEADER.pack(HEADER_MAGIC, HEADER_VERSION, codec, len(values))
+    return header + zlib.compress(planes.tobytes(), level)
+
+
+def decode(data) -> np.array:
+    """
+    Reverses `encode`.
+    """
+    data = bytes(data)
+    magic, version, codec, count = HEADER.unpack_from(data, 0)
+    if magic != HEADER_MAGIC or version != HEADER_VERSION:
+        raise ValueError("Not an encoded time series")
+
+    planes = np.frombuffer(zlib.decompress(data[HEADER.size :]), dtype=np.uint8)
+    bits = planes.reshape(8, count).T.copy().view(np.uint64).ravel()
+    return _inverse(bits, codec).view(np.float64)
+
+
+def is_encoded(a: np.array) -> bool:
+    """
+    Whether an array, e.g. from an `.npz` file, holds an encoded time series.
+    """
+    return (
+        a.dtype == np.uint8
+        and a.ndim == 1
+        and len(a) >= HEADER.size
+        and a[:4].tobytes() == HEADER_MAGIC
+    )
@@ -0,0 +1,154 @@
+"""
+Decides whether a test has been repeated enough, from the SPEChpc times (and
+optionally the RAPL energies) of the repetitions so far. Run inside the job
+after every repetition, so it only uses the standard library and does not
+import the rest of the harness.
+
+Usage:
+
+    python3 converge.py --spectimes 'spectimes.rep*.txt' --target 0.02 \\
+        [--energies rapl_reads.txt] [--min-repeats 3] [--max-repeats 10]
+
+Exits with 0 once the relative half-width of the confidence interval of the
+mean Core time (and energy) is below `--target`, or `--max-repeats` is
+reached, and with 1 while more repetitions are needed. Exits with 2 if
+`--energies` is given but there are no energies, e.g. the counters could not
+be read, rather than converging on the times alone.
+"""
+
+import re
+import sys
+import glob
+import math
+import argparse
+import statistics
+
+DEFAULT_CONFIDENCE = 0.95
+# the repetition number in the spectimes file names
+REPETITION_REGEX = re.compile(r"(\d+)\D*$")
+
+
+def t_quantile(p: float, df: int) -> float:
+    """
+    Quantile of Student's t distribution with `df` degrees of freedom. Exact
+    for one and two degrees of freedom, otherwise the Cornish-Fisher expansion
+    about the normal quantile (Abramowitz & Stegun 26.7.5), which is good to a
+    few parts in a thousand for the confidence levels used here.
+    """
+    if df < 1:
+        raise ValueError("Need at least one degree of freedom")
+    if df == 1:
+        return math.tan(math.pi * (p - 0.5))
+    if df == 2:
+        return (2 * p - 1) / math.sqrt(2 * p * (1 - p))
+
+    z = statistics.NormalDist().inv_cdf(p)
+    g1 = (z**3 + z) / 4
+    g2 = (5 * z**5 + 16 * z**3 + 3 * z) / 96
+    g3 = (3 * z**7 + 19 * z**5 + 17 * z**3 - 15 * z) / 384
+    g4 = (79 * z**9 + 776 * z**7 + 1482 * z**5 - 1920 * z**3 - 945 * z) / 92160
+    return z + g1 / df + g2 / df**2 + g3 / df**3 + g4 / df**4
+
+
+def relative_half_width(samples: list, confidence: float = DEFAULT_CONFIDENCE):
+    """
+    The half-width of the confidence interval of the mean relative to the
+    mean, which is infinite for fewer than two samples.
+    """
+    if len(samples) < 2:
+        return math.inf
+    mean = statistics.fmean(samples)
+    sem = statistics.stdev(samples) / math.sqrt(len(samples))
+    half_width = t_quantile(0.5 + confidence / 2, len(samples) - 1) * sem
+    return half_width / abs(mean) if mean else math.inf
+
+
+def read_times(pattern: str, key: str = "Core time") -> list:
+    """
+    The `key` time of each spectimes file matching `pattern`, in the order of
+    the repetitions.
+    """
+
+    def _repetition(path):
+        match = REPETITION_REGEX.search(path)
+        return int(match.group(1)) if match else -1
+
+    times = []
+    regex = re.compile(rf"{key}:\s+(\S+)")
+    for path in sorted(glob.glob(pattern), key=_repetition):
+        with open(path) as f:
+            match = regex.search(f.read())
+        if match:
+            times.append(float(match.group(1)))
+    return times
+
+
+def read_energies(path: str) -> list:
+    """
+    The energy in joules of each repetition from the counters written by
+    `rapl.py read` before and after it, summed over the domains.
+    """
+    with open(path) as f:
+        reads = [
+            [int(float(v)) for v in line.split()[1:]] for line in f if line.strip()
+        ]
+
+    energies = []
+    for before, after in zip(reads[0::2], reads[1::2]):
+        total = 0
+        for i in range(0, len(before), 2):
+            delta = after[i] - before[i]
+            if delta < 0:
+                delta += before[i + 1]
+            total += delta
+        energies.append(total / 1e6)
+    return energies
+
+
+def _log(msg: str):
+    print(f"converge.py: {msg}", file=sys.stderr)
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(
+        prog="converge.py", description=__doc__.split("\n\n")[0]
+    )
+    parser.add_argument("--spectimes", required=True, help="glob of the times")
+    parser.add_argument("--key", default="Core time")
+    parser.add_argument("--energies", help="as written by `rapl.py read`")
+    parser.add_argument(
+        "--target", type=float, default=0.02, help="relative CI half-width"
+    )
+    parser.add_argument("--confidence", type=float, default=DEFAULT_CONFIDENCE)
+    parser.add_argument("--min-repeats", type=int, default=3)
+    parser.add_argument("--max-repeats", type=int, default=10)
+    args = parser.parse_args(argv)
+
+    series = {args.key: read_times(args.spectimes, args.key)}
+    if args.energies:
+        try:
+            series["energy"] = read_energies(args.energies)
+        except OSError as e:
+            _log(f"No energies: {e}")
+            return 2
+        if not series["energy"]:
+            _log(f"No energies in {args.energies}")
+            return 2
+
+    repeats = len(series[args.key])
+    widths = {k: relative_half_width(v, args.confidence) for (k, v) in series.items()}
+    summary = ", ".join(f"{k} ±{w:.2%}" for (k, w) in widths.items())
+
+    if repeats >= args.max_repeats:
+        _log(f"Stopping at the limit of {repeats} repeats: {summary}")
+        return 0
+    if repeats >= args.min_repeats and all(w <= args.target for w in widths.values()):
+        _log(f"Converged after {repeats} repeats: {summary}")
+        return 0
+
+    _log(f"Repeating after {repeats} repeats: {summary}")
+    return 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
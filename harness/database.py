@@ -1,8 +1,13 @@
 import os
+import re
+import glob
 import logging
 import json
+from concurrent.futures import ThreadPoolExecutor
 
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import numpy as np
 
 import reframe as rfm
@@ -10,6 +15,8 @@ import reframe.core.builtins as blt
 import reframe.utility.typecheck as typ
 
 import harness.utils as utils
+import harness.energy as energy
+from harness.querycache import QueryCache
 
 logger = logging.getLogger(__name__)
 
@@ -23,6 +30,19 @@ SRFM_PROMETHEUS_DEBUG_ONLY: bool = (
     os.environ.get("SRFM_PROMETHEUS_DEBUG_ONLY", None) is not None
 )
 
+# a directory to persist query results in. results for windows that have
+# closed never change, so re-running the performance stage or re-analysing old
+# runs can be served from here
+SRFM_PROMETHEUS_CACHE_DIR = os.environ.get("SRFM_PROMETHEUS_CACHE_DIR", None)
+SRFM_PROMETHEUS_CACHE_MAX_MB = float(
+    os.environ.get("SRFM_PROMETHEUS_CACHE_MAX_MB", "512")
+)
+
+# only serve results from the cache and never contact the database
+SRFM_PROMETHEUS_OFFLINE: bool = (
+    os.environ.get("SRFM_PROMETHEUS_OFFLINE", None) is not None
+)
+
 DATABASE_QUERY_ENABLED: bool = (
     True
     if (
@@ -30,10 +50,16 @@ DATABASE_QUERY_ENABLED: bool = (
         (SRFM_PROMETHEUS_ADDRESS and SRFM_PROMETHEUS_TOKEN)
         # or if debug mode is enabled, in which case the fetch is never made
         or SRFM_PROMETHEUS_DEBUG_ONLY
+        # or if everything is to come from the cache
+        or (SRFM_PROMETHEUS_OFFLINE and SRFM_PROMETHEUS_CACHE_DIR)
     )
     else False
 )
 
+# how long after the end of a window before the results are considered final
+# and may be cached
+CACHE_SETTLE_SECONDS = 300
+
 STATUS_SUCCESS = "success"
 
 # tell the user what they've got configured
@@ -47,6 +73,23 @@ if not DATABASE_QUERY_ENABLED:
 if SRFM_PROMETHEUS_DEBUG_ONLY:
     logger.warn("SRFM_PROMETHEUS_DEBUG_ONLY is set. Fetch query will not be performed.")
 
+if SRFM_PROMETHEUS_OFFLINE:
+    if SRFM_PROMETHEUS_CACHE_DIR:
+        logger.warn(
+            "SRFM_PROMETHEUS_OFFLINE is set. Measurements will only be read from the cache."
+        )
+    else:
+        logger.warn(
+            "SRFM_PROMETHEUS_OFFLINE is set but SRFM_PROMETHEUS_CACHE_DIR is not."
+            " Cannot fetch PDU measurement estimate."
+        )
+
+QUERY_CACHE = (
+    QueryCache(SRFM_PROMETHEUS_CACHE_DIR, SRFM_PROMETHEUS_CACHE_MAX_MB)
+    if SRFM_PROMETHEUS_CACHE_DIR
+    else None
+)
+
 
 def _digest_result(data: dict) -> np.array:
     if data["status"] != STATUS_SUCCESS:
@@ -56,52 +99,200 @@ def _digest_result(data: dict) -> np.array:
     return np.array(data["data"]["result"][0]["values"], dtype=np.float64)
 
 
+def _digest_result_by_node(data: dict) -> dict:
+    """
+    Splits a multi-series query result back into a dictionary of `nodename:
+    values`, using the `alias` label of each returned series.
+    """
+    if data["status"] != STATUS_SUCCESS:
+        logger.error("Dabase returned status: %s", data["status"])
+        raise ValueError("Database query returned unsuccessful!")
+
+    readings = {}
+    for series in data["data"]["result"]:
+        nodename = series["metric"]["alias"]
+        values = np.array(series["values"], dtype=np.float64)
+
+        if nodename in readings:
+            # the same node can appear more than once if one of the other
+            # labels changed during the window, so stitch them back together
+            logger.debug("Merging multiple series for node %s", nodename)
+            values = np.concatenate((readings[nodename], values))
+            values = values[np.argsort(values[:, 0], kind="stable")]
+
+        readings[nodename] = values
+
+    return readings
+
+
 CLUSTER_LOOKUP = {
     "sapphire": "Sapphire Rapid",
     "cclake": "Cascade Lake",
 }
 
+QUERY_STEP = "60s"
+QUERY_TIMEOUT_SECONDS = 10
+QUERY_MAX_RETRIES = 3
+QUERY_BACKOFF_FACTOR = 0.5
+# maximum number of nodes to put into a single `alias=~"..."` matcher. larger
+# node lists are split into several queries which are made concurrently
+QUERY_BATCH_SIZE = 64
+QUERY_MAX_WORKERS = 8
 
-def _construct_pdu_query_node(cluster: str, nodename: str):
+_session = None
+
+
+def _get_session() -> requests.Session:
+    """
+    Returns a module-wide session, so that the connection to the database is
+    pooled between queries. Failed requests are retried with exponential
+    backoff.
+    """
+    global _session
+
+    if _session is None:
+        retries = Retry(
+            total=QUERY_MAX_RETRIES,
+            backoff_factor=QUERY_BACKOFF_FACTOR,
+            status_forcelist=(429, 500, 502, 503, 504),
+            # the query endpoint is read-only, so POST is safe to retry
+            allowed_methods=None,
+        )
+        adapter = HTTPAdapter(max_retries=retries, pool_maxsize=QUERY_MAX_WORKERS)
+
+        _session = requests.Session()
+        _session.mount("http://", adapter)
+        _session.mount("https://", adapter)
+        _session.headers.update(
+            {
+                "Authorization": f"Bearer {SRFM_PROMETHEUS_TOKEN}",
+                "Accept": "application/json",
+            }
+        )
+
+    return _session
+
+
+def _construct_pdu_query(cluster: str, alias_matcher: str) -> str:
     # cluster name is capitalized in the database, so we make sure it is here too
     # for some others it has a special string so assert that with a lookup
     cluster_name = CLUSTER_LOOKUP.get(cluster, cluster.title())
     return (
         'amperageProbeReading{job="snmp_bmc", '
         'amperageProbeLocationName="System Board Pwr Consumption", '
-        'cluster="' + cluster_name + '", alias="' + nodename + '"}'
+        'cluster="' + cluster_name + '", ' + alias_matcher + "}"
     )
 
 
-def _make_pdu_query(start_date: str, end_date: str, cluster, nodename):
-    query_string = _construct_pdu_query_node(cluster, nodename)
+def _construct_pdu_query_node(cluster: str, nodename: str):
+    return _construct_pdu_query(cluster, 'alias="' + nodename + '"')
+
+
+def _construct_pdu_query_nodes(cluster: str, nodenames: typ.List[str]):
+    # escape the node names for the regex, and then escape the backslashes
+    # again for the string literal in the query
+    pattern = "|".join(re.escape(n) for n in nodenames).replace("\\", "\\\\")
+    return _construct_pdu_query(cluster, 'alias=~"' + pattern + '"')
 
-    headers = {
-        "Authorization": f"Bearer {SRFM_PROMETHEUS_TOKEN}",
-        "Accept": "application/json",
+
+def _post_query(query_string: str, start_date: str, end_date: str) -> dict:
+    data = {
+        "query": query_string,
+        "start": start_date,
+        "end": end_date,
+        "step": QUERY_STEP,
     }
 
+    response = _get_session().post(
+        f"http://{SRFM_PROMETHEUS_ADDRESS}/api/v1/query_range",
+        data=data,
+        timeout=QUERY_TIMEOUT_SECONDS,
+    )
+    response.raise_for_status()
+
+    return json.loads(response.content.decode())
+
+
+def _debug_query(query_string: str, start_date: str, end_date: str):
+    # todo: log to debug? but then have to mess with levels?
     data = {
         "query": query_string,
         "start": start_date,
         "end": end_date,
-        "step": "60s",
+        "step": QUERY_STEP,
     }
+    logger.warn("request data: %s", json.dumps(data, indent=2))
+
+
+def _cache_key(start_date: str, end_date: str, cluster, nodename) -> str:
+    return QueryCache.key(cluster, nodename, start_date, end_date, QUERY_STEP)
+
+
+def _window_closed(end_date: str) -> bool:
+    try:
+        end = utils.parse_date(end_date)
+    except ValueError:
+        # can't tell, so be safe and assume the data may still change
+        return False
+
+    return (utils.now() - end).total_seconds() > CACHE_SETTLE_SECONDS
+
+
+def _read_cache(start_date: str, end_date: str, cluster, nodenames) -> dict:
+    readings = {}
+    if QUERY_CACHE is None:
+        return readings
+
+    for nodename in nodenames:
+        values = QUERY_CACHE.get(_cache_key(start_date, end_date, cluster, nodename))
+        if values is not None:
+            readings[nodename] = values
+
+    logger.debug("Query cache hits: %d / %d", len(readings), len(nodenames))
+    return readings
+
+
+def _write_cache(start_date: str, end_date: str, cluster, readings: dict):
+    if (QUERY_CACHE is None) or SRFM_PROMETHEUS_DEBUG_ONLY:
+        return
+
+    if not _window_closed(end_date):
+        logger.debug("Query window has not closed yet. Not caching results.")
+        return
+
+    for nodename, values in readings.items():
+        QUERY_CACHE.put(_cache_key(start_date, end_date, cluster, nodename), values)
+
+
+def _make_pdu_query(start_date: str, end_date: str, cluster, nodename):
+    cached = _read_cache(start_date, end_date, cluster, [nodename])
+    if nodename in cached:
+        return cached[nodename]
+
+    if SRFM_PROMETHEUS_OFFLINE:
+        raise ValueError(f"No cached measurements for node {nodename} (offline)")
+
+    query_string = _construct_pdu_query_node(cluster, nodename)
 
     if SRFM_PROMETHEUS_DEBUG_ONLY:
-        # todo: log to debug? but then have to mess with levels?
-        logger.warn("request data: %s", json.dumps(data, indent=2))
+        _debug_query(query_string, start_date, end_date)
         return np.zeros((1, 2), dtype=np.float64)
     else:
-        response = requests.post(
-            f"http://{SRFM_PROMETHEUS_ADDRESS}/api/v1/query_range",
-            headers=headers,
-            data=data,
-            timeout=10,
-        )
+        values = _digest_result(_post_query(query_string, start_date, end_date))
+        _write_cache(start_date, end_date, cluster, {nodename: values})
+        return values
 
-        result = json.loads(response.content.decode())
-        return _digest_result(result)
+
+def _make_pdu_batch_query(
+    start_date: str, end_date: str, cluster, nodenames: typ.List[str]
+) -> dict:
+    query_string = _construct_pdu_query_nodes(cluster, nodenames)
+
+    if SRFM_PROMETHEUS_DEBUG_ONLY:
+        _debug_query(query_string, start_date, end_date)
+        return {n: np.zeros((1, 2), dtype=np.float64) for n in nodenames}
+    else:
+        return _digest_result_by_node(_post_query(query_string, start_date, end_date))
 
 
 def fetch_pdu_measurements(
@@ -121,6 +312,63 @@ def fetch_pdu_measurements(
     )
 
 
+def fetch_pdu_measurements_batched(
+    start_time: str,
+    end_time: str,
+    cluster: str,
+    nodenames: typ.List[str],
+) -> dict:
+    """
+    Fetches the measurements for many nodes at once, returning a dictionary of
+    `nodename: values`. Units of each value are the same as in
+    `fetch_pdu_measurements`.
+
+    The nodes are matched with a single regex selector, so the number of
+    round-trips to the database is independent of the number of nodes for
+    anything up to `QUERY_BATCH_SIZE` nodes. Larger node lists are split into
+    batches that are fetched concurrently over the pooled session. Nodes that
+    are already in the query cache are not fetched again.
+    """
+    readings = _read_cache(start_time, end_time, cluster, nodenames)
+    uncached = [n for n in nodenames if n not in readings]
+
+    if SRFM_PROMETHEUS_OFFLINE:
+        if uncached:
+            logger.warn("Offline and no cached measurements for nodes: %s", uncached)
+        uncached = []
+
+    batches = [
+        uncached[i : i + QUERY_BATCH_SIZE]
+        for i in range(0, len(uncached), QUERY_BATCH_SIZE)
+    ]
+
+    def _fetch(batch):
+        return _make_pdu_batch_query(start_time, end_time, cluster, batch)
+
+    fetched = {}
+    if len(batches) == 1:
+        fetched.update(_fetch(batches[0]))
+    elif batches:
+        with ThreadPoolExecutor(max_workers=QUERY_MAX_WORKERS) as pool:
+            for result in pool.map(_fetch, batches):
+                fetched.update(result)
+
+    _write_cache(start_time, end_time, cluster, fetched)
+    readings.update(fetched)
+
+    missing = [n for n in nodenames if n not in readings]
+    if missing:
+        logger.warn("No database measurements returned for nodes: %s", missing)
+
+    return readings
+
+
+# run on the compute nodes to wait for the power to settle after a run
+RAPL_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "rapl.py")
+COOLDOWN_BASELINE_FORMAT = "rapl_baseline.{host}"
+COOLDOWN_TIMES_FILE = "cooldown_times.txt"
+
+
 class BMCInstrument(rfm.RegressionMixin):
 
     # database specifics
@@ -128,23 +376,108 @@ class BMCInstrument(rfm.RegressionMixin):
     job_end_time = variable(str, type(None), value=None)
     database_query_node_names = variable(typ.List[str], type(None), value=None)
 
+    # the longest the node is rested for after the run
     cooldown_seconds = variable(int, value=60)
+    # wait for the node power to settle back to idle rather than always
+    # sleeping for `cooldown_seconds`. This reads the RAPL `energy_uj`
+    # counters, which are only readable by root by default: without
+    # `cooldown_sudo` or a readable powercap tree, the cooldown falls back to
+    # sleeping for `cooldown_seconds`, and a warning is logged
+    cooldown_adaptive = variable(bool, value=True)
+    # read the RAPL counters with `sudo -n`, as the node setup does
+    cooldown_sudo = variable(bool, value=False)
+    # relative tolerance on the idle power, and how long it must be within it
+    cooldown_tolerance = variable(float, value=0.05)
+    cooldown_settle_seconds = variable(float, value=5.0)
+    # idle power of a node in watts, measured before the run if not given
+    cooldown_idle_power = variable(float, type(None), value=None)
+    # how long the cooldown actually took
+    cooldown_duration = variable(float, type(None), value=None)
+
+    def _rapl_cmd(self, *args) -> str:
+        sudo = ["sudo", "-n"] if self.cooldown_sudo else []
+        return " ".join([*sudo, "python3", RAPL_SCRIPT, *args])
+
+    def _cooldown_cmds(self) -> typ.List[str]:
+        if not self.cooldown_adaptive:
+            return [
+                f'echo "Sleeping for {self.cooldown_seconds} seconds"',
+                f"sleep {self.cooldown_seconds}s",
+            ]
+
+        if self.cooldown_idle_power is not None:
+            baseline = f"--baseline {self.cooldown_idle_power}"
+        else:
+            baseline = f"--baseline-file {COOLDOWN_BASELINE_FORMAT}"
+
+        settle = self._rapl_cmd(
+            "settle",
+            baseline,
+            f"--tolerance {self.cooldown_tolerance}",
+            f"--window {self.cooldown_settle_seconds}",
+            f"--max-seconds {self.cooldown_seconds}",
+        )
+        return [
+            f'echo "Waiting up to {self.cooldown_seconds} seconds for the power to settle"',
+            "SRFM_COOLDOWN_START=$(date +%s.%N)",
+            # every node has to settle, so wait for all of them, and rest for
+            # the whole time if the settle could not run at all, e.g. sudo
+            # was refused
+            utils.multiplex_for_each_node(settle, self.num_nodes, False)
+            + f" || sleep {self.cooldown_seconds}s",
+            f'echo "$SRFM_COOLDOWN_START $(date +%s.%N)" > {COOLDOWN_TIMES_FILE}',
+        ]
 
     @blt.run_before("run", always_last=True)
     def _bmc_instrument_post_command(self):
-        postrun_cmds = [
-            # after the run has finished and all measurements are made
-            # rest the node for a bit before the next job sweeps in so
-            # the database measurements are sane
-            f'echo "Sleeping for {self.cooldown_seconds} seconds"',
-            f"sleep {self.cooldown_seconds}s",
-        ]
+        if self.cooldown_adaptive and self.cooldown_idle_power is None:
+            # measured at the very start, while the node is still idle
+            baseline = self._rapl_cmd(
+                "baseline", f"--output {COOLDOWN_BASELINE_FORMAT}"
+            )
+            self.prerun_cmds = [
+                utils.multiplex_for_each_node(baseline, self.num_nodes, False)
+            ] + (self.prerun_cmds or [])
+
+        # after the run has finished and all measurements are made
+        # rest the node for a bit before the next job sweeps in so
+        # the database measurements are sane
+        postrun_cmds = self._cooldown_cmds()
 
         if self.postrun_cmds:
             self.postrun_cmds += postrun_cmds
         else:
             self.postrun_cmds = postrun_cmds
 
+    def _warn_cooldown_fallback(self, duration: float):
+        baseline = COOLDOWN_BASELINE_FORMAT.format(host="*")
+        if self.cooldown_idle_power is None and not glob.glob(
+            os.path.join(self.stagedir, baseline)
+        ):
+            logger.warn(
+                "No idle RAPL power was measured, so the cooldown slept for the"
+                " full %d seconds: energy_uj is only readable by root unless"
+                " cooldown_sudo is set",
+                self.cooldown_seconds,
+            )
+        elif duration >= self.cooldown_seconds:
+            logger.warn(
+                "The power did not settle within %d seconds, or the RAPL"
+                " counters could not be read",
+                self.cooldown_seconds,
+            )
+
+    def _read_cooldown_duration(self) -> float:
+        path = os.path.join(self.stagedir, COOLDOWN_TIMES_FILE)
+        if self.cooldown_adaptive and os.path.isfile(path):
+            try:
+                start, end = (float(v) for v in open(path).read().split())
+                self._warn_cooldown_fallback(end - start)
+                return end - start
+            except ValueError:
+                logger.warn("Could not read the cooldown times from %s", path)
+        return float(self.cooldown_seconds)
+
     @blt.run_after("run", always_last=True)
     def _bmc_instrument_scheduler_times(self):
         # for the database query, need a rough estimate of when to start query
@@ -157,8 +490,10 @@ class BMCInstrument(rfm.RegressionMixin):
             self.job_end_time = maybe_better_times[1]
 
         # adjust the cooldown period in the recorded end time
+        self.cooldown_duration = self._read_cooldown_duration()
+        logger.debug("Cooldown took %.1f seconds", self.cooldown_duration)
         self.job_end_time = utils.subtract_cooldown(
-            self.job_end_time, self.cooldown_seconds
+            self.job_end_time, self.cooldown_duration
         )
 
         # after the run we ask the job where it ran
@@ -168,29 +503,63 @@ class BMCInstrument(rfm.RegressionMixin):
         else:
             logger.warn("No nodelists set by scheduler. Cannot query database")
 
-    @blt.performance_function("J")
-    def _bmc_instrument_extract_database_readings(self, nodename=None):
+    def _bmc_instrument_fetch_readings(self) -> dict:
+        # all nodes are fetched together the first time any of the performance
+        # functions are evaluated, and then re-used for each node
+        readings = getattr(self, "_bmc_instrument_readings", None)
+        if readings is None:
+            readings = fetch_pdu_measurements_batched(
+                self.job_start_time,
+                self.job_end_time,
+                self.partition_name,
+                self.database_query_node_names,
+            )
+            self._bmc_instrument_readings = readings
+
+        return readings
+
+    def _bmc_instrument_node_readings(self, nodename) -> np.array:
         if not nodename:
             raise ValueError("`nodename` must be defined")
 
-        # get the pdu measurements
-        values = fetch_pdu_measurements(
-            self.job_start_time,
-            self.job_end_time,
-            self.partition_name,
-            nodename,
+        readings = self._bmc_instrument_fetch_readings()
+        if nodename not in readings:
+            raise ValueError(f"No database measurements for node {nodename}")
+
+        return readings[nodename]
+
+    def _bmc_instrument_window(self):
+        # a repeated launch is measured over its last repetition only, as are
+        # its times
+        if hasattr(self, "_repeat_last_step"):
+            step = self._repeat_last_step()
+            return float(step["start"]), float(step["end"])
+
+        return (
+            utils.parse_date(self.job_start_time).timestamp(),
+            utils.parse_date(self.job_end_time).timestamp(),
         )
 
-        time_values = values[:, 0]
-        power_values = values[:, 1]
+    def _bmc_instrument_integrate(self, nodename) -> energy.EnergyEstimate:
+        values = self._bmc_instrument_node_readings(nodename)
 
-        self.time_series[f"BMC/{nodename}"] = [
-            list(time_values),
-            list(power_values),
-        ]
+        # integrate under the power curve between the exact job start and end,
+        # rather than whichever samples happen to fall in the query window
+        return energy.integrate_power(
+            values[:, 0], values[:, 1], *self._bmc_instrument_window()
+        )
 
-        # integrate under the power curve to get the total energy
-        return np.trapz(power_values, time_values)
+    @blt.performance_function("J")
+    def _bmc_instrument_extract_database_readings(self, nodename=None):
+        values = self._bmc_instrument_node_readings(nodename)
+
+        self.time_series.add(f"BMC/{nodename}", "power", values[:, 0], values[:, 1])
+
+        return self._bmc_instrument_integrate(nodename).energy
+
+    @blt.performance_function("J")
+    def _bmc_instrument_extract_energy_uncertainty(self, nodename=None):
+        return self._bmc_instrument_integrate(nodename).uncertainty
 
     @blt.run_before("performance", always_last=True)
     def _bmc_instrument_set_performance_variables(self):
@@ -203,6 +572,9 @@ class BMCInstrument(rfm.RegressionMixin):
                 bmc_variables[f"BMC/{nodename}"] = (
                     self._bmc_instrument_extract_database_readings(nodename)
                 )
+                bmc_variables[f"BMC/{nodename}/uncertainty"] = (
+                    self._bmc_instrument_extract_energy_uncertainty(nodename)
+                )
 
             if self.perf_variables:
                 self.perf_variables = {**self.perf_variables, **bmc_variables}
@@ -0,0 +1,165 @@
+import logging
+import collections
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# segments between samples longer than this multiple of the median sampling
+# step are treated as gaps (missed scrapes, dropped intervals)
+GAP_FACTOR = 2.0
+
+EnergyEstimate = collections.namedtuple("EnergyEstimate", ["energy", "uncertainty"])
+"""
+An integrated energy and an upper bound on its absolute error, both in joules.
+Both fields are scalars if the window was given as scalars, otherwise arrays
+with the broadcast shape of the window `start` and `end`.
+"""
+
+
+def _clean(times, values):
+    # drop missing samples and make sure everything is in time order
+    times = np.asarray(times, dtype=np.float64)
+    values = np.asarray(values, dtype=np.float64)
+
+    mask = np.isfinite(times) & np.isfinite(values)
+    times = times[mask]
+    values = values[mask]
+
+    order = np.argsort(times, kind="stable")
+    return times[order], values[order]
+
+
+def _gaps(dt, max_gap):
+    if max_gap is None:
+        max_gap = GAP_FACTOR * np.median(dt)
+    return dt > max_gap
+
+
+def _estimate(energy, uncertainty, scalar: bool) -> EnergyEstimate:
+    if scalar:
+        return EnergyEstimate(float(energy[0]), float(uncertainty[0]))
+    return EnergyEstimate(energy, uncertainty)
+
+
+def _window(start, end):
+    start = np.asarray(start, dtype=np.float64)
+    end = np.asarray(end, dtype=np.float64)
+    scalar = (start.ndim == 0) and (end.ndim == 0)
+    return np.atleast_1d(start), np.atleast_1d(end), scalar
+
+
+def integrate_power(times, power, start, end, max_gap=None) -> EnergyEstimate:
+    """
+    Integrates a series of instantaneous power samples (e.g. BMC readings in
+    `[s, W]`) over the window `[start, end]`, which may be scalars or arrays of
+    windows.
+
+    The power is linearly interpolated between samples, including at the exact
+    window edges, and held at the first / last sample if the window extends
+    past the data. Non-finite samples are dropped, and segments longer than
+    `max_gap` seconds (by default `GAP_FACTOR` times the median sampling step)
+    are treated as gaps.
+
+    The uncertainty is half the difference between the left and right Riemann
+    sums on each segment, widened to the full observed power range over gaps
+    and outside of the data.
+    """
+    t, p = _clean(times, power)
+    start, end, scalar = _window(start, end)
+
+    if len(t) == 0:
+        logger.warn("No power samples to integrate")
+        nans = np.full(np.broadcast(start, end).shape, np.nan)
+        return _estimate(nans, nans, scalar)
+
+    if len(t) == 1:
+        # nothing to interpolate between, so all we know is one reading
+        energy = p[0] * (end - start)
+        return _estimate(energy, np.abs(energy), scalar)
+
+    dt = np.diff(t)
+    spread = p.max() - p.min()
+
+    segment_energy = 0.5 * (p[1:] + p[:-1]) * dt
+    segment_error = 0.5 * np.abs(np.diff(p)) * dt
+    gaps = _gaps(dt, max_gap)
+    if np.any(gaps):
+        logger.debug("Found %d gaps in the power samples", np.count_nonzero(gaps))
+        segment_error[gaps] = np.maximum(segment_error[gaps], 0.5 * spread * dt[gaps])
+
+    cumulative_energy = np.concatenate(([0.0], np.cumsum(segment_energy)))
+    cumulative_error = np.concatenate(([0.0], np.cumsum(segment_error)))
+
+    def _at(x):
+        # the cumulative energy and error from the first sample up to time `x`
+        k = np.clip(np.searchsorted(t, x, side="right") - 1, 0, len(dt) - 1)
+        dx = np.clip(x, t[0], t[-1]) - t[k]
+        px = np.interp(x, t, p)
+
+        energy = cumulative_energy[k] + 0.5 * (p[k] + px) * dx
+        error = cumulative_error[k] + segment_error[k] * dx / dt[k]
+
+        # extrapolate past either end of the data
+        before = np.minimum(x - t[0], 0.0)
+        after = np.maximum(x - t[-1], 0.0)
+        energy = energy + before * p[0] + after * p[-1]
+        error = error + (before + after) * spread
+        return energy, error
+
+    start_energy, start_error = _at(start)
+    end_energy, end_error = _at(end)
+
+    return _estimate(end_energy - start_energy, end_error - start_error, scalar)
+
+
+def integrate_interval_energy(
+    times, energies, start, end, origin: float = 0.0
+) -> EnergyEstimate:
+    """
+    Integrates a series of per-interval energies (e.g. `perf stat -I` output,
+    where each value is the energy counted in the interval ending at that time)
+    over the window `[start, end]`. The first interval starts at `origin`.
+
+    The power is assumed constant within each interval, so windows that start
+    or end part way through an interval are split proportionally. The
+    uncertainty is bounded by how much of those partial intervals could fall on
+    either side of the edge, and by the full interval energy for any part of
+    the window outside the data.
+    """
+    t, e = _clean(times, energies)
+    start, end, scalar = _window(start, end)
+
+    if len(t) == 0:
+        logger.warn("No interval energies to integrate")
+        nans = np.full(np.broadcast(start, end).shape, np.nan)
+        return _estimate(nans, nans, scalar)
+
+    edges = np.concatenate(([origin], t))
+    dt = np.diff(edges)
+    cumulative_energy = np.concatenate(([0.0], np.cumsum(e)))
+    interval_power = np.divide(e, dt, out=np.zeros_like(e), where=dt > 0)
+
+    def _at(x):
+        energy = np.interp(x, edges, cumulative_energy)
+
+        k = np.clip(np.searchsorted(edges, x, side="right") - 1, 0, len(dt) - 1)
+        frac = np.divide(
+            np.clip(x, edges[0], edges[-1]) - edges[k],
+            dt[k],
+            out=np.zeros_like(energy),
+            where=dt[k] > 0,
+        )
+        error = e[k] * np.minimum(frac, 1.0 - frac)
+
+        # extrapolate past either end of the data
+        before = np.minimum(x - edges[0], 0.0) * interval_power[0]
+        after = np.maximum(x - edges[-1], 0.0) * interval_power[-1]
+        energy = energy + before + after
+        error = error + np.abs(before) + after
+        return energy, error
+
+    start_energy, start_error = _at(start)
+    end_energy, end_error = _at(end)
+
+    return _estimate(end_energy - start_energy, start_error + end_error, scalar)
@@ -1,26 +1,35 @@
 import os
+import glob
+import json
 import logging
 
+import numpy as np
+
 from harness.config import FREQUENCY_LOOKUP
+from harness.database import DATABASE_QUERY_ENABLED
 import harness.utils as utils
+import harness.energy as energy
+import harness.launch as launch
+from harness.nodesetup import NodeSetupBase, NODE_SETUP_DEBUG
 
 import reframe as rfm
 import reframe.core.builtins as blt
-
+import reframe.utility.sanity as sn
+import reframe.utility.typecheck as typ
+from reframe.core.exceptions import SanityError
 
 logger = logging.getLogger(__name__)
 
 
-FREQUENCY_SET_DEBUG = os.environ.get("SRFM_NODE_SETUP_DEBUG", None) is not None
-
-if FREQUENCY_SET_DEBUG:
-    logger.warn(
-        "SRFM_NODE_SETUP_DEBUG is set. Will not attempt to set CPU frequencies."
-    )
+FREQUENCY_SET_DEBUG = NODE_SETUP_DEBUG
 
 
 PARAMETER_CARDINALITY = max(len(v) for _, v in FREQUENCY_LOOKUP.items())
 
+SWEEP_STEPS_FILE = "sweep_steps.txt"
+SPECTIMES_STEP_FORMAT = "spectimes.{}.txt"
+SWEEP_SETUP_FORMAT = "sweepsetup.{host}.{step}.json"
+
 
 def partition_frequencies(name: str):
     fqs = FREQUENCY_LOOKUP.get(name, None)
@@ -31,24 +40,10 @@ def partition_frequencies(name: str):
     raise ValueError(f"No frequencies for requested parititon {name}")
 
 
-class FrequencyBase(rfm.RegressionMixin):
+class FrequencyBase(NodeSetupBase):
 
-    def frequency_cmd(self) -> str:
-        # todo: this is ridiculously unsafe and in an ideal world
-        # the parameter would be sanitized but oh well !!!
-        cmd = f"sudo cpupower frequency-set -f {self.cpu_frequency}mhz"
-        return cmd
-
-    def _construct_freq_cmd(self) -> str:
-        cmd = self.frequency_cmd()
-        return utils.multiplex_for_each_node(cmd, self.num_nodes, FREQUENCY_SET_DEBUG)
-
-    @blt.run_before("run", always_last=True)
-    def set_cpu_frequency(self):
-        if self.prerun_cmds:
-            self.prerun_cmds.append(self._construct_freq_cmd())
-        else:
-            self.prerun_cmds = [self._construct_freq_cmd()]
+    def node_setup_args(self) -> list:
+        return super().node_setup_args() + [f"--frequency {self.cpu_frequency}"]
 
 
 class FrequencySweepAll(FrequencyBase):
@@ -79,8 +74,204 @@ class FrequencySweepChosen(FrequencyBase):
 class FrequencyCPUGovenor(FrequencyBase):
     cpu_govenor = variable(str, value="powersave")
 
-    def frequency_cmd(self) -> str:
-        # todo: this is ridiculously unsafe and in an ideal world
-        # the parameter would be sanitized but oh well !!!
-        cmd = f"sudo cpupower frequency-set -g {self.cpu_govenor}"
-        return cmd
+    def node_setup_args(self) -> list:
+        # the governor instead of a fixed frequency
+        return super(FrequencyBase, self).node_setup_args() + [
+            f"--governor {self.cpu_govenor}"
+        ]
+
+
+class FrequencySweepBatched(FrequencyBase):
+    """
+    Steps through the frequencies of the partition, with `sweep_repetitions`
+    repetitions of each, inside a single allocation instead of one job per
+    frequency.
+
+    The launch is run in a shell loop, laid out with `launch.set_step_loop`,
+    that sets the frequency of each step with `nodeagent.py apply` and skips
+    the step if it does not take effect. The outcome of the setup of each step
+    is kept in `SWEEP_SETUP_FORMAT`, the start and end times in
+    `SWEEP_STEPS_FILE` and the SPEChpc times in `SPECTIMES_STEP_FORMAT`. Every
+    step has to have been set up and to pass verification.
+
+    The times, achieved frequencies, perf and BMC energies of each step are
+    reported as separate performance variables prefixed with
+    `<frequency>MHz/<repetition>/`, in place of the plain `Core time` and
+    `Total time`.
+
+    Not to be combined with the other frequency mixins.
+    """
+
+    # defaults to all frequencies of the partition
+    sweep_frequencies = variable(typ.List[float], value=[])
+    sweep_repetitions = variable(int, value=1)
+
+    def sweep_steps(self) -> list:
+        return [
+            (f, r)
+            for f in self.sweep_frequencies
+            for r in range(self.sweep_repetitions)
+        ]
+
+    def node_setup_args(self) -> list:
+        # the frequency is set for each step instead
+        return super(FrequencyBase, self).node_setup_args()
+
+    def _sweep_setup_cmd(self) -> str:
+        return self.node_setup_cmd(
+            ["--frequency $SRFM_FREQUENCY"],
+            SWEEP_SETUP_FORMAT.format(host="{host}", step="$SRFM_STEP"),
+        )
+
+    @blt.run_after("setup")
+    def get_sweep_frequencies(self):
+        if not self.sweep_frequencies:
+            self.sweep_frequencies = partition_frequencies(self.current_partition.name)
+
+    @blt.run_before("run", always_last=True)
+    def set_cpu_frequency(self):
+        steps = " ".join(
+            f"{i}:{f:g}:{r}" for (i, (f, r)) in enumerate(self.sweep_steps())
+        )
+        header = [
+            f"for SRFM_STEP_SPEC in {steps}; do",
+            'IFS=: read SRFM_STEP SRFM_FREQUENCY SRFM_REPETITION <<< "$SRFM_STEP_SPEC"',
+        ]
+        launch.set_step_loop(
+            self,
+            header,
+            ["done"],
+            SWEEP_STEPS_FILE,
+            SPECTIMES_STEP_FORMAT,
+            # a step at the wrong frequency is not worth running
+            [f"{self._sweep_setup_cmd()} || continue"],
+        )
+
+    def _sweep_setup_results(self) -> dict:
+        # the outcomes of the node setup by step and host
+        results = getattr(self, "_frequency_sweep_setup", None)
+        if results is None:
+            results = {}
+            pattern = SWEEP_SETUP_FORMAT.format(host="*", step="*")
+            for path in glob.glob(os.path.join(self.stagedir, pattern)):
+                with open(path) as f:
+                    outcome = json.load(f)
+                step = int(path.rsplit(".", 2)[-2])
+                results.setdefault(step, {})[outcome["host"]] = outcome
+            self._frequency_sweep_setup = results
+
+        return results
+
+    @blt.run_before("sanity")
+    def check_sweep_steps(self):
+        steps = range(len(self.sweep_steps()))
+        if not FREQUENCY_SET_DEBUG:
+            results = self._sweep_setup_results()
+            failed = [
+                str(i)
+                for i in steps
+                if len(results.get(i, {})) < self.num_nodes
+                or not all(r["ok"] for r in results[i].values())
+            ]
+            if failed:
+                raise SanityError(f"Steps {', '.join(failed)} could not be set up")
+
+        launch.assert_steps_passed(self.stagedir, SPECTIMES_STEP_FORMAT, steps)
+
+    def _sweep_step_times(self) -> np.array:
+        steps = getattr(self, "_frequency_sweep_steps", None)
+        if steps is None:
+            steps = utils.read_step_times(os.path.join(self.stagedir, SWEEP_STEPS_FILE))
+            self._frequency_sweep_steps = steps
+        return steps
+
+    def _sweep_bmc_energies(self, nodename) -> np.array:
+        # all steps are integrated at once, and kept for the other steps
+        cache = getattr(self, "_frequency_sweep_bmc", None)
+        if cache is None:
+            cache = self._frequency_sweep_bmc = {}
+
+        if nodename not in cache:
+            steps = self._sweep_step_times()
+            values = self._bmc_instrument_node_readings(nodename)
+            cache[nodename] = energy.integrate_power(
+                values[:, 0], values[:, 1], steps["start"], steps["end"]
+            ).energy
+
+        return cache[nodename]
+
+    @blt.performance_function("s")
+    def extract_step_time(self, step=None, key="Core time"):
+        return sn.extractsingle(
+            rf"{key}:\s+(\S+)", SPECTIMES_STEP_FORMAT.format(step), 1, float
+        )
+
+    @blt.performance_function("J")
+    def extract_step_perf_energy(self, step=None, key=None, socket=0, host_index=None):
+        records = self._perf_instrument_intervals().select(
+            -1 if host_index is None else host_index,
+            socket,
+            self.perf_events.index(key),
+            step,
+        )
+        return float(np.sum(records["value"]))
+
+    @blt.performance_function("J")
+    def extract_step_bmc_energy(self, step=None, nodename=None):
+        index = np.flatnonzero(self._sweep_step_times()["step"] == step)
+        if len(index) == 0:
+            raise ValueError(f"Step {step} did not finish")
+
+        return float(self._sweep_bmc_energies(nodename)[index[0]])
+
+    @blt.performance_function("MHz")
+    def extract_step_frequency(self, step=None, host=None):
+        return self._sweep_setup_results()[step][host]["settings"]["frequency"][
+            "achieved"
+        ]
+
+    @blt.run_before("performance", always_last=True)
+    def set_sweep_performance_variables(self):
+        num_sockets = self.current_partition.processor.num_sockets
+        perf_events = getattr(self, "perf_events", None) or []
+        use_bmc = DATABASE_QUERY_ENABLED and getattr(
+            self, "database_query_node_names", None
+        )
+
+        variables = {}
+        for i, (f, r) in enumerate(self.sweep_steps()):
+            prefix = f"{f:g}MHz/{r}"
+            variables[f"{prefix}/Core time"] = self.extract_step_time(i, "Core time")
+            variables[f"{prefix}/Total time"] = self.extract_step_time(i, "Total time")
+
+            if not FREQUENCY_SET_DEBUG:
+                for host in self._sweep_setup_results()[i]:
+                    variables[f"{prefix}/Setup/{host}/frequency"] = (
+                        self.extract_step_frequency(i, host)
+                    )
+
+            for k in perf_events:
+                for socket in range(num_sockets):
+                    if self.num_nodes == 1:
+                        variables[f"{prefix}/perf/{socket}/{k}"] = (
+                            self.extract_step_perf_energy(i, k, socket)
+                        )
+                    else:
+                        for h, host in enumerate(self.job.nodelist):
+                            variables[f"{prefix}/perf/{host}/{socket}/{k}"] = (
+                                self.extract_step_perf_energy(i, k, socket, h)
+                            )
+
+            if use_bmc:
+                for nodename in self.database_query_node_names:
+                    variables[f"{prefix}/BMC/{nodename}"] = (
+                        self.extract_step_bmc_energy(i, nodename)
+                    )
+
+        # the plain times are those of the last step only
+        perf_variables = {
+            k: v
+            for (k, v) in (self.perf_variables or {}).items()
+            if k not in ("Core time", "Total time")
+        }
+        self.perf_variables = {**perf_variables, **variables}
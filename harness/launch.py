@@ -0,0 +1,124 @@
+import os
+import logging
+
+from reframe.core.exceptions import SanityError
+
+import harness.utils as utils
+
+logger = logging.getLogger(__name__)
+
+# the commands around the launch, from the outermost in: the node setup, the
+# node state snapshots, the loop of the batched runs, the step markers, the
+# RAPL counter reads and the launch markers
+LAUNCH_LAYERS = ["setup", "quality", "loop", "step", "rapl", "phases"]
+
+SPECHPC_PASSED = "Verification: PASSED"
+
+
+def _layered_before(layers: dict) -> list:
+    return [c for name in LAUNCH_LAYERS for c in layers.get(name, ([], []))[0]]
+
+
+def _layered_after(layers: dict) -> list:
+    return [
+        c for name in reversed(LAUNCH_LAYERS) for c in layers.get(name, ([], []))[1]
+    ]
+
+
+def set_launch_layer(test, layer: str, before=(), after=()):
+    """
+    Sets the commands of `layer` to run just before and just after the launch
+    of a test, nested in the order of `LAUNCH_LAYERS` whichever order the
+    hooks run in. Setting a layer again replaces its commands.
+
+    The layers are kept at the end of the pre-run and the start of the
+    post-run commands, so other commands have to be put before the pre-run or
+    after the post-run commands, or a `ValueError` is raised.
+    """
+    if layer not in LAUNCH_LAYERS:
+        raise ValueError(f"Unknown launch layer {layer}")
+
+    layers = getattr(test, "_launch_layers", None) or {}
+    prerun_cmds = list(test.prerun_cmds or [])
+    postrun_cmds = list(test.postrun_cmds or [])
+
+    before_cmds = _layered_before(layers)
+    after_cmds = _layered_after(layers)
+    tail = len(prerun_cmds) - len(before_cmds)
+    if (
+        prerun_cmds[tail:] != before_cmds
+        or postrun_cmds[: len(after_cmds)] != after_cmds
+    ):
+        raise ValueError(
+            "Commands were added inside the launch layers of "
+            f"{getattr(test, 'display_name', test)}"
+        )
+
+    layers[layer] = (list(before), list(after))
+    test._launch_layers = layers
+    test.prerun_cmds = prerun_cmds[:tail] + _layered_before(layers)
+    test.postrun_cmds = _layered_after(layers) + postrun_cmds[len(after_cmds) :]
+
+
+def step_marker_cmd(kind: str, steps_file: str) -> str:
+    return (
+        f'echo "{utils.STEP_MARKER} $SRFM_STEP {kind} $(date +%s.%N)"'
+        f" | tee -a {steps_file} >&2"
+    )
+
+
+def set_step_loop(
+    test,
+    header: list,
+    footer: list,
+    steps_file: str,
+    spectimes_format: str,
+    step_cmds=(),
+):
+    """
+    Runs the launch once for every step of a shell loop opened by `header`,
+    which must set `SRFM_STEP`, and closed by `footer`. The `step_cmds`, e.g.
+    the node setup of the step, run at the start of each step.
+
+    Every step is marked with `utils.STEP_MARKER` lines in `steps_file` and
+    stderr, and its SPEChpc times are kept in `spectimes_format`. The times of
+    the step before are removed first, so a failed launch leaves no times.
+    """
+    spectimes = test.spectimes_path
+    set_launch_layer(
+        test,
+        "loop",
+        [*header, *step_cmds, f"rm -f {spectimes}"],
+        [f'cp {spectimes} "{spectimes_format.format("$SRFM_STEP")}"', *footer],
+    )
+    set_launch_layer(
+        test,
+        "step",
+        [step_marker_cmd("start", steps_file)],
+        [step_marker_cmd("end", steps_file)],
+    )
+
+
+def assert_steps_passed(stagedir: str, spectimes_format: str, steps):
+    """
+    Raises a `SanityError` if the SPEChpc run of any of the `steps` did not
+    pass its verification, or if there are no steps.
+    """
+    steps = list(steps)
+    if not steps:
+        raise SanityError("No steps were run")
+
+    failed = []
+    for step in steps:
+        path = os.path.join(stagedir, spectimes_format.format(step))
+        if not os.path.isfile(path):
+            failed.append(step)
+            continue
+        with open(path) as f:
+            if SPECHPC_PASSED not in f.read():
+                failed.append(step)
+
+    if failed:
+        raise SanityError(
+            f"Steps {', '.join(str(s) for s in failed)} did not pass verification"
+        )
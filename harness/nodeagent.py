@@ -0,0 +1,316 @@
+"""
+Configures the CPU governor, frequency and powercap of the local node in one
+go, then polls the readbacks until every setting has taken effect or the
+timeout passes. Run on the compute nodes as part of a job, so it only uses the
+standard library and does not import the rest of the harness.
+
+Usage:
+
+    python3 nodeagent.py apply --frequency 1800 --powercap 650 --output nodesetup.{host}.json
+    python3 nodeagent.py --sysfs-root /tmp/fake-node apply --governor powersave
+
+The governor and frequency are set with `cpupower`, and read back from the
+`scaling_governor` and `scaling_cur_freq` of every CPU. The powercap is set
+and read back with `racadm`, in parallel with the CPU settings since the BMC
+takes a few seconds to answer.
+
+With `--sysfs-root`, nothing is run with `sudo`: the settings are written
+straight to the cpufreq files under that root, with `scaling_cur_freq`
+following the frequency as the hardware would, and the powercap goes to
+`<root>/racadm/system.power.cap.watts`. This is a dry run of the whole setup
+against a fake node.
+
+The outcome is written as JSON with, for each setting, the target, the value
+read back, whether it matched and how long it took. The exit code is 1 if any
+setting did not take effect.
+"""
+
+import os
+import re
+import sys
+import json
+import time
+import socket
+import argparse
+import statistics
+import subprocess
+import threading
+
+CPU_ROOT = "/sys/devices/system/cpu"
+RACADM_PATH = "/opt/dell/srvadmin/sbin/racadm"
+POWERCAP_ATTRIBUTE = "system.power.cap.watts"
+KHZ_PER_MHZ = 1000
+
+CPU_REGEX = re.compile(r"^cpu\d+$")
+
+
+def _read(path: str) -> str:
+    with open(path) as f:
+        return f.read().strip()
+
+
+def _write(path: str, value: str):
+    with open(path, "w") as f:
+        f.write(value)
+
+
+def _run(cmd: list) -> str:
+    return subprocess.run(
+        cmd, check=True, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True
+    ).stdout
+
+
+class CPUFreq:
+    """
+    The cpufreq settings of every CPU, set through `cpupower`, or written
+    directly if `dry_run`.
+    """
+
+    def __init__(self, root: str = CPU_ROOT, dry_run: bool = False):
+        self.dry_run = dry_run
+        self.policies = sorted(
+            os.path.join(root, d, "cpufreq")
+            for d in os.listdir(root)
+            if CPU_REGEX.match(d) and os.path.isdir(os.path.join(root, d, "cpufreq"))
+        )
+
+    def _write_all(self, name: str, value: str):
+        for p in self.policies:
+            _write(os.path.join(p, name), value)
+
+    def set_governor(self, governor: str):
+        if self.dry_run:
+            self._write_all("scaling_governor", governor)
+        else:
+            _run(["sudo", "cpupower", "frequency-set", "-g", governor])
+
+    def set_frequency(self, mhz: float):
+        if self.dry_run:
+            khz = str(int(mhz * KHZ_PER_MHZ))
+            self._write_all("scaling_min_freq", khz)
+            self._write_all("scaling_max_freq", khz)
+            self._write_all("scaling_cur_freq", khz)
+        else:
+            _run(["sudo", "cpupower", "frequency-set", "-f", f"{mhz:g}mhz"])
+
+    def governors(self) -> set:
+        return {_read(os.path.join(p, "scaling_governor")) for p in self.policies}
+
+    def frequency(self) -> float:
+        """
+        The median current frequency over the CPUs in MHz.
+        """
+        return statistics.median(
+            int(_read(os.path.join(p, "scaling_cur_freq"))) / KHZ_PER_MHZ
+            for p in self.policies
+        )
+
+
+class Racadm:
+    """
+    The powercap of the node through the BMC, or a file under `root` if given.
+    """
+
+    def __init__(self, path: str = RACADM_PATH, root: str = None):
+        self.path = path
+        self.file = None
+        if root is not None:
+            self.file = os.path.join(root, "racadm", POWERCAP_ATTRIBUTE)
+
+    def set(self, watts: int):
+        if self.file:
+            os.makedirs(os.path.dirname(self.file), exist_ok=True)
+            _write(self.file, f"{watts} W")
+        else:
+            _run(["sudo", self.path, "set", POWERCAP_ATTRIBUTE, str(watts)])
+
+    def get(self):
+        if self.file:
+            text = _read(self.file)
+        else:
+            text = _run(["sudo", self.path, "get", POWERCAP_ATTRIBUTE])
+        # e.g. `650 W`, as the first line
+        try:
+            return int(text.splitlines()[0].split()[0])
+        except (IndexError, ValueError):
+            return None
+
+
+def poll(read, check, timeout: float, interval: float) -> tuple:
+    """
+    Reads until `check(value)` holds or `timeout` seconds pass. Returns the
+    last value, whether it passed, and the time taken.
+    """
+    start = time.monotonic()
+    while True:
+        try:
+            value = read()
+        except (OSError, subprocess.CalledProcessError, statistics.StatisticsError):
+            value = None
+        elapsed = time.monotonic() - start
+        if value is not None and check(value):
+            return value, True, elapsed
+        if elapsed >= timeout:
+            return value, False, elapsed
+        time.sleep(interval)
+
+
+def _apply_setting(
+    results: dict, name: str, target, apply, read, check, timeout, interval
+):
+    start = time.monotonic()
+    try:
+        apply()
+    except (OSError, subprocess.CalledProcessError) as e:
+        _log(f"Could not set the {name}: {e}")
+        results[name] = {"target": target, "achieved": None, "ok": False}
+        return
+
+    value, ok, _ = poll(read, check, timeout, interval)
+    results[name] = {
+        "target": target,
+        "achieved": value,
+        "ok": ok,
+        "latency": time.monotonic() - start,
+    }
+    if not ok:
+        _log(f"The {name} did not take effect: {value} is not {target}")
+
+
+def _apply_cpu(results: dict, cpufreq: CPUFreq, args):
+    if args.governor:
+        _apply_setting(
+            results,
+            "governor",
+            args.governor,
+            lambda: cpufreq.set_governor(args.governor),
+            cpufreq.governors,
+            lambda v: v == {args.governor},
+            args.timeout,
+            args.poll_interval,
+        )
+        results["governor"]["achieved"] = sorted(results["governor"]["achieved"] or [])
+
+    if args.frequency:
+        _apply_setting(
+            results,
+            "frequency",
+            args.frequency,
+            lambda: cpufreq.set_frequency(args.frequency),
+            cpufreq.frequency,
+            lambda v: abs(v - args.frequency) <= args.frequency_tolerance,
+            args.timeout,
+            args.poll_interval,
+        )
+
+
+def _log(msg: str):
+    print(f"nodeagent.py [{_hostname()}]: {msg}", file=sys.stderr)
+
+
+def _hostname() -> str:
+    # short name, as in the scheduler's node list
+    return socket.gethostname().split(".")[0]
+
+
+def _format_path(path: str) -> str:
+    return path.format(host=_hostname())
+
+
+def _apply(args) -> int:
+    dry_run = args.sysfs_root != CPU_ROOT
+    start = time.monotonic()
+    results = {}
+
+    threads = []
+    if args.powercap:
+        racadm = Racadm(args.racadm, args.sysfs_root if dry_run else None)
+        threads.append(
+            threading.Thread(
+                target=_apply_setting,
+                args=(
+                    results,
+                    "powercap",
+                    args.powercap,
+                    lambda: racadm.set(args.powercap),
+                    racadm.get,
+                    lambda v: v == args.powercap,
+                    args.timeout,
+                    # the BMC is slow to answer, so poll it less often
+                    max(args.poll_interval, 1.0),
+                ),
+            )
+        )
+    if args.governor or args.frequency:
+        cpufreq = CPUFreq(args.sysfs_root, dry_run)
+        threads.append(
+            threading.Thread(target=_apply_cpu, args=(results, cpufreq, args))
+        )
+
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    ok = all(r["ok"] for r in results.values())
+    outcome = {
+        "host": _hostname(),
+        "dry_run": dry_run,
+        "ok": ok,
+        "elapsed": time.monotonic() - start,
+        "settings": results,
+    }
+
+    text = json.dumps(outcome)
+    if args.output:
+        with open(_format_path(args.output), "w") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+
+    summary = ", ".join(
+        f"{k} {v['achieved']} ({'ok' if v['ok'] else 'FAILED'})"
+        for (k, v) in results.items()
+    )
+    _log(f"Setup in {outcome['elapsed']:.2f} s: {summary}")
+    return 0 if ok else 1
+
+
+def _parse_args(argv):
+    parser = argparse.ArgumentParser(
+        prog="nodeagent.py", description=__doc__.split("\n\n")[0]
+    )
+    parser.add_argument(
+        "--sysfs-root",
+        default=CPU_ROOT,
+        help="root of the cpufreq files; anything but the default is a dry run",
+    )
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    apply = commands.add_parser("apply", help="apply and verify the settings")
+    apply.add_argument("--governor")
+    apply.add_argument("--frequency", type=float, help="in MHz")
+    apply.add_argument(
+        "--frequency-tolerance",
+        type=float,
+        default=50.0,
+        help="how far the median frequency may be from the target, in MHz",
+    )
+    apply.add_argument("--powercap", type=int, help="in watts")
+    apply.add_argument("--racadm", default=RACADM_PATH)
+    apply.add_argument("--timeout", type=float, default=30.0, help="in seconds")
+    apply.add_argument("--poll-interval", type=float, default=0.1, help="in seconds")
+    apply.add_argument(
+        "--output", help="file to write to, `{host}` is replaced by the hostname"
+    )
+
+    return parser.parse_args(argv)
+
+
+def main(argv=None) -> int:
+    args = _parse_args(argv)
+    return _apply(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,142 @@
+import os
+import glob
+import json
+import logging
+
+import reframe as rfm
+import reframe.core.builtins as blt
+
+import harness.utils as utils
+import harness.launch as launch
+from harness.nodeagent import CPU_ROOT
+
+logger = logging.getLogger(__name__)
+
+NODE_SETUP_DEBUG = os.environ.get("SRFM_NODE_SETUP_DEBUG", None) is not None
+
+if NODE_SETUP_DEBUG:
+    logger.warn(
+        "SRFM_NODE_SETUP_DEBUG is set. Will not attempt to set CPU frequencies or power caps."
+    )
+
+NODE_AGENT_SCRIPT = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "nodeagent.py"
+)
+NODE_SETUP_FORMAT = "nodesetup.{host}.json"
+NODE_SETUP_GLOB = "nodesetup.*.json"
+
+
+class NodeSetupBase(rfm.RegressionMixin):
+    """
+    Applies every node setting of a test, e.g. frequency and powercap, with a
+    single `nodeagent.py apply` on each node before the run, which waits for
+    the readbacks to match. The job exits if any setting did not take effect.
+    Mixins add their settings by extending `node_setup_args`.
+
+    The setup time of each node and the values it achieved are reported as
+    `Setup/<node>/time`, `Setup/<node>/frequency` and `Setup/<node>/powercap`.
+    Set `node_setup_sysfs_root` to a fake sysfs to dry-run the setup there.
+    """
+
+    # plain attributes rather than variables, as the frequency and powercap
+    # mixins both derive from this class and variables cannot be inherited
+    # twice
+
+    # seconds to wait for the settings to take effect
+    node_setup_timeout = 30.0
+    # how far the median CPU frequency may be from the target, in MHz
+    node_setup_frequency_tolerance = 50.0
+    node_setup_sysfs_root = CPU_ROOT
+
+    def node_setup_args(self) -> list:
+        """
+        Returns the arguments of `nodeagent.py apply` for the settings of this
+        test. Extend with `super().node_setup_args() + [...]`.
+        """
+        return []
+
+    def node_setup_cmd(self, args=None, output=NODE_SETUP_FORMAT) -> str:
+        if args is None:
+            args = self.node_setup_args()
+        if not args:
+            return None
+
+        cmd = " ".join(
+            [
+                "python3",
+                NODE_AGENT_SCRIPT,
+                f"--sysfs-root {self.node_setup_sysfs_root}",
+                "apply",
+                *args,
+                f"--frequency-tolerance {self.node_setup_frequency_tolerance}",
+                f"--timeout {self.node_setup_timeout}",
+                f"--output {output}",
+            ]
+        )
+        return utils.multiplex_for_each_node(cmd, self.num_nodes, NODE_SETUP_DEBUG)
+
+    @blt.run_before("run", always_last=True)
+    def apply_node_setup(self):
+        cmd = self.node_setup_cmd()
+        if cmd is None:
+            return
+
+        # the job scripts do not stop on errors, so a node that could not be
+        # set up ends the job rather than running with the wrong settings
+        launch.set_launch_layer(self, "setup", [f"{cmd} || exit 1"])
+
+    def _node_setup_results(self) -> dict:
+        results = getattr(self, "_node_setup_parsed", None)
+        if results is None:
+            results = {}
+            for path in sorted(glob.glob(os.path.join(self.stagedir, NODE_SETUP_GLOB))):
+                with open(path) as f:
+                    outcome = json.load(f)
+                results[outcome["host"]] = outcome
+            self._node_setup_parsed = results
+
+        return results
+
+    @blt.performance_function("s")
+    def _node_setup_extract_time(self, host=None):
+        return self._node_setup_results()[host]["elapsed"]
+
+    def _node_setup_achieved(self, host, setting) -> float:
+        achieved = self._node_setup_results()[host]["settings"][setting]["achieved"]
+        if achieved is None:
+            raise ValueError(f"The {setting} of {host} could not be read back")
+        return achieved
+
+    @blt.performance_function("MHz")
+    def _node_setup_extract_frequency(self, host=None):
+        return self._node_setup_achieved(host, "frequency")
+
+    @blt.performance_function("W")
+    def _node_setup_extract_powercap(self, host=None):
+        return self._node_setup_achieved(host, "powercap")
+
+    @blt.run_before("performance", always_last=True)
+    def _node_setup_set_variables(self):
+        if not self.node_setup_args() or NODE_SETUP_DEBUG:
+            return
+
+        results = self._node_setup_results()
+        if not results:
+            logger.warn("No node setup results were recorded")
+
+        variables = {}
+        for host, outcome in results.items():
+            variables[f"Setup/{host}/time"] = self._node_setup_extract_time(host)
+            if "frequency" in outcome["settings"]:
+                variables[f"Setup/{host}/frequency"] = (
+                    self._node_setup_extract_frequency(host)
+                )
+            if "powercap" in outcome["settings"]:
+                variables[f"Setup/{host}/powercap"] = self._node_setup_extract_powercap(
+                    host
+                )
+
+        if self.perf_variables:
+            self.perf_variables = {**self.perf_variables, **variables}
+        else:
+            self.perf_variables = variables
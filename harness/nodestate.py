@@ -0,0 +1,267 @@
+"""
+Records the state of the local node that makes runs slow or noisy: the load
+average, processes other than the job using the CPU, the thermal throttling
+counters, whether turbo / boost is on, and which C-states are enabled. Run on
+the compute nodes as part of a job, so it only uses the standard library and
+does not import the rest of the harness.
+
+Usage:
+
+    python3 nodestate.py snapshot --output nodestate.{host}.before.json
+    python3 nodestate.py --sysfs-root /tmp/fake-node/cpu --proc-root /tmp/fake-node/proc snapshot
+
+Stray processes are those that used more than `--cpu-threshold` of a core
+over `--interval` seconds, other than this script and the processes of the
+job shell it runs from. Any value that cannot be read, e.g. the boost state on
+a driver without one, is `null`.
+"""
+
+import os
+import re
+import sys
+import json
+import time
+import socket
+import argparse
+
+CPU_ROOT = "/sys/devices/system/cpu"
+PROC_ROOT = "/proc"
+CLOCK_TICKS = os.sysconf("SC_CLK_TCK") if hasattr(os, "sysconf") else 100
+# most processes to list
+MAX_STRAY = 10
+
+CPU_REGEX = re.compile(r"^cpu\d+$")
+
+
+def _read(path: str) -> str:
+    with open(path) as f:
+        return f.read().strip()
+
+
+def _read_int(path: str):
+    try:
+        return int(_read(path))
+    except (OSError, ValueError):
+        return None
+
+
+def _cpus(cpu_root: str) -> list:
+    return sorted(
+        (os.path.join(cpu_root, d) for d in os.listdir(cpu_root) if CPU_REGEX.match(d)),
+        key=lambda p: int(os.path.basename(p)[3:]),
+    )
+
+
+def load_average(proc_root: str = PROC_ROOT):
+    """
+    The 1, 5 and 15 minute load averages and the number of running tasks.
+    """
+    try:
+        fields = _read(os.path.join(proc_root, "loadavg")).split()
+    except OSError:
+        return None
+    return {
+        "load": [float(v) for v in fields[:3]],
+        "running": int(fields[3].split("/")[0]),
+    }
+
+
+def throttle_counts(cpu_root: str = CPU_ROOT):
+    """
+    The thermal throttle events of all cores, and of all packages, counting
+    each package once. `None` if the counters are not exposed.
+    """
+    core, package = None, {}
+    for cpu in _cpus(cpu_root):
+        directory = os.path.join(cpu, "thermal_throttle")
+        count = _read_int(os.path.join(directory, "core_throttle_count"))
+        if count is not None:
+            core = (core or 0) + count
+
+        count = _read_int(os.path.join(directory, "package_throttle_count"))
+        if count is not None:
+            pkg = _read_int(os.path.join(cpu, "topology", "physical_package_id"))
+            package[pkg] = count
+
+    return {"core": core, "package": sum(package.values()) if package else None}
+
+
+def boost_enabled(cpu_root: str = CPU_ROOT):
+    """
+    Whether turbo / boost is on, from either the generic cpufreq switch or
+    that of `intel_pstate`.
+    """
+    boost = _read_int(os.path.join(cpu_root, "cpufreq", "boost"))
+    if boost is not None:
+        return bool(boost)
+    no_turbo = _read_int(os.path.join(cpu_root, "intel_pstate", "no_turbo"))
+    if no_turbo is not None:
+        return not no_turbo
+    return None
+
+
+def enabled_cstates(cpu_root: str = CPU_ROOT):
+    """
+    The names of the idle states enabled on the first CPU.
+    """
+    cpus = _cpus(cpu_root)
+    if not cpus:
+        return None
+    directory = os.path.join(cpus[0], "cpuidle")
+    if not os.path.isdir(directory):
+        return None
+
+    states = []
+    for d in sorted(os.listdir(directory)):
+        path = os.path.join(directory, d)
+        if _read_int(os.path.join(path, "disable")) == 0:
+            try:
+                states.append(_read(os.path.join(path, "name")))
+            except OSError:
+                continue
+    return states
+
+
+def _ancestors(proc_root: str, pid: int) -> set:
+    pids = set()
+    while pid > 1 and pid not in pids:
+        pids.add(pid)
+        stat = _process_stat(proc_root, pid)
+        if stat is None:
+            break
+        pid = stat[1]
+    return pids
+
+
+def _process_stat(proc_root: str, pid: int):
+    # the command name is in brackets and may contain spaces
+    try:
+        text = _read(os.path.join(proc_root, str(pid), "stat"))
+    except OSError:
+        return None
+    name = text[text.index("(") + 1 : text.rindex(")")]
+    fields = text[text.rindex(")") + 2 :].split()
+    # ppid, utime and stime
+    return name, int(fields[1]), int(fields[11]) + int(fields[12])
+
+
+def _cpu_ticks(proc_root: str) -> dict:
+    ticks = {}
+    for d in os.listdir(proc_root):
+        if not d.isdigit():
+            continue
+        stat = _process_stat(proc_root, int(d))
+        if stat is not None:
+            ticks[int(d)] = stat
+    return ticks
+
+
+def stray_processes(proc_root: str, interval: float, threshold: float) -> list:
+    """
+    The busiest processes using more than `threshold` of a core over
+    `interval` seconds, excluding this script and the shell it runs in.
+    """
+    ignore = _ancestors(proc_root, os.getpid())
+    before = _cpu_ticks(proc_root)
+    time.sleep(interval)
+    after = _cpu_ticks(proc_root)
+
+    stray = []
+    for pid, (name, ppid, ticks) in after.items():
+        if pid in ignore or ppid in ignore or pid not in before:
+            continue
+        share = (ticks - before[pid][2]) / CLOCK_TICKS / interval
+        if share > threshold:
+            stray.append({"pid": pid, "name": name, "cpu": share})
+
+    stray.sort(key=lambda p: p["cpu"], reverse=True)
+    return stray[:MAX_STRAY]
+
+
+def snapshot(cpu_root: str, proc_root: str, interval: float, threshold: float):
+    t = time.time()
+    loadavg = load_average(proc_root)
+    stray = stray_processes(proc_root, interval, threshold)
+    # helpers such as `srun` or the samplers are only running for a moment, so
+    # keep the lower count of the reads either side of the interval
+    later = load_average(proc_root)
+    if loadavg is not None and later is not None:
+        loadavg["running"] = min(loadavg["running"], later["running"])
+
+    return {
+        "host": _hostname(),
+        "time": t,
+        "loadavg": loadavg,
+        "stray": stray,
+        "throttle": throttle_counts(cpu_root),
+        "boost": boost_enabled(cpu_root),
+        "cstates": enabled_cstates(cpu_root),
+    }
+
+
+def _log(msg: str):
+    print(f"nodestate.py [{_hostname()}]: {msg}", file=sys.stderr)
+
+
+def _hostname() -> str:
+    # short name, as in the scheduler's node list
+    return socket.gethostname().split(".")[0]
+
+
+def _format_path(path: str) -> str:
+    return path.format(host=_hostname())
+
+
+def _snapshot(args) -> int:
+    state = snapshot(args.sysfs_root, args.proc_root, args.interval, args.cpu_threshold)
+
+    text = json.dumps(state)
+    if args.output:
+        with open(_format_path(args.output), "w") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+
+    load = state["loadavg"]["load"][0] if state["loadavg"] else None
+    _log(
+        f"load {load}, {len(state['stray'])} stray processes,"
+        f" boost {state['boost']}, throttled {state['throttle']['package']}"
+    )
+    return 0
+
+
+def _parse_args(argv):
+    parser = argparse.ArgumentParser(
+        prog="nodestate.py", description=__doc__.split("\n\n")[0]
+    )
+    parser.add_argument("--sysfs-root", default=CPU_ROOT)
+    parser.add_argument("--proc-root", default=PROC_ROOT)
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    snap = commands.add_parser("snapshot", help="record the state of the node")
+    snap.add_argument(
+        "--interval",
+        type=float,
+        default=1.0,
+        help="seconds to measure the CPU use of processes over",
+    )
+    snap.add_argument(
+        "--cpu-threshold",
+        type=float,
+        default=0.1,
+        help="share of a core above which a process is stray",
+    )
+    snap.add_argument(
+        "--output", help="file to write to, `{host}` is replaced by the hostname"
+    )
+
+    return parser.parse_args(argv)
+
+
+def main(argv=None) -> int:
+    args = _parse_args(argv)
+    return _snapshot(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
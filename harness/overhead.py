@@ -0,0 +1,109 @@
+"""
+Summarises the runs of `perf-overhead.py`: the Core time overhead of perf at
+each sampling interval relative to running without perf, per benchmark.
+
+Usage:
+
+    python -m harness.overhead report.json [report.json ...] [--threshold 0.01]
+"""
+
+import sys
+import logging
+import argparse
+import collections
+
+import harness.report as report
+import harness.stats as stats
+
+logger = logging.getLogger(__name__)
+
+# the test parameters written to the report
+BENCHMARK_KEY = "overhead_benchmark"
+INTERVAL_KEY = "overhead_poll_interval"
+# the interval used to mean perf is off
+PERF_OFF = 0
+
+DEFAULT_THRESHOLD = 0.01
+
+Overhead = collections.namedtuple(
+    "Overhead", ["benchmark", "interval", "runs", "overhead", "low", "high"]
+)
+
+
+def collect_times(reports, time_key: str = "Core time") -> dict:
+    """
+    Groups the runtimes of the test cases by `(benchmark, interval)`.
+    """
+    times = collections.defaultdict(list)
+    for r in reports:
+        for tc in report.iter_testcases(r):
+            if BENCHMARK_KEY not in tc or INTERVAL_KEY not in tc:
+                continue
+            values = report.perf_values(tc)
+            if time_key in values:
+                times[(tc[BENCHMARK_KEY], int(tc[INTERVAL_KEY]))].append(
+                    values[time_key]
+                )
+    return times
+
+
+def compute_overheads(times: dict, confidence=stats.DEFAULT_CONFIDENCE) -> list:
+    overheads = []
+    for (benchmark, interval), samples in sorted(times.items()):
+        if interval == PERF_OFF:
+            continue
+        baseline = times.get((benchmark, PERF_OFF), None)
+        if not baseline:
+            logger.warn("No runs without perf for %s", benchmark)
+            continue
+        overheads.append(
+            Overhead(
+                benchmark,
+                interval,
+                len(samples),
+                *stats.relative_difference_ci(baseline, samples, confidence),
+            )
+        )
+    return overheads
+
+
+def finest_interval(overheads: list, threshold: float = DEFAULT_THRESHOLD):
+    """
+    The shortest interval whose overhead is below `threshold` with confidence
+    for every benchmark, or `None` if there is none.
+    """
+    worst = collections.defaultdict(float)
+    for o in overheads:
+        worst[o.interval] = max(worst[o.interval], o.high)
+
+    below = [i for (i, high) in worst.items() if high < threshold]
+    return min(below) if below else None
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog="python -m harness.overhead",
+        description="Summarise the perf overhead runs.",
+    )
+    parser.add_argument("reports", nargs="+")
+    parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD)
+    parser.add_argument("--confidence", type=float, default=stats.DEFAULT_CONFIDENCE)
+    args = parser.parse_args(argv)
+
+    times = collect_times(report.load_report(path) for path in args.reports)
+    overheads = compute_overheads(times, args.confidence)
+
+    print(f"{'benchmark':<16} {'interval / ms':>14} {'runs':>5} {'overhead':>22}")
+    for o in overheads:
+        ci = f"{o.overhead:+.2%} [{o.low:+.2%}, {o.high:+.2%}]"
+        print(f"{o.benchmark:<16} {o.interval:>14} {o.runs:>5} {ci:>22}")
+
+    best = finest_interval(overheads, args.threshold)
+    if best is None:
+        print(f"No interval is below {args.threshold:.1%} overhead for all benchmarks")
+    else:
+        print(f"Finest interval below {args.threshold:.1%} overhead: {best} ms")
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,233 @@
+"""
+Time and energy analysis of frequency and powercap sweeps: the Pareto frontier
+of Core time against energy, the EDP and ED²P optima, and the speed and energy
+of each setting relative to the highest one, for every benchmark and
+partition of a campaign.
+
+Every run of the campaign is held in a single structured array, and each
+stage works on all of the benchmarks at once.
+
+Usage:
+
+    python -m harness.pareto report.json [perflog.log ...] [--energy bmc perf]
+"""
+
+import sys
+import logging
+import argparse
+
+import numpy as np
+
+import harness.report as report
+
+logger = logging.getLogger(__name__)
+
+SETTINGS = ("cpu_frequency", "powercap_value")
+
+RUN_DTYPE = np.dtype(
+    [
+        ("benchmark", "U64"),
+        ("partition", "U64"),
+        ("setting", np.float64),
+        ("time", np.float64),
+        ("energy", np.float64),
+    ]
+)
+
+POINT_DTYPE = np.dtype(
+    [
+        ("group", np.int64),
+        ("setting", np.float64),
+        ("runs", np.int64),
+        ("time", np.float64),
+        ("energy", np.float64),
+        ("edp", np.float64),
+        ("ed2p", np.float64),
+        ("speedup", np.float64),
+        ("relative_energy", np.float64),
+        ("pareto", np.bool_),
+    ]
+)
+
+
+def load_testcases(paths: list):
+    """
+    Reads test cases from ReFrame reports (`.json`) and perflogs (anything
+    else).
+    """
+    for path in paths:
+        if path.endswith(".json"):
+            yield from report.iter_testcases(report.load_report(path))
+        else:
+            yield from report.read_perflog(path)
+
+
+def _setting(testcase: dict, setting: str):
+    try:
+        return float(testcase.get(setting))
+    except (TypeError, ValueError):
+        return None
+
+
+def collect_runs(
+    testcases, setting: str = None, source: str = "bmc", time_key: str = "Core time"
+) -> np.array:
+    """
+    Gathers the setting, time and total energy from `source` of each run into
+    a `RUN_DTYPE` array. If `setting` is not given, it is whichever of
+    `SETTINGS` the first run with either has. Runs without the setting, time
+    or energy, and runs flagged by `RunQuality`, are left out.
+    """
+    rows = []
+    for tc in testcases:
+        if setting is None:
+            setting = next((s for s in SETTINGS if _setting(tc, s) is not None), None)
+            if setting is None:
+                continue
+
+        value = _setting(tc, setting)
+        values = report.perf_values(tc)
+        if report.is_flagged(values):
+            continue
+        energy = report.total_energy(values, source)
+        if value is None or energy is None or time_key not in values:
+            continue
+
+        rows.append(
+            (
+                report.benchmark_name(tc),
+                tc.get("partition") or "",
+                value,
+                values[time_key],
+                energy,
+            )
+        )
+
+    return np.array(rows, dtype=RUN_DTYPE)
+
+
+def _group_shift(values: np.array, group: np.array) -> np.array:
+    # lowers each group below all of the previous ones, so that a running
+    # minimum over values sorted by group restarts with every group
+    span = np.ptp(values) + 1.0 if len(values) else 0.0
+    return values - group * span
+
+
+def _group_first(group: np.array) -> np.array:
+    # the first index of each group in an array sorted by group
+    return np.flatnonzero(np.r_[True, group[1:] != group[:-1]])
+
+
+def analyse(runs: np.array) -> tuple:
+    """
+    Averages the repetitions of each setting and analyses every benchmark and
+    partition together. Returns the `(benchmark, partition)` of each group
+    and a `POINT_DTYPE` array of the settings, sorted by group and setting,
+    where `group` indexes the former.
+    """
+    keys, group = np.unique(
+        np.stack((runs["benchmark"], runs["partition"]), axis=1),
+        axis=0,
+        return_inverse=True,
+    )
+    group = group.reshape(-1)
+
+    # mean over the repetitions of each (group, setting)
+    points_keys, inverse, counts = np.unique(
+        np.stack((group.astype(np.float64), runs["setting"]), axis=1),
+        axis=0,
+        return_inverse=True,
+        return_counts=True,
+    )
+    inverse = inverse.reshape(-1)
+
+    points = np.zeros(len(points_keys), dtype=POINT_DTYPE)
+    points["group"] = points_keys[:, 0].astype(np.int64)
+    points["setting"] = points_keys[:, 1]
+    points["runs"] = counts
+    points["time"] = np.bincount(inverse, runs["time"]) / counts
+    points["energy"] = np.bincount(inverse, runs["energy"]) / counts
+    points["edp"] = points["energy"] * points["time"]
+    points["ed2p"] = points["edp"] * points["time"]
+
+    # relative to the highest setting of each group, which is the last
+    first = _group_first(points["group"])
+    last = np.r_[first[1:] - 1, len(points) - 1]
+    reference = np.repeat(last, last - first + 1)
+    points["speedup"] = points["time"][reference] / points["time"]
+    points["relative_energy"] = points["energy"] / points["energy"][reference]
+
+    # a point is on the frontier if no point of its group is both at least as
+    # fast and uses less energy: sorted by time, it has to beat the running
+    # minimum energy of all faster points
+    order = np.lexsort((points["energy"], points["time"], points["group"]))
+    g = points["group"][order]
+    e = _group_shift(points["energy"][order], g)
+    best_before = np.r_[np.inf, np.minimum.accumulate(e)[:-1]]
+    best_before[_group_first(g)] = np.inf
+    points["pareto"][order] = e < best_before
+
+    return [tuple(k) for k in keys], points
+
+
+def group_minima(points: np.array, metric: str) -> np.array:
+    """
+    Returns the index of the point with the smallest `metric` of each group.
+    """
+    order = np.lexsort((points[metric], points["group"]))
+    return order[_group_first(points["group"][order])]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog="python -m harness.pareto",
+        description="Pareto frontiers and EDP optima of sweep results.",
+    )
+    parser.add_argument("results", nargs="+", help="Reports or perflogs")
+    parser.add_argument(
+        "--energy",
+        nargs="+",
+        choices=report.ENERGY_SOURCES,
+        default=["bmc", "perf"],
+    )
+    parser.add_argument("--setting", choices=SETTINGS)
+    parser.add_argument("--time-key", default="Core time")
+    args = parser.parse_args(argv)
+
+    testcases = list(load_testcases(args.results))
+
+    for source in args.energy:
+        runs = collect_runs(testcases, args.setting, source, args.time_key)
+        if len(runs) == 0:
+            logger.warn("No runs with %s energy", source)
+            continue
+
+        keys, points = analyse(runs)
+        edp = set(group_minima(points, "edp"))
+        ed2p = set(group_minima(points, "ed2p"))
+
+        print(f"# {source} energy")
+        print(
+            f"{'benchmark':<16} {'partition':<12} {'setting':>8} {'runs':>4}"
+            f" {'time / s':>9} {'energy / J':>11} {'speed':>6} {'energy':>6}"
+        )
+        for i, p in enumerate(points):
+            benchmark, partition = keys[p["group"]]
+            marks = " ".join(
+                m
+                for (m, on) in (
+                    ("pareto", p["pareto"]),
+                    ("EDP", i in edp),
+                    ("ED2P", i in ed2p),
+                )
+                if on
+            )
+            print(
+                f"{benchmark:<16} {partition:<12} {p['setting']:>8g} {p['runs']:>4}"
+                f" {p['time']:>9.2f} {p['energy']:>11.1f} {p['speedup']:>6.3f}"
+                f" {p['relative_energy']:>6.3f} {marks}"
+            )
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,44 @@
+#!/bin/bash
+# Runs a single rank of an MPI job, with the node-local rank 0 also running a
+# system-wide `perf stat` for as long as its own rank runs.
+#
+# usage: perf-leader.sh <output prefix> <step> <perf stat args...> -- <command...>
+#
+# The perf output of each node goes to `<output prefix>.<short hostname>.txt`.
+# If `step` is not negative, a step marker with the current time is written to
+# the output first, so the intervals of batched runs can be told apart.
+
+output="$1"
+step="$2"
+shift 2
+
+perf_args=()
+while [ "$#" -gt 0 ] && [ "$1" != "--" ]; do
+    perf_args+=("$1")
+    shift
+done
+shift
+
+# srun, Intel MPI, Open MPI, MPICH (hydra) and PALS respectively
+local_rank="${SLURM_LOCALID:-${MPI_LOCALRANKID:-${OMPI_COMM_WORLD_LOCAL_RANK:-${PMI_LOCAL_RANK:-${PALS_LOCAL_RANKID:-0}}}}}"
+
+if [ "$local_rank" != "0" ]; then
+    exec "$@"
+fi
+
+file="${output}.$(hostname -s).txt"
+if [ "$step" -ge 0 ]; then
+    echo "SRFM_STEP $step start $(date +%s.%N)" >> "$file"
+fi
+
+# background jobs ignore SIGINT unless it is reset, and perf is stopped with it
+(trap - INT; exec perf stat "${perf_args[@]}" --append -o "$file") &
+perf_pid=$!
+
+"$@"
+status=$?
+
+# perf writes out the last interval on SIGINT
+kill -INT "$perf_pid"
+wait "$perf_pid"
+exit "$status"
@@ -1,16 +1,29 @@
+import os
 import logging
 
+import numpy as np
+
 import reframe.utility.typecheck as typ
+import reframe.utility.sanity as sn
 import reframe.core.builtins as blt
 import reframe as rfm
 
 from reframe.core.launchers import JobLauncher
 
 import harness.utils as utils
+import harness.config as config
 
 MS_PER_SECOND = 1000
 MPI_TASK_SEPERATOR = ": \\\n    "
 
+PERF_LEADER_SCRIPT = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "perf-leader.sh"
+)
+# per-node perf output of the leader launch
+PERF_OUTPUT_FORMAT = "perf.{host}.txt"
+
+PERF_LAUNCH_MODES = ("leader", "mpmd")
+
 logger = logging.getLogger(__name__)
 
 
@@ -24,6 +37,55 @@ class PerfEvents:
     power = _Power()
 
 
+class PerfIntervals:
+    """
+    Index over the records returned by `utils.read_perf_intervals`, so that the
+    measurements of each `(host, socket, event)` can be sliced out as views
+    without reading the perf output again.
+    """
+
+    def __init__(self, records: np.array):
+        order = np.lexsort(
+            (records["time"], records["event"], records["socket"], records["host"])
+        )
+        self.records = records[order]
+
+        # find the boundaries of each (host, socket, event) group
+        r = self.records
+        changes = (
+            np.flatnonzero(
+                (r["host"][1:] != r["host"][:-1])
+                | (r["socket"][1:] != r["socket"][:-1])
+                | (r["event"][1:] != r["event"][:-1])
+            )
+            + 1
+        )
+        starts = np.concatenate(([0], changes)) if len(r) else []
+        ends = np.concatenate((changes, [len(r)])) if len(r) else []
+
+        self._groups = {
+            (int(r["host"][i]), int(r["socket"][i]), int(r["event"][i])): slice(i, j)
+            for (i, j) in zip(starts, ends)
+        }
+
+    def groups(self) -> list:
+        """
+        Returns the `(host, socket, event)` of every group with records.
+        """
+        return list(self._groups)
+
+    def select(self, host: int, socket: int, event: int, step=None) -> np.array:
+        """
+        Returns the records of a single host, socket and event in time order.
+        Use `host = -1` for single-node output. If `step` is given, only the
+        records of that step of a batched run are returned.
+        """
+        records = self.records[self._groups.get((host, socket, event), slice(0, 0))]
+        if step is None:
+            return records
+        return records[records["step"] == step]
+
+
 def _line_of_file(line, filename) -> str:
     return f'sed "{line}q;d" {filename}'
 
@@ -39,8 +101,10 @@ class PerfLauncherWrapper(JobLauncher):
 
         perf stat [...] mpirun [...] ./a.out
 
-    When it is >1, the wrapper is in `"multi-node"` mode, and instead an
-    "Unusual MPI" job is launched
+    Multi-node jobs use `PerfLeaderLauncherWrapper` by default
+    (`perf_launch_mode = "leader"`). Only with the opt-in
+    `perf_launch_mode = "mpmd"` is this wrapper used in `"multi-node"` mode,
+    where an "Unusual MPI" job is launched, which only works with Intel MPI
 
         mpirun \
             --host A -n 1 perf stat [...] ./a.out \
@@ -57,9 +121,13 @@ class PerfLauncherWrapper(JobLauncher):
         executable,
         executable_opts,
         num_nodes,
+        poll_interval=None,
     ):
         super().__init__()
 
+        if poll_interval is not None:
+            self.poll_interval = poll_interval
+
         self.perf_command = ["perf", "stat"]
         self.perf_command += [
             # don't change the output of numbers depending on locale
@@ -122,8 +190,70 @@ class PerfLauncherWrapper(JobLauncher):
             ]
 
 
+class PerfLeaderLauncherWrapper(PerfLauncherWrapper):
+    """
+    Wraps every rank of a normal launch in `perf-leader.sh`, which runs a
+    system-wide perf on node-local rank 0 of each node only:
+
+        mpirun [...] bash perf-leader.sh perf <step> [perf args] -- ./a.out
+
+    The command stays the same length for any number of nodes, does not need a
+    hostfile, and works with any launcher that sets a local rank variable
+    (srun, Intel MPI, Open MPI). The perf output of each node is written to
+    `PERF_OUTPUT_FORMAT` rather than stderr.
+    """
+
+    def command(self, job):
+        prefix = PERF_OUTPUT_FORMAT.split(".{host}")[0]
+        return self._target_launcher.command(job) + [
+            "bash",
+            PERF_LEADER_SCRIPT,
+            prefix,
+            # set by the batched frequency sweeps
+            "${SRFM_STEP:--1}",
+            # without the leading `perf stat`
+            *self.perf_command[2:],
+            "--",
+        ]
+
+    def additional_prerun_cmds(self):
+        return []
+
+
+class SetupPerfEvents(rfm.RegressionMixin):
+    """
+    Helper mixin that selects the available perf events depending on the
+    partition the job is being run on.
+    """
+
+    @blt.run_after("setup")
+    def set_perf_events(self):
+        partition_name = self.current_partition.name
+        if partition_name in (config.SAPPHIRE, config.ICELAKE):
+            self.perf_events = [
+                PerfEvents.power.energy_ram,
+                PerfEvents.power.energy_pkg,
+            ]
+        elif partition_name == config.CASCADE_LAKE:
+            self.perf_events = [
+                PerfEvents.power.energy_cores,
+                PerfEvents.power.energy_ram,
+                PerfEvents.power.energy_pkg,
+            ]
+        else:
+            self.perf_events = [
+                PerfEvents.power.energy_cores,
+                PerfEvents.power.energy_pkg,
+            ]
+
+
 class PerfInstrument(rfm.RegressionMixin):
     perf_events = variable(typ.List[str], value=[])
+    # milliseconds between perf samples
+    perf_poll_interval = variable(int, value=PerfLauncherWrapper.poll_interval)
+    # how perf is launched on each node of multi-node jobs, one of
+    # `PERF_LAUNCH_MODES`. `mpmd` is the old Intel MPI only launch
+    perf_launch_mode = variable(str, value="leader")
 
     # prefix all names with _perf_instrument_* to avoid namespace collisions
     def _perf_instrument_check_preconditions(self):
@@ -150,17 +280,60 @@ class PerfInstrument(rfm.RegressionMixin):
 
         logger.debug("perf events selected %s", self.perf_events)
 
+        if self.perf_launch_mode not in PERF_LAUNCH_MODES:
+            raise ValueError(f"Unknown perf launch mode {self.perf_launch_mode}")
+
+        wrapper = PerfLauncherWrapper
+        if self.num_nodes > 1 and self.perf_launch_mode == "leader":
+            wrapper = PerfLeaderLauncherWrapper
+
         # use the perf wrapper only if we're measuring perf events
         if self.perf_events:
-            self.job.launcher = PerfLauncherWrapper(
+            self.job.launcher = wrapper(
                 self.job.launcher,
                 self.perf_events,
                 self.executable,
                 self.executable_opts,
                 self.num_nodes,
+                self.perf_poll_interval,
+            )
+            # get any additional pre-run commands, ahead of the launch layers
+            self.prerun_cmds = self.job.launcher.additional_prerun_cmds() + (
+                self.prerun_cmds or []
             )
-            # get any additional pre-run commands
-            self.prerun_cmds += self.job.launcher.additional_prerun_cmds()
+
+    def _perf_instrument_intervals(self) -> PerfIntervals:
+        # the perf output is parsed once, the first time any of the
+        # performance functions are evaluated, and then sliced for each metric
+        intervals = getattr(self, "_perf_instrument_parsed", None)
+        if intervals is None:
+            intervals = PerfIntervals(self._perf_instrument_read_records())
+            self._perf_instrument_parsed = intervals
+
+        return intervals
+
+    def _perf_instrument_read_records(self) -> np.array:
+        if self.num_nodes == 1 or self.perf_launch_mode == "mpmd":
+            path = os.path.join(self.stagedir, sn.evaluate(self.stderr))
+            logger.debug("Parsing perf output from %s", path)
+            return utils.read_perf_intervals(path, self.perf_events)
+
+        # one file per node, numbered in node list order as in the mpmd launch
+        records = []
+        for i, host in enumerate(self.job.nodelist):
+            path = os.path.join(self.stagedir, PERF_OUTPUT_FORMAT.format(host=host))
+            if not os.path.isfile(path):
+                logger.warn("No perf output for node %s", host)
+                continue
+
+            logger.debug("Parsing perf output from %s", path)
+            host_records = utils.read_perf_intervals(path, self.perf_events)
+            host_records["host"] = i
+            records.append(host_records)
+
+        if not records:
+            return np.array([], dtype=utils.PERF_INTERVAL_DTYPE)
+        return np.concatenate(records)
 
     @blt.performance_function("J")
     def _perf_instrument_extract_perf_energy_event(
@@ -172,32 +345,33 @@ class PerfInstrument(rfm.RegressionMixin):
         if socket < 0:
             raise ValueError("`socket` cannot be negative")
 
-        # todo: this could easily be a single query instead of two
-        # if we hand roll the regex capture instead
-        all_time_measurements = utils.extract_perf_values_for_host(
-            socket, key, self.stderr, "time", host_index
-        )
-        all_energy_measurements = utils.extract_perf_values_for_host(
-            socket, key, self.stderr, "energy", host_index
+        # a repeated launch is measured over its last repetition only, as are
+        # its times
+        step = None
+        if hasattr(self, "_repeat_last_step"):
+            step = int(self._repeat_last_step()["step"])
+
+        records = self._perf_instrument_intervals().select(
+            -1 if host_index is None else host_index,
+            socket,
+            self.perf_events.index(key),
+            step,
         )
 
-        time_series_key = f"perf/{socket}/{key}"
+        source = "perf"
 
         # use the host name if it's a mutli-node job
         if not host_index is None:
             node_name = self.job.nodelist[host_index]
-            time_series_key = f"perf/{node_name}/{socket}/{key}"
-
-        # save all measurements to the time series dictionary
-        self.time_series[time_series_key] = [
-            # explicitly call list, as the extraction functions return reframe
-            # deferrables
-            list(all_time_measurements),
-            list(all_energy_measurements),
-        ]
+            source = f"perf/{node_name}"
+
+        # every socket and event of a host shares the same interval timestamps
+        self.time_series.add(
+            source, f"{socket}/{key}", records["time"], records["value"]
+        )
 
         # return the summed energy
-        return sum(all_energy_measurements)
+        return float(np.sum(records["value"]))
 
     @blt.run_before("performance", always_last=True)
     def _perf_instrument_set_variables(self):
@@ -214,7 +388,7 @@ class PerfInstrument(rfm.RegressionMixin):
             # for multi-node jobs, need to extract a perf value for each node
             perf_events_gather = {
                 f"/{host}/{socket}/{k}": self._perf_instrument_extract_perf_energy_event(
-                    k, socket, i, host
+                    k, socket, i
                 )
                 for k in self.perf_events
                 for socket in range(self.current_partition.processor.num_sockets)
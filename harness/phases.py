@@ -0,0 +1,268 @@
+import os
+import re
+import logging
+import collections
+
+import numpy as np
+
+import reframe as rfm
+import reframe.core.builtins as blt
+
+import harness.energy as energy
+import harness.launch as launch
+from harness.database import DATABASE_QUERY_ENABLED
+
+logger = logging.getLogger(__name__)
+
+# wall clock times of the start and end of the launch
+PHASES_FILE = "phases.txt"
+LAUNCH_START = "launch_start"
+LAUNCH_END = "launch_end"
+
+SPECTIMES_REGEX = re.compile(r"^\s*(?P<name>\w[\w ]*?) time:\s+(?P<value>\S+)", re.M)
+
+PHASE_CORE = "Core"
+PHASE_INIT_IO = "Init/IO"
+
+PhaseWindows = collections.namedtuple("PhaseWindows", ["launch", "core", "init_io"])
+"""
+The `(start, end)` unix timestamps of the launch and of the core phase, and the
+list of windows that make up the rest of the launch (initialisation before
+the core phase and I/O after it).
+"""
+
+
+def launch_marker_cmd(kind: str) -> str:
+    return f'echo "{kind} $(date +%s.%N)" >> {PHASES_FILE}'
+
+
+def add_launch_markers(test):
+    """
+    Marks the start and end of the launch of a test, as the innermost of the
+    launch layers. Safe to call from several mixins.
+    """
+    launch.set_launch_layer(
+        test,
+        "phases",
+        [launch_marker_cmd(LAUNCH_START)],
+        [launch_marker_cmd(LAUNCH_END)],
+    )
+
+
+def read_launch_window(path: str):
+    """
+    Returns the `(start, end)` of the launch, or `None` if it was not marked.
+    """
+    if not os.path.isfile(path):
+        return None
+
+    times = {}
+    with open(path) as f:
+        for line in f:
+            parts = line.split()
+            if len(parts) == 2:
+                times[parts[0]] = float(parts[1])
+
+    if LAUNCH_START in times and LAUNCH_END in times:
+        return times[LAUNCH_START], times[LAUNCH_END]
+    return None
+
+
+def read_spectimes(path: str) -> dict:
+    """
+    Reads every `<name> time: <seconds>` line of the SPEChpc timing output,
+    e.g. `{"Core": 9.3, "Total": 10.1}`.
+    """
+    with open(path) as f:
+        text = f.read()
+
+    times = {}
+    for match in SPECTIMES_REGEX.finditer(text):
+        try:
+            times[match.group("name")] = float(match.group("value"))
+        except ValueError:
+            continue
+    return times
+
+
+def phase_windows(launch_start: float, launch_end: float, times: dict) -> PhaseWindows:
+    """
+    Places the SPEChpc phases in the launch window. The `Total` timer is taken
+    to end with the launch, and the core phase to start `Init` seconds after
+    it starts. Without an `Init` timer, everything outside of the core phase
+    is taken to come before it, as the initialisation dominates the I/O.
+    """
+    core = times["Core"]
+    total = min(
+        times.get("Total", launch_end - launch_start), launch_end - launch_start
+    )
+    init = times.get("Init", total - core)
+
+    core_start = max(launch_end - total + init, launch_start)
+    core_end = min(core_start + core, launch_end)
+
+    return PhaseWindows(
+        (launch_start, launch_end),
+        (core_start, core_end),
+        [(launch_start, core_start), (core_end, launch_end)],
+    )
+
+
+class PhaseEnergy(rfm.RegressionMixin):
+    """
+    Splits the energy measured by the other instruments into the core phase of
+    the benchmark and the rest of the launch (initialisation and I/O), from
+    launch markers and the SPEChpc timers. For each of the BMC, RAPL and perf
+    measurements that are present, reports `Core energy/<source>`,
+    `Init/IO energy/<source>` and the average power of each phase, summed over
+    the nodes.
+    """
+
+    @blt.run_before("run", always_last=True)
+    def _phase_energy_mark_launch(self):
+        add_launch_markers(self)
+
+    def _phase_energy_windows(self) -> PhaseWindows:
+        windows = getattr(self, "_phase_energy_parsed", None)
+        if windows is None:
+            launch = read_launch_window(os.path.join(self.stagedir, PHASES_FILE))
+            if launch is None:
+                raise ValueError("The launch was not marked")
+            times = read_spectimes(os.path.join(self.stagedir, self.spectimes_path))
+            windows = phase_windows(*launch, times)
+            self._phase_energy_parsed = windows
+
+        return windows
+
+    def _phase_energy_bounds(self):
+        # every window at once: the core phase followed by the rest
+        w = self._phase_energy_windows()
+        windows = [w.core] + w.init_io
+        return np.array([s for (s, _) in windows]), np.array([e for (_, e) in windows])
+
+    def _phase_energy_split(self, energies: np.array, phase: str) -> float:
+        if phase == PHASE_CORE:
+            return float(energies[0])
+        return float(np.sum(energies[1:]))
+
+    def _phase_energy_bmc(self) -> np.array:
+        starts, ends = self._phase_energy_bounds()
+        total = np.zeros(len(starts))
+        for nodename in self.database_query_node_names:
+            values = self._bmc_instrument_node_readings(nodename)
+            total += energy.integrate_power(
+                values[:, 0], values[:, 1], starts, ends
+            ).energy
+        return total
+
+    def _phase_energy_rapl(self) -> np.array:
+        starts, ends = self._phase_energy_bounds()
+        total = np.zeros(len(starts))
+        for samples in self._rapl_instrument_samples().values():
+            if len(samples.times) == 0:
+                continue
+            for i in range(len(samples.domains)):
+                total += self._rapl_instrument_energy_at(
+                    samples, ends, i
+                ) - self._rapl_instrument_energy_at(samples, starts, i)
+        return total
+
+    def _phase_energy_perf(self) -> np.array:
+        starts, ends = self._phase_energy_bounds()
+        launch_start = self._phase_energy_windows().launch[0]
+        intervals = self._perf_instrument_intervals()
+
+        # the package includes the cores, so only count the package and DRAM
+        events = [
+            i
+            for (i, e) in enumerate(self.perf_events)
+            if e.endswith(("energy-pkg/", "energy-ram/"))
+        ]
+
+        total = np.zeros(len(starts))
+        for host, socket, event in intervals.groups():
+            if event not in events:
+                continue
+            records = intervals.select(host, socket, event)
+            # the launch markers are those of the last step of a batched run,
+            # whose perf times are already offset by the step marker
+            step = np.max(records["step"])
+            records = records[records["step"] == step]
+            times = records["time"] if step >= 0 else records["time"] + launch_start
+            # perf starts with the launch, and its times are relative to that
+            total += energy.integrate_interval_energy(
+                times,
+                records["value"],
+                starts,
+                ends,
+                origin=launch_start,
+            ).energy
+        return total
+
+    def _phase_energy_source(self, source: str) -> np.array:
+        cache = getattr(self, "_phase_energy_sources", None)
+        if cache is None:
+            cache = self._phase_energy_sources = {}
+
+        if source not in cache:
+            if source == "BMC":
+                cache[source] = self._phase_energy_bmc()
+            elif source == "RAPL":
+                cache[source] = self._phase_energy_rapl()
+            else:
+                cache[source] = self._phase_energy_perf()
+        return cache[source]
+
+    def _phase_energy_duration(self, phase: str) -> float:
+        w = self._phase_energy_windows()
+        if phase == PHASE_CORE:
+            return w.core[1] - w.core[0]
+        return sum(e - s for (s, e) in w.init_io)
+
+    @blt.performance_function("J")
+    def _phase_energy_extract_energy(self, source=None, phase=None):
+        return self._phase_energy_split(self._phase_energy_source(source), phase)
+
+    @blt.performance_function("W")
+    def _phase_energy_extract_power(self, source=None, phase=None):
+        duration = self._phase_energy_duration(phase)
+        if duration <= 0:
+            raise ValueError(f"The {phase} phase has no duration")
+        energies = self._phase_energy_source(source)
+        return self._phase_energy_split(energies, phase) / duration
+
+    def _phase_energy_sources_present(self) -> list:
+        sources = []
+        # without a node list from the scheduler, the BMC cannot be queried
+        if (
+            DATABASE_QUERY_ENABLED
+            and hasattr(self, "_bmc_instrument_node_readings")
+            and getattr(self, "database_query_node_names", None)
+        ):
+            sources.append("BMC")
+        if hasattr(self, "_rapl_instrument_samples") and any(
+            len(s.times) for s in self._rapl_instrument_samples().values()
+        ):
+            sources.append("RAPL")
+        if getattr(self, "perf_events", None) and hasattr(
+            self, "_perf_instrument_intervals"
+        ):
+            sources.append("perf")
+        return sources
+
+    @blt.run_before("performance", always_last=True)
+    def _phase_energy_set_variables(self):
+        variables = {}
+        for source in self._phase_energy_sources_present():
+            for phase in (PHASE_CORE, PHASE_INIT_IO):
+                variables[f"{phase} energy/{source}"] = (
+                    self._phase_energy_extract_energy(source, phase)
+                )
+                variables[f"{phase} power/{source}"] = self._phase_energy_extract_power(
+                    source, phase
+                )
+
+        if self.perf_variables:
+            self.perf_variables = {**self.perf_variables, **variables}
+        else:
+            self.perf_variables = variables
@@ -0,0 +1,302 @@
+"""
+Plans a joint sweep of CPU frequency and powercap, leaving out the
+combinations that cannot tell us anything new.
+
+A powercap only changes a run if it is below the power the node would draw
+uncapped at that frequency. That draw is taken from earlier uncapped runs in
+the results warehouse where there are some, and otherwise from a model
+`P(f) = a + b f^3` fitted to them (or scaled from the highest powercap of the
+partition if there are none). For each frequency, only the caps that can bind,
+plus the lowest one that cannot as the uncapped reference, are kept.
+
+The points that are kept are ordered so that each next point is the one
+furthest from all points before it, starting from the uncapped run at the
+highest frequency, so a campaign that is cut short still covers the space
+evenly.
+
+Print the plan for a partition with
+
+    python -m harness.planner sapphire [--benchmark Lbm_t] [--warehouse <dir>]
+"""
+
+import sys
+import logging
+import argparse
+import collections
+
+import numpy as np
+
+import reframe.core.builtins as blt
+
+import harness.report as report
+import harness.frequency as frequency
+import harness.powercap as powercap
+from harness.warehouse import Warehouse, SRFM_WAREHOUSE_DIR
+
+logger = logging.getLogger(__name__)
+
+# watts a cap must be below the uncapped draw to be taken as binding
+DEFAULT_POWER_MARGIN = 25.0
+# share of the power at the highest frequency that does not scale with it,
+# when there are too few measurements to fit the model
+DEFAULT_STATIC_FRACTION = 0.5
+
+# the plans made in this session, as the runs of the sweep are added to the
+# warehouse while it runs and would change the plan under it
+_session_plans = {}
+
+SweepPoint = collections.namedtuple(
+    "SweepPoint", ["frequency", "powercap", "uncapped_power", "binding"]
+)
+
+
+def measured_power(warehouse: Warehouse, benchmark: str, partition: str) -> dict:
+    """
+    The mean uncapped power per node at each frequency of the earlier runs of
+    a benchmark, from the BMC energy of the core phase where it was recorded
+    and otherwise of the whole run. Flagged runs are left out.
+    """
+    samples = collections.defaultdict(list)
+    for run in warehouse.query(benchmark=benchmark, partition=partition):
+        if run.frequency is None or run.powercap is not None:
+            continue
+        if report.is_flagged(run.metrics):
+            continue
+
+        nodes = run.num_nodes or 1
+        power = run.metrics.get("Core power/BMC", None)
+        if power is None:
+            energy = report.total_energy(run.metrics, "bmc")
+            time = run.metrics.get("Total time", None)
+            if energy is None or not time:
+                continue
+            power = energy / time
+        samples[run.frequency].append(power / nodes)
+
+    return {f: float(np.mean(p)) for (f, p) in samples.items()}
+
+
+def power_model(
+    frequencies: list,
+    measured: dict,
+    max_power: float,
+    static_fraction: float = DEFAULT_STATIC_FRACTION,
+) -> np.array:
+    """
+    The uncapped power at each frequency: measured where available, and from
+    `P(f) = a + b f^3` otherwise. The model is fitted to the measurements if
+    there are at least two, scaled through the one if there is one, and
+    otherwise has `max_power` at the highest frequency.
+    """
+    f = np.asarray(frequencies, dtype=np.float64)
+    known_f = np.array(list(measured.keys()), dtype=np.float64)
+    known_p = np.array(list(measured.values()), dtype=np.float64)
+
+    if len(known_f) >= 2:
+        design = np.stack((np.ones_like(known_f), known_f**3), axis=1)
+        (a, b), *_ = np.linalg.lstsq(design, known_p, rcond=None)
+        if b <= 0:
+            # no dependence on frequency in the measurements
+            a, b = float(np.mean(known_p)), 0.0
+        model = a + b * f**3
+    else:
+        if len(known_f) == 1:
+            f0, p0 = known_f[0], known_p[0]
+        else:
+            f0, p0 = f.max(), max_power
+        model = p0 * (static_fraction + (1 - static_fraction) * (f / f0) ** 3)
+
+    for i, fi in enumerate(f):
+        if fi in measured:
+            model[i] = measured[fi]
+    return model
+
+
+def _farthest_first(coords: np.array, start: int) -> np.array:
+    # greedy maximin ordering of the points
+    n = len(coords)
+    order = np.empty(n, dtype=np.int64)
+    order[0] = start
+    distance = np.linalg.norm(coords - coords[start], axis=1)
+    for i in range(1, n):
+        nxt = int(np.argmax(distance))
+        order[i] = nxt
+        distance = np.minimum(distance, np.linalg.norm(coords - coords[nxt], axis=1))
+    return order
+
+
+def plan_sweep(
+    frequencies: list,
+    powercaps: list,
+    uncapped_power: np.array,
+    margin: float = DEFAULT_POWER_MARGIN,
+) -> list:
+    """
+    Returns the `SweepPoint`s worth running, most informative first.
+    """
+    f = np.asarray(frequencies, dtype=np.float64)
+    caps = np.sort(np.asarray(powercaps, dtype=np.float64))
+
+    ff, cc = np.meshgrid(f, caps, indexing="ij")
+    power = np.broadcast_to(np.asarray(uncapped_power)[:, None], ff.shape)
+    binding = cc < power - margin
+
+    # the lowest non-binding cap of each frequency is its uncapped reference
+    keep = binding.copy()
+    first_free = np.argmax(~binding, axis=1)
+    has_free = np.any(~binding, axis=1)
+    keep[np.flatnonzero(has_free), first_free[has_free]] = True
+
+    fi, ci = np.nonzero(keep)
+    if len(fi) == 0:
+        return []
+
+    # normalise both axes so neither dominates the distances
+    coords = np.stack(
+        (
+            (f[fi] - f.min()) / max(np.ptp(f), 1.0),
+            (caps[ci] - caps.min()) / max(np.ptp(caps), 1.0),
+        ),
+        axis=1,
+    )
+    references = np.flatnonzero(~binding[fi, ci])
+    if len(references):
+        start = references[np.argmax(f[fi][references])]
+    else:
+        start = int(np.argmax(f[fi] + caps[ci]))
+    order = _farthest_first(coords, start)
+
+    return [
+        SweepPoint(
+            float(f[fi[i]]),
+            int(caps[ci[i]]),
+            float(power[fi[i], ci[i]]),
+            bool(binding[fi[i], ci[i]]),
+        )
+        for i in order
+    ]
+
+
+def partition_plan(
+    partition: str,
+    benchmark: str = None,
+    warehouse_dir: str = None,
+    margin: float = DEFAULT_POWER_MARGIN,
+    static_fraction: float = DEFAULT_STATIC_FRACTION,
+) -> list:
+    frequencies = frequency.partition_frequencies(partition)
+    powercaps = powercap.partition_powercaps(partition)
+
+    measured = {}
+    if warehouse_dir and benchmark:
+        with Warehouse(warehouse_dir) as w:
+            measured = measured_power(w, benchmark, partition)
+    if not measured:
+        logger.info(
+            "No uncapped runs of %s on %s, modelling power", benchmark, partition
+        )
+
+    uncapped = power_model(frequencies, measured, max(powercaps), static_fraction)
+    return plan_sweep(frequencies, powercaps, uncapped, margin)
+
+
+def session_plan(
+    partition: str,
+    benchmark: str = None,
+    warehouse_dir: str = None,
+    margin: float = DEFAULT_POWER_MARGIN,
+    static_fraction: float = DEFAULT_STATIC_FRACTION,
+) -> list:
+    """
+    The `partition_plan`, made the first time it is asked for in this session
+    and then kept, so that every point of the sweep is run exactly once.
+    """
+    key = (partition, benchmark, warehouse_dir, margin, static_fraction)
+    if key not in _session_plans:
+        _session_plans[key] = partition_plan(*key)
+    return _session_plans[key]
+
+
+class FrequencyPowercapSweep(frequency.FrequencyBase, powercap.PowercapBase):
+    """
+    Sweeps frequency and powercap together, running only the points of the
+    `partition_plan` of the partition, in its order. The plan is made once per
+    session with `session_plan`, from the runs before the session. As with
+    the other sweeps, there is a parameter for every possible point, and
+    those past the end of the plan are skipped.
+    """
+
+    sweep_point_index = parameter(
+        range(frequency.PARAMETER_CARDINALITY * powercap.PARAMETER_CARDINALITY)
+    )
+    cpu_frequency = variable(float)
+    powercap_value = variable(int)
+
+    planner_power_margin = variable(float, value=DEFAULT_POWER_MARGIN)
+    planner_static_fraction = variable(float, value=DEFAULT_STATIC_FRACTION)
+    planner_warehouse_dir = variable(str, type(None), value=SRFM_WAREHOUSE_DIR)
+    # the benchmark name the earlier runs are stored under, if not this test's
+    planner_benchmark = variable(str, type(None), value=None)
+
+    @blt.run_after("setup")
+    def get_sweep_point(self):
+        benchmark = self.planner_benchmark or report.benchmark_name(
+            {
+                "name": self.name,
+                "spechpc_benchmark": getattr(self, "spechpc_benchmark", None),
+            }
+        )
+        plan = session_plan(
+            self.current_partition.name,
+            benchmark,
+            self.planner_warehouse_dir,
+            self.planner_power_margin,
+            self.planner_static_fraction,
+        )
+
+        if self.sweep_point_index >= len(plan):
+            self.skip(
+                msg=f"Point is not in the plan ({self.sweep_point_index} >= {len(plan)})"
+            )
+
+        point = plan[self.sweep_point_index]
+        self.cpu_frequency = point.frequency
+        self.powercap_value = point.powercap
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog="python -m harness.planner",
+        description="Print the joint frequency and powercap sweep plan.",
+    )
+    parser.add_argument("partition")
+    parser.add_argument("--benchmark")
+    parser.add_argument("--warehouse", default=SRFM_WAREHOUSE_DIR)
+    parser.add_argument("--margin", type=float, default=DEFAULT_POWER_MARGIN)
+    parser.add_argument(
+        "--static-fraction", type=float, default=DEFAULT_STATIC_FRACTION
+    )
+    args = parser.parse_args(argv)
+
+    plan = partition_plan(
+        args.partition,
+        args.benchmark,
+        args.warehouse,
+        args.margin,
+        args.static_fraction,
+    )
+    total = len(frequency.partition_frequencies(args.partition)) * len(
+        powercap.partition_powercaps(args.partition)
+    )
+
+    print(f"{'index':>5} {'frequency':>9} {'powercap':>8} {'uncapped / W':>12}")
+    for i, p in enumerate(plan):
+        ref = "" if p.binding else " (reference)"
+        print(
+            f"{i:>5} {p.frequency:>9g} {p.powercap:>8} {p.uncapped_power:>12.1f}{ref}"
+        )
+    print(f"{len(plan)} of {total} points")
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,282 @@
+import os
+import glob
+import json
+import logging
+
+import reframe as rfm
+import reframe.core.builtins as blt
+import reframe.utility.typecheck as typ
+from reframe.core.exceptions import SanityError
+
+import harness.utils as utils
+import harness.stats as stats
+import harness.report as report
+import harness.launch as launch
+import harness.converge as converge
+from harness.nodestate import CPU_ROOT, PROC_ROOT
+from harness.warehouse import Warehouse, SRFM_WAREHOUSE_DIR
+
+logger = logging.getLogger(__name__)
+
+NODE_STATE_SCRIPT = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "nodestate.py"
+)
+NODE_STATE_FORMAT = "nodestate.{host}.{label}.json"
+NODE_STATE_BEFORE = "before"
+NODE_STATE_AFTER = "after"
+DEFAULT_MAX_RUNNING = 1
+
+
+class RunQuality(rfm.RegressionMixin):
+    """
+    Records the state of every node with `nodestate.py` just before and just
+    after the run, and flags the run if a node had other tasks running or
+    stray processes, was thermally throttled during the run, or had a
+    different boost or C-state setting from the one expected. In the batched
+    sweeps and adaptive repetitions, the snapshots are taken once around all
+    of the steps.
+
+    The load average is only reported, not checked, as after a run on the
+    whole node it stays high for minutes, far longer than the cooldown.
+
+    The run is also flagged as an outlier if its `quality_metric` is more than
+    `quality_outlier_threshold` robust standard deviations from the earlier
+    unflagged runs of the same benchmark, partition, frequency, powercap and
+    node count in the warehouse, once there are `quality_min_history` of them.
+
+    The node state is reported as
+    `Quality/<node>/running|load|stray|throttle|boost`,
+    the outlier score as `Quality/outlier score`, and the outcome as
+    `report.QUALITY_FLAG_KEY`, which the analyses use to leave the run out.
+    With `quality_fail`, flagged runs fail instead, so they never reach the
+    warehouse.
+    """
+
+    # tasks running on a node just before the run, other than the snapshot
+    # itself, above which it is busy. one more is allowed for the helpers of
+    # the job, e.g. `srun` or the RAPL sampler
+    quality_max_running = variable(int, value=DEFAULT_MAX_RUNNING)
+    quality_max_stray = variable(int, value=0)
+    # share of a core above which a process counts as stray
+    quality_stray_threshold = variable(float, value=0.1)
+    # the expected settings, or `None` to not check
+    quality_expect_boost = variable(bool, type(None), value=None)
+    quality_expect_cstates = variable(typ.List[str], type(None), value=None)
+
+    quality_metric = variable(str, value="Core time")
+    quality_outlier_threshold = variable(float, value=3.5)
+    quality_min_history = variable(int, value=5)
+    quality_warehouse_dir = variable(str, type(None), value=SRFM_WAREHOUSE_DIR)
+
+    quality_fail = variable(bool, value=False)
+    quality_sysfs_root = variable(str, value=CPU_ROOT)
+    quality_proc_root = variable(str, value=PROC_ROOT)
+
+    def _node_state_cmd(self, label: str, interval: float) -> str:
+        cmd = " ".join(
+            [
+                "python3",
+                NODE_STATE_SCRIPT,
+                f"--sysfs-root {self.quality_sysfs_root}",
+                f"--proc-root {self.quality_proc_root}",
+                "snapshot",
+                f"--interval {interval}",
+                f"--cpu-threshold {self.quality_stray_threshold}",
+                f"--output {NODE_STATE_FORMAT.format(host='{host}', label=label)}",
+            ]
+        )
+        return utils.multiplex_for_each_node(cmd, self.num_nodes, False)
+
+    @blt.run_before("run", always_last=True)
+    def _run_quality_snapshots(self):
+        # a short window after the run, as the job's own processes are gone
+        before = self._node_state_cmd(NODE_STATE_BEFORE, 1.0)
+        after = self._node_state_cmd(NODE_STATE_AFTER, 0.1)
+
+        # outside of the launch markers and of the loop of batched runs
+        launch.set_launch_layer(self, "quality", [before], [after])
+
+    def _run_quality_states(self) -> dict:
+        states = getattr(self, "_run_quality_parsed", None)
+        if states is None:
+            states = {}
+            for label in (NODE_STATE_BEFORE, NODE_STATE_AFTER):
+                pattern = NODE_STATE_FORMAT.format(host="*", label=label)
+                for path in sorted(glob.glob(os.path.join(self.stagedir, pattern))):
+                    with open(path) as f:
+                        state = json.load(f)
+                    states.setdefault(state["host"], {})[label] = state
+            self._run_quality_parsed = states
+
+        return states
+
+    def _run_quality_throttled(self, host):
+        # events during the run, preferring the package counters
+        states = self._run_quality_states()[host]
+        if NODE_STATE_AFTER not in states:
+            return None
+        before = states[NODE_STATE_BEFORE]["throttle"]
+        after = states[NODE_STATE_AFTER]["throttle"]
+        for counter in ("package", "core"):
+            if before[counter] is not None and after[counter] is not None:
+                return after[counter] - before[counter]
+        return None
+
+    def _run_quality_running(self, state):
+        # the snapshot is itself running when it reads the count
+        if state["loadavg"] is None:
+            return None
+        return max(state["loadavg"]["running"] - 1, 0)
+
+    def _run_quality_history(self) -> list:
+        if not self.quality_warehouse_dir:
+            return []
+
+        benchmark = report.benchmark_name(
+            {
+                "name": self.name,
+                "spechpc_benchmark": getattr(self, "spechpc_benchmark", None),
+            }
+        )
+        frequency = getattr(self, "cpu_frequency", None)
+        powercap = getattr(self, "powercap_value", None)
+
+        with Warehouse(self.quality_warehouse_dir) as w:
+            runs = w.query(
+                benchmark=benchmark,
+                partition=self.current_partition.name,
+                system=self.current_system.name,
+                frequency=(frequency, frequency),
+                metrics=[self.quality_metric, report.QUALITY_FLAG_KEY],
+            )
+
+        return [
+            run.metrics[self.quality_metric]
+            for run in runs
+            if run.frequency == frequency
+            and run.powercap == powercap
+            and run.num_nodes == getattr(self, "num_nodes", None)
+            and self.quality_metric in run.metrics
+            and not report.is_flagged(run.metrics)
+        ]
+
+    def _run_quality_compute_score(self):
+        history = self._run_quality_history()
+        if len(history) < self.quality_min_history:
+            logger.debug(
+                "Only %d earlier runs like %s, not checking for outliers",
+                len(history),
+                self.display_name,
+            )
+            return None
+
+        path = os.path.join(self.stagedir, self.spectimes_path)
+        values = converge.read_times(path, self.quality_metric)
+        if not values:
+            return None
+        return stats.robust_zscore(values[0], history)
+
+    def _run_quality_outlier_score(self):
+        # cached as a tuple, since the score may be `None`
+        score = getattr(self, "_run_quality_score", None)
+        if score is None:
+            score = (self._run_quality_compute_score(),)
+            self._run_quality_score = score
+        return score[0]
+
+    def _run_quality_problems(self) -> list:
+        problems = []
+        for host, states in self._run_quality_states().items():
+            state = states.get(NODE_STATE_BEFORE, None)
+            if state is None:
+                continue
+
+            running = self._run_quality_running(state)
+            if running is not None and running > self.quality_max_running:
+                problems.append(f"{host} had {running} other tasks running")
+            if len(state["stray"]) > self.quality_max_stray:
+                names = ", ".join(p["name"] for p in state["stray"])
+                problems.append(f"{host} had stray processes ({names})")
+
+            throttled = self._run_quality_throttled(host)
+            if throttled:
+                problems.append(f"{host} was throttled {throttled} times")
+
+            boost = state["boost"]
+            expected = self.quality_expect_boost
+            if expected is not None and boost is not None and boost != expected:
+                problems.append(f"{host} had boost {'on' if boost else 'off'}")
+
+            cstates = state["cstates"]
+            expected = self.quality_expect_cstates
+            if expected is not None and cstates is not None:
+                if set(cstates) != set(expected):
+                    problems.append(f"{host} had C-states {', '.join(cstates)}")
+
+        score = self._run_quality_outlier_score()
+        if score is not None and abs(score) > self.quality_outlier_threshold:
+            problems.append(f"{self.quality_metric} is an outlier (score {score:.1f})")
+
+        return problems
+
+    @blt.performance_function("")
+    def _run_quality_extract_state(self, host=None, quantity=None):
+        state = self._run_quality_states()[host][NODE_STATE_BEFORE]
+        if quantity == "running":
+            return self._run_quality_running(state)
+        if quantity == "load":
+            return state["loadavg"]["load"][0]
+        if quantity == "stray":
+            return len(state["stray"])
+        if quantity == "boost":
+            return int(state["boost"])
+        return self._run_quality_throttled(host)
+
+    @blt.performance_function("")
+    def _run_quality_extract_score(self):
+        return self._run_quality_outlier_score()
+
+    @blt.performance_function("")
+    def _run_quality_extract_flagged(self, flagged=None):
+        return int(flagged)
+
+    @blt.run_before("performance", always_last=True)
+    def _run_quality_set_variables(self):
+        states = self._run_quality_states()
+        if not states:
+            logger.warn("No node states were recorded")
+
+        variables = {}
+        for host, s in states.items():
+            if NODE_STATE_BEFORE not in s:
+                continue
+            before = s[NODE_STATE_BEFORE]
+            quantities = ["stray"]
+            if before["loadavg"] is not None:
+                quantities += ["running", "load"]
+            if before["boost"] is not None:
+                quantities.append("boost")
+            if self._run_quality_throttled(host) is not None:
+                quantities.append("throttle")
+            for q in quantities:
+                variables[f"Quality/{host}/{q}"] = self._run_quality_extract_state(
+                    host, q
+                )
+
+        if self._run_quality_outlier_score() is not None:
+            variables["Quality/outlier score"] = self._run_quality_extract_score()
+
+        problems = self._run_quality_problems()
+        for p in problems:
+            logger.warn("%s: %s", self.display_name, p)
+        if problems and self.quality_fail:
+            raise SanityError("Run quality: " + "; ".join(problems))
+
+        variables[report.QUALITY_FLAG_KEY] = self._run_quality_extract_flagged(
+            bool(problems)
+        )
+
+        if self.perf_variables:
+            self.perf_variables = {**self.perf_variables, **variables}
+        else:
+            self.perf_variables = variables
@@ -0,0 +1,93 @@
+import os
+import logging
+import hashlib
+import tempfile
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+CACHE_SUFFIX = ".npy"
+BYTES_PER_MB = 1024 * 1024
+
+
+class QueryCache:
+    """
+    A persistent on-disk cache for the digested database query results.
+
+    Each entry is keyed on `(cluster, alias, start, end, step)` and stored as a
+    single `.npy` file of the `[['s', 'W'], ...]` array, named by the hash of
+    the key. The total size of the cache is bounded, and the least recently
+    used entries are evicted first. Reading an entry touches its modification
+    time, which is what the eviction uses to order the entries.
+    """
+
+    def __init__(self, directory: str, max_size_mb: float = 512):
+        self.directory = directory
+        self.max_size_bytes = int(max_size_mb * BYTES_PER_MB)
+        os.makedirs(self.directory, exist_ok=True)
+
+    @staticmethod
+    def key(cluster: str, alias: str, start: str, end: str, step: str) -> str:
+        text = "\0".join((cluster, alias, start, end, step))
+        return hashlib.sha256(text.encode()).hexdigest()
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, key + CACHE_SUFFIX)
+
+    def get(self, key: str):
+        """
+        Returns the cached array, or `None` if there is no entry for the key.
+        """
+        path = self._path(key)
+        try:
+            values = np.load(path, allow_pickle=False)
+        except FileNotFoundError:
+            return None
+        except ValueError:
+            # a corrupt entry is as good as a miss
+            logger.warn("Removing unreadable cache entry %s", path)
+            self._remove(path)
+            return None
+
+        # mark as recently used
+        os.utime(path)
+        return values
+
+    def put(self, key: str, values: np.array):
+        # write to a temporary file first so that concurrent readers never see
+        # a partially written entry
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        with os.fdopen(fd, "wb") as f:
+            np.save(f, np.ascontiguousarray(values, dtype=np.float64))
+        os.replace(tmp_path, self._path(key))
+
+        self.evict()
+
+    def evict(self):
+        entries = []
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith(CACHE_SUFFIX):
+                stat = entry.stat()
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+
+        total = sum(size for (_, size, _) in entries)
+        if total <= self.max_size_bytes:
+            return
+
+        # oldest first
+        entries.sort()
+        for _, size, path in entries:
+            if total <= self.max_size_bytes:
+                break
+            logger.debug("Evicting cache entry %s", path)
+            self._remove(path)
+            total -= size
+
+    @staticmethod
+    def _remove(path: str):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            # someone else got there first
+            pass
@@ -0,0 +1,421 @@
+"""
+Samples the local node power from the RAPL `energy_uj` counters in
+`/sys/class/powercap`. Run on the compute nodes as part of a job, so it only
+uses the standard library and does not import the rest of the harness.
+
+Usage:
+
+    python3 rapl.py baseline --output rapl_baseline.{host}
+    python3 rapl.py settle --baseline-file rapl_baseline.{host} --max-seconds 60
+    python3 rapl.py --interval 0.1 sample --output rapl_samples.{host}.bin
+    python3 rapl.py read --output rapl_reads.{host}.txt
+
+`baseline` measures the idle power of the node, and `settle` waits until the
+power has stayed within a tolerance of that baseline, up to a hard cap. If the
+counters cannot be read, `settle` falls back to sleeping for the cap.
+
+`read` appends the current value and wraparound range of every counter to a
+file, for the energy between two reads to be worked out later.
+
+`sample` records the energy counters into a fixed-size binary ring buffer
+until it is signalled or the `--stop-file` appears. The file starts with a
+`HEADER` and the names of the domains, followed by the first sample and then
+the ring of `capacity` samples. Each sample is a float64 unix timestamp and
+the uint64 energy of each domain in microjoules since the first sample, with
+the counter wraparound already removed, so the energy between any two
+retained samples is a plain difference even if the ring has wrapped.
+"""
+
+import os
+import re
+import sys
+import time
+import signal
+import socket
+import struct
+import argparse
+import statistics
+
+POWERCAP_ROOT = "/sys/class/powercap"
+UJ_PER_J = 1e6
+
+# top-level package zones, e.g. `intel-rapl:0`
+PACKAGE_ZONE_REGEX = re.compile(r"^intel-rapl:\d+$")
+# sub-zones that are not already counted by their package
+EXTRA_SUBZONES = ("dram",)
+
+# magic, version, number of domains, capacity, interval, samples written
+HEADER = struct.Struct("<8sIIQdQ")
+HEADER_MAGIC = b"SRFMRAPL"
+HEADER_VERSION = 1
+# offset of the number of samples written, which is updated with every sample
+COUNT_OFFSET = HEADER.size - 8
+DOMAIN_NAME_SIZE = 64
+
+
+def _read(path: str) -> str:
+    with open(path) as f:
+        return f.read().strip()
+
+
+def find_domains(root: str = POWERCAP_ROOT) -> list:
+    """
+    Returns the zone directories whose energies add up to the node power: each
+    package, and the DRAM sub-zones, which the package does not include.
+    """
+    domains = []
+    try:
+        entries = sorted(os.listdir(root))
+    except FileNotFoundError:
+        return domains
+
+    for name in entries:
+        if not PACKAGE_ZONE_REGEX.match(name):
+            continue
+        zone = os.path.join(root, name)
+        domains.append(zone)
+        for sub in sorted(os.listdir(zone)):
+            path = os.path.join(zone, sub)
+            if sub.startswith(name + ":") and os.path.isdir(path):
+                if _read(os.path.join(path, "name")) in EXTRA_SUBZONES:
+                    domains.append(path)
+    return domains
+
+
+def domain_name(zone: str) -> str:
+    """
+    The name of a zone, qualified with its package for sub-zones, e.g.
+    `package-0` or `package-0/dram`.
+    """
+    name = _read(os.path.join(zone, "name"))
+    parent = os.path.dirname(zone)
+    if PACKAGE_ZONE_REGEX.match(os.path.basename(parent)):
+        return _read(os.path.join(parent, "name")) + "/" + name
+    return name
+
+
+class Counters:
+    """
+    Reads the energy counters of the given domains, accounting for them
+    wrapping around at `max_energy_range_uj`.
+    """
+
+    def __init__(self, domains: list):
+        self.domains = domains
+        self.ranges = [
+            int(_read(os.path.join(d, "max_energy_range_uj"))) for d in domains
+        ]
+        # kept open and re-read from the start, which is cheaper than opening
+        # the files at every sample
+        self._files = [open(os.path.join(d, "energy_uj"), "rb", 0) for d in domains]
+        self.last = self._read_all()
+        self.last_time = time.monotonic()
+        self.total = [0] * len(domains)
+
+    def _read_all(self) -> list:
+        return [int(os.pread(f.fileno(), 32, 0)) for f in self._files]
+
+    def energies(self) -> list:
+        """
+        The energy of each domain in microjoules since the counters were opened.
+        """
+        values = self._read_all()
+        for i, (last, value, limit) in enumerate(zip(self.last, values, self.ranges)):
+            delta = value - last
+            if delta < 0:
+                delta += limit
+            self.total[i] += delta
+        self.last = values
+        return list(self.total)
+
+    def power(self) -> float:
+        """
+        Average power in watts of all domains since the last call.
+        """
+        now = time.monotonic()
+        before = sum(self.total)
+        total = sum(self.energies()) - before
+
+        dt = now - self.last_time
+        self.last_time = now
+        return total / UJ_PER_J / dt if dt > 0 else 0.0
+
+
+def open_counters(root: str):
+    domains = find_domains(root)
+    if not domains:
+        _log(f"No RAPL domains found under {root}")
+        return None
+    try:
+        return Counters(domains)
+    except OSError as e:
+        # usually permissions: energy_uj is only readable by root by default
+        _log(f"Cannot read RAPL counters: {e}")
+        return None
+
+
+def measure_baseline(counters: Counters, duration: float, interval: float) -> float:
+    samples = []
+    end = time.monotonic() + duration
+    while time.monotonic() < end:
+        time.sleep(interval)
+        samples.append(counters.power())
+    return statistics.median(samples)
+
+
+def settle(
+    counters: Counters,
+    baseline: float,
+    tolerance: float,
+    window: float,
+    interval: float,
+    max_seconds: float,
+) -> float:
+    """
+    Waits until the power has been within `tolerance` (relative) of `baseline`
+    for `window` seconds, or for at most `max_seconds`. Returns the time
+    waited in seconds.
+    """
+    start = time.monotonic()
+    settled_since = None
+    counters.power()
+
+    while True:
+        elapsed = time.monotonic() - start
+        if elapsed >= max_seconds:
+            _log(f"Power did not settle within {max_seconds:g} s")
+            return elapsed
+
+        time.sleep(min(interval, max_seconds - elapsed))
+        now = time.monotonic()
+        power = counters.power()
+
+        if abs(power - baseline) <= tolerance * baseline:
+            if settled_since is None:
+                settled_since = now - interval
+            if now - settled_since >= window:
+                return now - start
+        else:
+            settled_since = None
+
+
+class RingBuffer:
+    """
+    Writer for the sample file described in the module docstring. Samples are
+    written in place with `pwrite`, so there is no buffering to flush and a
+    reader always sees every sample up to the written count.
+    """
+
+    def __init__(self, path: str, names: list, capacity: int, interval: float):
+        self.names = names
+        self.capacity = capacity
+        self.record = struct.Struct("<d" + "Q" * len(names))
+        self.count = 0
+
+        self.fd = os.open(path, os.O_RDWR | os.O_CREAT | os.O_TRUNC, 0o644)
+        header = HEADER.pack(
+            HEADER_MAGIC, HEADER_VERSION, len(names), capacity, interval, 0
+        )
+        header += b"".join(
+            n.encode()[:DOMAIN_NAME_SIZE].ljust(DOMAIN_NAME_SIZE, b"\0") for n in names
+        )
+        os.pwrite(self.fd, header, 0)
+        self.first_offset = len(header)
+        self.ring_offset = self.first_offset + self.record.size
+        os.ftruncate(self.fd, self.ring_offset + capacity * self.record.size)
+
+    def append(self, timestamp: float, energies: list):
+        data = self.record.pack(timestamp, *energies)
+        if self.count == 0:
+            os.pwrite(self.fd, data, self.first_offset)
+        slot = self.count % self.capacity
+        os.pwrite(self.fd, data, self.ring_offset + slot * self.record.size)
+        self.count += 1
+        os.pwrite(self.fd, struct.pack("<Q", self.count), COUNT_OFFSET)
+
+    def close(self):
+        os.close(self.fd)
+
+
+def sample(
+    counters: Counters,
+    ring: RingBuffer,
+    interval: float,
+    stop_file: str = None,
+    max_seconds: float = None,
+):
+    """
+    Appends a sample every `interval` seconds until a SIGTERM or SIGINT, the
+    `stop_file` appearing, or `max_seconds`. The samples are paced against
+    the start time, so that they do not drift.
+    """
+    stopping = []
+
+    def _stop(signum, frame):
+        stopping.append(signum)
+
+    signal.signal(signal.SIGTERM, _stop)
+    signal.signal(signal.SIGINT, _stop)
+
+    start = time.monotonic()
+    n = 0
+    while True:
+        ring.append(time.time(), counters.energies())
+        if stopping or (stop_file and os.path.exists(stop_file)):
+            break
+
+        n += 1
+        now = time.monotonic()
+        if max_seconds is not None and now - start >= max_seconds:
+            break
+        time.sleep(max(0.0, start + n * interval - now))
+
+
+def _log(msg: str):
+    print(f"rapl.py [{_hostname()}]: {msg}", file=sys.stderr)
+
+
+def _hostname() -> str:
+    # short name, as in the scheduler's node list
+    return socket.gethostname().split(".")[0]
+
+
+def _format_path(path: str) -> str:
+    return path.format(host=_hostname())
+
+
+def _baseline(args) -> int:
+    counters = open_counters(args.sysfs_root)
+    if counters is None:
+        return 0
+
+    power = measure_baseline(counters, args.duration, args.interval)
+    _log(f"Idle baseline {power:.1f} W")
+    if args.output:
+        with open(_format_path(args.output), "w") as f:
+            f.write(f"{power}\n")
+    else:
+        print(power)
+    return 0
+
+
+def _settle(args) -> int:
+    baseline = args.baseline
+    if baseline is None and args.baseline_file:
+        try:
+            baseline = float(_read(_format_path(args.baseline_file)))
+        except (OSError, ValueError) as e:
+            _log(f"No baseline: {e}")
+
+    counters = open_counters(args.sysfs_root) if baseline else None
+    if counters is None:
+        # behave as the fixed cooldown did
+        _log(f"Sleeping for {args.max_seconds:g} seconds")
+        time.sleep(args.max_seconds)
+        return 0
+
+    elapsed = settle(
+        counters,
+        baseline,
+        args.tolerance,
+        args.window,
+        args.interval,
+        args.max_seconds,
+    )
+    _log(
+        f"Settled within {args.tolerance:.0%} of {baseline:.1f} W after {elapsed:.1f} s"
+    )
+    return 0
+
+
+def _read_counters(args) -> int:
+    counters = open_counters(args.sysfs_root)
+    if counters is None:
+        return 1
+
+    # `<unix time> <energy> <range> [<energy> <range> ...]`, in microjoules
+    fields = [f"{time.time()}"] + [
+        f"{e} {r}" for (e, r) in zip(counters.last, counters.ranges)
+    ]
+    with open(_format_path(args.output), "a") as f:
+        f.write(" ".join(fields) + "\n")
+    return 0
+
+
+def _sample(args) -> int:
+    counters = open_counters(args.sysfs_root)
+    if counters is None:
+        return 1
+
+    names = [domain_name(d) for d in counters.domains]
+    ring = RingBuffer(_format_path(args.output), names, args.capacity, args.interval)
+    try:
+        sample(counters, ring, args.interval, args.stop_file, args.max_seconds)
+    finally:
+        ring.close()
+
+    _log(f"Wrote {ring.count} samples of {len(names)} domains")
+    return 0
+
+
+def _parse_args(argv):
+    parser = argparse.ArgumentParser(
+        prog="rapl.py", description=__doc__.split("\n\n")[0]
+    )
+    parser.add_argument("--sysfs-root", default=POWERCAP_ROOT)
+    parser.add_argument("--interval", type=float, default=0.5, help="in seconds")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    baseline = commands.add_parser("baseline", help="measure the idle power")
+    baseline.add_argument("--duration", type=float, default=3.0, help="in seconds")
+    baseline.add_argument(
+        "--output", help="file to write to, `{host}` is replaced by the hostname"
+    )
+
+    settle = commands.add_parser("settle", help="wait for the power to settle")
+    settle.add_argument("--baseline", type=float, help="idle power in watts")
+    settle.add_argument("--baseline-file", help="as written by `baseline --output`")
+    settle.add_argument("--tolerance", type=float, default=0.05, help="relative")
+    settle.add_argument(
+        "--window",
+        type=float,
+        default=5.0,
+        help="how long the power must stay settled, in seconds",
+    )
+    settle.add_argument("--max-seconds", type=float, default=60.0)
+
+    read = commands.add_parser("read", help="append the counters to a file")
+    read.add_argument(
+        "--output",
+        required=True,
+        help="file to append to, `{host}` is replaced by the hostname",
+    )
+
+    sample = commands.add_parser("sample", help="record the energy counters")
+    sample.add_argument(
+        "--output",
+        required=True,
+        help="file to write to, `{host}` is replaced by the hostname",
+    )
+    sample.add_argument(
+        "--capacity", type=int, default=65536, help="number of samples kept"
+    )
+    sample.add_argument("--stop-file", help="stop once this file exists")
+    sample.add_argument("--max-seconds", type=float)
+
+    return parser.parse_args(argv)
+
+
+def main(argv=None) -> int:
+    args = _parse_args(argv)
+    if args.command == "baseline":
+        return _baseline(args)
+    if args.command == "sample":
+        return _sample(args)
+    if args.command == "read":
+        return _read_counters(args)
+    return _settle(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
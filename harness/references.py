@@ -0,0 +1,218 @@
+"""
+Performance references derived from the earlier runs in the results
+warehouse, so that a regression after e.g. a compiler, module or firmware
+change fails the performance check without anyone keeping the numbers by hand.
+
+The reference of each metric is the median of the most recent unflagged runs
+with the same system, partition, benchmark, frequency, powercap and node
+count, with a tolerance of `DEFAULT_TOLERANCE_FACTOR` robust standard
+deviations, and at least `DEFAULT_MIN_TOLERANCE`, above it (and below it, if
+improvements should fail the check too). Runs that fail
+their performance check never reach the warehouse, so a regression does not
+become the new reference.
+
+Print the references of a configuration with
+
+    python -m harness.references <system> <partition> <benchmark> [--frequency 1800] [--nodes 1]
+"""
+
+import sys
+import logging
+import argparse
+
+import reframe as rfm
+import reframe.core.builtins as blt
+import reframe.utility.typecheck as typ
+from reframe.utility import ScopedDict
+
+import harness.stats as stats
+import harness.report as report
+from harness.warehouse import Warehouse, SRFM_WAREHOUSE_DIR
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_METRICS = [
+    "Core time",
+    "Total time",
+    "Core energy/BMC",
+    "Core energy/RAPL",
+    "Core energy/perf",
+]
+DEFAULT_TOLERANCE_FACTOR = 3.0
+DEFAULT_MIN_TOLERANCE = 0.02
+DEFAULT_MIN_HISTORY = 5
+DEFAULT_MAX_HISTORY = 20
+
+
+def reference_tuple(
+    values: list,
+    factor: float = DEFAULT_TOLERANCE_FACTOR,
+    min_tolerance: float = DEFAULT_MIN_TOLERANCE,
+    one_sided: bool = True,
+) -> tuple:
+    """
+    The ReFrame reference `(value, lower, upper)` of a metric from its earlier
+    values. With `one_sided`, only being higher than the reference fails, as
+    for times and energies.
+    """
+    median, spread = stats.robust_spread(values)
+    tolerance = max(min_tolerance, factor * spread / abs(median)) if median else 0.0
+    return (median, None if one_sided else -tolerance, tolerance)
+
+
+def historical_references(
+    warehouse: Warehouse,
+    benchmark: str,
+    system: str,
+    partition: str,
+    frequency: float = None,
+    powercap: int = None,
+    num_nodes: int = None,
+    metrics: list = DEFAULT_METRICS,
+    min_history: int = DEFAULT_MIN_HISTORY,
+    max_history: int = DEFAULT_MAX_HISTORY,
+    factor: float = DEFAULT_TOLERANCE_FACTOR,
+    min_tolerance: float = DEFAULT_MIN_TOLERANCE,
+    one_sided: bool = True,
+) -> dict:
+    """
+    The reference tuple of every metric with at least `min_history` earlier
+    runs of the configuration, from the latest `max_history` of them.
+    """
+    runs = warehouse.query(
+        benchmark=benchmark,
+        system=system,
+        partition=partition,
+        frequency=(frequency, frequency),
+        metrics=list(metrics) + [report.QUALITY_FLAG_KEY],
+    )
+    # `None` settings have to be matched here, as the query only filters on
+    # values
+    runs = [
+        run
+        for run in runs
+        if run.frequency == frequency
+        and run.powercap == powercap
+        and (num_nodes is None or run.num_nodes == num_nodes)
+        and not report.is_flagged(run.metrics)
+    ]
+
+    references = {}
+    for metric in metrics:
+        # the runs are in order of completion
+        values = [run.metrics[metric] for run in runs if metric in run.metrics]
+        values = values[-max_history:]
+        if len(values) < min_history:
+            continue
+        references[metric] = reference_tuple(values, factor, min_tolerance, one_sided)
+
+    return references
+
+
+class HistoricalReferences(rfm.RegressionMixin):
+    """
+    Fills in the `reference` of the current partition from the earlier runs
+    of the same configuration in `reference_warehouse_dir`, which defaults to
+    `SRFM_WAREHOUSE_DIR`. References that are already set are kept, and
+    nothing is done without a warehouse or over external or indexed
+    references.
+    """
+
+    reference_warehouse_dir = variable(str, type(None), value=SRFM_WAREHOUSE_DIR)
+    reference_metrics = variable(typ.List[str], value=DEFAULT_METRICS)
+    reference_min_history = variable(int, value=DEFAULT_MIN_HISTORY)
+    reference_max_history = variable(int, value=DEFAULT_MAX_HISTORY)
+    # robust standard deviations either side of the reference
+    reference_tolerance_factor = variable(float, value=DEFAULT_TOLERANCE_FACTOR)
+    reference_min_tolerance = variable(float, value=DEFAULT_MIN_TOLERANCE)
+    # only fail runs that are slower or use more energy
+    reference_one_sided = variable(bool, value=True)
+
+    @blt.run_before("performance")
+    def set_historical_references(self):
+        if not self.reference_warehouse_dir:
+            return
+        if self.reference.is_external() or self.reference.index:
+            logger.debug("Not deriving references over those of %s", self.display_name)
+            return
+
+        benchmark = report.benchmark_name(
+            {
+                "name": self.name,
+                "spechpc_benchmark": getattr(self, "spechpc_benchmark", None),
+            }
+        )
+        with Warehouse(self.reference_warehouse_dir) as w:
+            references = historical_references(
+                w,
+                benchmark,
+                self.current_system.name,
+                self.current_partition.name,
+                getattr(self, "cpu_frequency", None),
+                getattr(self, "powercap_value", None),
+                getattr(self, "num_nodes", None),
+                self.reference_metrics,
+                self.reference_min_history,
+                self.reference_max_history,
+                self.reference_tolerance_factor,
+                self.reference_min_tolerance,
+                self.reference_one_sided,
+            )
+        if not references:
+            logger.debug("No history to derive references for %s", self.display_name)
+            return
+
+        # kept if set for this partition, its system or globally
+        existing = ScopedDict(dict(self.reference))
+        key = self.current_partition.fullname
+        for metric, ref in references.items():
+            if f"{key}:{metric}" not in existing:
+                self.reference.setdefault(key, {})[metric] = ref
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog="python -m harness.references",
+        description="Print the references derived from the earlier runs.",
+    )
+    parser.add_argument("system")
+    parser.add_argument("partition")
+    parser.add_argument("benchmark")
+    parser.add_argument("--frequency", type=float)
+    parser.add_argument("--powercap", type=int)
+    parser.add_argument("--nodes", type=int)
+    parser.add_argument("--warehouse", default=SRFM_WAREHOUSE_DIR)
+    parser.add_argument("--metric", action="append", dest="metrics")
+    parser.add_argument("--min-history", type=int, default=DEFAULT_MIN_HISTORY)
+    parser.add_argument("--max-history", type=int, default=DEFAULT_MAX_HISTORY)
+    parser.add_argument("--factor", type=float, default=DEFAULT_TOLERANCE_FACTOR)
+    parser.add_argument("--min-tolerance", type=float, default=DEFAULT_MIN_TOLERANCE)
+    args = parser.parse_args(argv)
+
+    if not args.warehouse:
+        parser.error("No warehouse given, and SRFM_WAREHOUSE_DIR is not set")
+
+    with Warehouse(args.warehouse) as w:
+        references = historical_references(
+            w,
+            args.benchmark,
+            args.system,
+            args.partition,
+            args.frequency,
+            args.powercap,
+            args.nodes,
+            args.metrics or DEFAULT_METRICS,
+            args.min_history,
+            args.max_history,
+            args.factor,
+            args.min_tolerance,
+        )
+
+    for metric, (value, _, upper) in references.items():
+        print(f"{metric:<20} {value:>12.4g}  +{upper:.1%}")
+    if not references:
+        print("Not enough earlier runs")
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,205 @@
+import os
+import logging
+import statistics
+
+import numpy as np
+
+import reframe as rfm
+import reframe.core.builtins as blt
+from reframe.core.exceptions import SanityError
+
+import harness.utils as utils
+import harness.energy as energy
+import harness.launch as launch
+import harness.converge as converge
+from harness.database import DATABASE_QUERY_ENABLED
+from harness.sampler import RAPL_SCRIPT
+
+logger = logging.getLogger(__name__)
+
+CONVERGE_SCRIPT = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "converge.py"
+)
+REPEAT_STEPS_FILE = "repeat_steps.txt"
+SPECTIMES_REPEAT_FORMAT = "spectimes.rep{}.txt"
+RAPL_READS_FILE = "rapl_reads.txt"
+
+STATISTICS = {
+    "mean": statistics.fmean,
+    "median": statistics.median,
+    "stddev": lambda x: statistics.stdev(x) if len(x) > 1 else 0.0,
+}
+
+
+class AdaptiveRepetition(rfm.RegressionMixin):
+    """
+    Repeats the launch inside the same job until the confidence interval of
+    the mean Core time is narrower than `repeat_target` relative to the mean,
+    between `repeat_min` and `repeat_max` times. With `repeat_energy`, the
+    RAPL energy of the first node has to converge as well.
+
+    As in `FrequencySweepBatched`, the repetitions are laid out with
+    `launch.set_step_loop`, marked in `REPEAT_STEPS_FILE` and their SPEChpc
+    times kept in `SPECTIMES_REPEAT_FORMAT`, and every repetition has to pass
+    verification. The RAPL counters are read just inside the step markers, so
+    that only the launch is counted.
+
+    The number of repeats and the mean, median and standard deviation of the
+    Core time, and of the RAPL and BMC energies of each repetition where
+    measured, are reported as `Repeats` and `<quantity>/<statistic>`. The
+    plain `Core time` and the launch markers are those of the last
+    repetition, and so are the whole-launch energies of `PerfInstrument`,
+    `BMCInstrument` and `RAPLInstrument`, which look up `_repeat_last_step`.
+
+    The counters are read with `sudo -n` if `repeat_energy_sudo` is set, as
+    `energy_uj` is only readable by root on current kernels. Without any
+    reads, `converge.py` fails and so does the sanity check.
+
+    Not to be combined with `FrequencySweepBatched`.
+    """
+
+    # relative half-width of the confidence interval to stop at
+    repeat_target = variable(float, value=0.02)
+    repeat_confidence = variable(float, value=converge.DEFAULT_CONFIDENCE)
+    repeat_min = variable(int, value=3)
+    repeat_max = variable(int, value=10)
+    repeat_energy = variable(bool, value=False)
+    # read the RAPL counters with `sudo -n`, as the node setup does
+    repeat_energy_sudo = variable(bool, value=False)
+
+    def _converge_cmd(self) -> str:
+        args = [
+            "python3",
+            CONVERGE_SCRIPT,
+            f"--spectimes '{SPECTIMES_REPEAT_FORMAT.format('*')}'",
+            f"--target {self.repeat_target}",
+            f"--confidence {self.repeat_confidence}",
+            f"--min-repeats {self.repeat_min}",
+            f"--max-repeats {self.repeat_max}",
+        ]
+        if self.repeat_energy:
+            args.append(f"--energies {RAPL_READS_FILE}")
+        return " ".join(args)
+
+    @blt.run_before("run", always_last=True)
+    def _adaptive_repetition_loop(self):
+        header = ["SRFM_STEP=0", "while true; do"]
+        footer = [
+            "SRFM_STEP=$((SRFM_STEP + 1))",
+            # a hard stop in case the benchmark keeps failing
+            f"[ $SRFM_STEP -ge {self.repeat_max} ] && break",
+            # 1 asks for another repetition, anything else is final
+            f"{self._converge_cmd()}; SRFM_CONVERGED=$?",
+            "[ $SRFM_CONVERGED -ne 1 ] && break",
+            "done",
+        ]
+        launch.set_step_loop(
+            self, header, footer, REPEAT_STEPS_FILE, SPECTIMES_REPEAT_FORMAT
+        )
+
+        if self.repeat_energy:
+            sudo = "sudo -n " if self.repeat_energy_sudo else ""
+            read = f"{sudo}python3 {RAPL_SCRIPT} read --output {RAPL_READS_FILE}"
+            launch.set_launch_layer(self, "rapl", [read], [read])
+
+    @blt.run_before("sanity")
+    def _adaptive_repetition_check_steps(self):
+        steps = self._repeat_step_times()["step"]
+        launch.assert_steps_passed(self.stagedir, SPECTIMES_REPEAT_FORMAT, steps)
+
+        if self.repeat_energy:
+            path = os.path.join(self.stagedir, RAPL_READS_FILE)
+            energies = converge.read_energies(path) if os.path.isfile(path) else []
+            if len(energies) != len(steps):
+                hint = "" if self.repeat_energy_sudo else ", try repeat_energy_sudo"
+                raise SanityError(
+                    f"Only {len(energies)} of {len(steps)} repetitions have a"
+                    f" RAPL energy{hint}"
+                )
+
+    def _repeat_step_times(self) -> np.array:
+        steps = getattr(self, "_adaptive_repetition_steps", None)
+        if steps is None:
+            steps = utils.read_step_times(
+                os.path.join(self.stagedir, REPEAT_STEPS_FILE)
+            )
+            self._adaptive_repetition_steps = steps
+        return steps
+
+    def _repeat_last_step(self):
+        """
+        The `(step, start, end)` of the last repetition, which the other
+        instruments measure instead of the whole job.
+        """
+        steps = self._repeat_step_times()
+        if len(steps) == 0:
+            raise ValueError("No repetitions were run")
+        return steps[np.argmax(steps["step"])]
+
+    def _repeat_series(self) -> dict:
+        series = getattr(self, "_adaptive_repetition_series", None)
+        if series is not None:
+            return series
+
+        series = {
+            "Core time": converge.read_times(
+                os.path.join(self.stagedir, SPECTIMES_REPEAT_FORMAT.format("*"))
+            )
+        }
+
+        path = os.path.join(self.stagedir, RAPL_READS_FILE)
+        if self.repeat_energy and os.path.isfile(path):
+            series["RAPL energy"] = converge.read_energies(path)
+
+        if DATABASE_QUERY_ENABLED and getattr(self, "database_query_node_names", None):
+            steps = self._repeat_step_times()
+            total = np.zeros(len(steps))
+            for nodename in self.database_query_node_names:
+                values = self._bmc_instrument_node_readings(nodename)
+                total += energy.integrate_power(
+                    values[:, 0], values[:, 1], steps["start"], steps["end"]
+                ).energy
+            series["BMC energy"] = list(total)
+
+        self._adaptive_repetition_series = series
+        return series
+
+    def _repeat_statistic(self, quantity: str, statistic: str) -> float:
+        values = self._repeat_series()[quantity]
+        if not values:
+            raise ValueError(f"No repetitions with a {quantity}")
+        return float(STATISTICS[statistic](values))
+
+    @blt.performance_function("")
+    def extract_repeats(self):
+        return len(self._repeat_series()["Core time"])
+
+    @blt.performance_function("s")
+    def extract_repeat_time(self, statistic=None):
+        return self._repeat_statistic("Core time", statistic)
+
+    @blt.performance_function("J")
+    def extract_repeat_energy(self, quantity=None, statistic=None):
+        return self._repeat_statistic(quantity, statistic)
+
+    @blt.run_before("performance", always_last=True)
+    def set_repetition_performance_variables(self):
+        variables = {"Repeats": self.extract_repeats()}
+        for statistic in STATISTICS:
+            variables[f"Core time/{statistic}"] = self.extract_repeat_time(statistic)
+
+        quantities = []
+        if self.repeat_energy:
+            quantities.append("RAPL energy")
+        if DATABASE_QUERY_ENABLED and getattr(self, "database_query_node_names", None):
+            quantities.append("BMC energy")
+        for quantity in quantities:
+            for statistic in STATISTICS:
+                variables[f"{quantity}/{statistic}"] = self.extract_repeat_energy(
+                    quantity, statistic
+                )
+
+        if self.perf_variables:
+            self.perf_variables = {**self.perf_variables, **variables}
+        else:
+            self.perf_variables = variables
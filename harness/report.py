@@ -0,0 +1,155 @@
+import json
+import logging
+import re
+
+logger = logging.getLogger(__name__)
+
+# performance variables that are energies of a whole run, as opposed to e.g.
+# the per-step variables of batched runs or the error bounds
+BMC_ENERGY_REGEX = re.compile(r"^BMC/[^/]+$")
+PERF_ENERGY_REGEX = re.compile(r"^/(?:[^/]+/)?\d+/power/energy-(?:pkg|ram)/$")
+RAPL_ENERGY_REGEX = re.compile(r"^RAPL/[^/]+/package-\d+(?:/dram)?$")
+
+ENERGY_SOURCES = ("bmc", "perf", "rapl")
+
+# set by `RunQuality` on runs that should not be used as a reference
+QUALITY_FLAG_KEY = "Quality/flagged"
+
+
+def load_report(path: str) -> dict:
+    with open(path) as f:
+        return json.load(f)
+
+
+def iter_testcases(report: dict, include_failed: bool = False):
+    """
+    Iterates over the test cases of a ReFrame run report. As with ReFrame's own
+    summary, only the last retry of each test case is used, and failed test
+    cases are skipped unless `include_failed` is set.
+    """
+    runs = report.get("runs", [])
+    for runid, run in enumerate(runs):
+        for tc in run["testcases"]:
+            if tc.get("result") != "success":
+                if (not include_failed) or (runid != len(runs) - 1):
+                    continue
+            yield tc
+
+
+def perf_values(testcase: dict) -> dict:
+    """
+    Returns the performance variables of a test case as `name: value`, with the
+    `system:partition:` prefix removed.
+    """
+    values = {}
+    for key, reftuple in testcase.get("perfvalues", {}).items():
+        value = reftuple[0]
+        if value is None:
+            continue
+        values[key.split(":", 2)[-1]] = value
+    return values
+
+
+def benchmark_name(testcase: dict) -> str:
+    """
+    The benchmark of a test case, from `spechpc_benchmark` for suite builds or
+    otherwise the test name without its parameters.
+    """
+    return testcase.get("spechpc_benchmark") or testcase["name"].split()[0]
+
+
+def is_flagged(values: dict) -> bool:
+    """
+    Whether the run with these performance variables was flagged as an
+    outlier or as having run on a disturbed node.
+    """
+    return bool(values.get(QUALITY_FLAG_KEY, 0))
+
+
+def perf_units(testcase: dict) -> dict:
+    return {
+        key.split(":", 2)[-1]: reftuple[4]
+        for (key, reftuple) in testcase.get("perfvalues", {}).items()
+    }
+
+
+def total_energy(values: dict, source: str = "bmc"):
+    """
+    Sums the energy of a whole run from its performance variables, either from
+    the BMC of every node, or from the package and DRAM perf events or RAPL
+    domains of every socket (the core event is part of the package, so is not
+    counted twice).
+    Returns `None` if the run has no such variables.
+    """
+    if source == "bmc":
+        regex = BMC_ENERGY_REGEX
+    elif source == "perf":
+        regex = PERF_ENERGY_REGEX
+    elif source == "rapl":
+        regex = RAPL_ENERGY_REGEX
+    else:
+        raise ValueError(f"Unknown energy source {source}")
+
+    matched = [v for (k, v) in values.items() if regex.match(k)]
+    if not matched:
+        return None
+    return sum(matched)
+
+
+def _perflog_value(s: str):
+    try:
+        return float(s)
+    except ValueError:
+        return None if s == "None" else s
+
+
+def read_perflog(path: str, include_failed: bool = False):
+    """
+    Iterates over the records of a perflog written with ReFrame's default
+    `filelog` format, as test cases in the same form as the report's, so that
+    `perf_values` and the rest work on either.
+    """
+    header = None
+    with open(path) as f:
+        for line in f:
+            fields = line.rstrip("\n").split("|")
+            # a new header is written whenever the logged fields change
+            if fields[0] == "result":
+                header = fields
+                continue
+            if header is None:
+                continue
+
+            row = dict(zip(header, fields))
+            if row["result"] != "pass" and not include_failed:
+                continue
+
+            testcase = {}
+            perfvalues = {}
+            prefix = f"{row.get('system')}:{row.get('partition')}:"
+            for i, key in enumerate(header):
+                if (
+                    key.endswith("_value")
+                    and i + 1 < len(header)
+                    and header[i + 1] == key[: -len("_value")] + "_unit"
+                ):
+                    var = key[: -len("_value")]
+                    perfvalues[prefix + var] = [
+                        _perflog_value(row.get(key, "None")),
+                        _perflog_value(row.get(f"{var}_ref", "None")),
+                        _perflog_value(row.get(f"{var}_lower_thres", "None")),
+                        _perflog_value(row.get(f"{var}_upper_thres", "None")),
+                        row.get(f"{var}_unit"),
+                    ]
+
+            perf_columns = {
+                f"{k[len(prefix):]}_{suffix}"
+                for k in perfvalues
+                for suffix in ("value", "unit", "ref", "lower_thres", "upper_thres")
+            }
+            for key, value in row.items():
+                if key not in perf_columns:
+                    testcase[key] = None if value == "None" else value
+
+            testcase["perfvalues"] = perfvalues
+            yield testcase
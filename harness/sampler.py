@@ -0,0 +1,236 @@
+import os
+import glob
+import logging
+import collections
+
+import numpy as np
+
+import reframe as rfm
+import reframe.core.builtins as blt
+from reframe.core.exceptions import PerformanceError
+
+import harness.phases as phases
+from harness.rapl import (
+    HEADER,
+    HEADER_MAGIC,
+    HEADER_VERSION,
+    DOMAIN_NAME_SIZE,
+    POWERCAP_ROOT,
+)
+
+logger = logging.getLogger(__name__)
+
+RAPL_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "rapl.py")
+RAPL_SAMPLES_FORMAT = "rapl_samples.{host}.bin"
+RAPL_SAMPLES_GLOB = "rapl_samples.*.bin"
+RAPL_STOP_FILE = "rapl_sampler.stop"
+RAPL_STATUS_FILE = "rapl_sampler.status"
+UJ_PER_J = 1e6
+
+RAPLSamples = collections.namedtuple(
+    "RAPLSamples", ["domains", "first", "times", "energies", "wrapped"]
+)
+"""
+The samples of a single node. `times` are unix timestamps, and `energies` has
+one column per domain in joules since the first sample, which is kept in
+`first` as `(time, energies)` even if the ring buffer has since wrapped. If the
+sampler stopped before its first sample, `times` is empty and `first` is
+`None`.
+"""
+
+
+def read_rapl_samples(path: str) -> RAPLSamples:
+    """
+    Reads a ring buffer file written by `rapl.py sample`, returning the
+    retained samples in time order.
+    """
+    with open(path, "rb") as f:
+        data = f.read()
+
+    magic, version, num_domains, capacity, _, count = HEADER.unpack_from(data, 0)
+    if magic != HEADER_MAGIC or version != HEADER_VERSION:
+        raise ValueError(f"{path} is not a RAPL sample file")
+
+    offset = HEADER.size
+    domains = [
+        data[offset + i * DOMAIN_NAME_SIZE : offset + (i + 1) * DOMAIN_NAME_SIZE]
+        .rstrip(b"\0")
+        .decode()
+        for i in range(num_domains)
+    ]
+    offset += num_domains * DOMAIN_NAME_SIZE
+
+    record = np.dtype([("time", "<f8"), ("energy", "<u8", (num_domains,))])
+    first = np.frombuffer(data, dtype=record, count=1, offset=offset)
+    ring = np.frombuffer(
+        data, dtype=record, count=capacity, offset=offset + record.itemsize
+    )
+
+    if count == 0:
+        return RAPLSamples(
+            domains,
+            None,
+            np.empty(0),
+            np.empty((0, num_domains)),
+            False,
+        )
+
+    if count <= capacity:
+        records = ring[:count]
+    else:
+        # oldest first
+        slot = count % capacity
+        records = np.concatenate((ring[slot:], ring[:slot]))
+
+    return RAPLSamples(
+        domains,
+        (float(first["time"][0]), first["energy"][0] / UJ_PER_J),
+        records["time"].copy(),
+        records["energy"] / UJ_PER_J,
+        count > capacity,
+    )
+
+
+def _host_of(path: str) -> str:
+    name = os.path.basename(path)
+    prefix, suffix = RAPL_SAMPLES_FORMAT.split("{host}")
+    return name[len(prefix) : -len(suffix)]
+
+
+class RAPLInstrument(rfm.RegressionMixin):
+    """
+    Samples the RAPL energy counters of every node with `rapl.py sample`
+    while the job runs, as a lighter-weight and higher resolution alternative
+    to `PerfInstrument`. The energy of each domain between the launch and the
+    end of the run is reported as `RAPL/<node>/<domain>`, and the power as a
+    time series.
+
+    `energy_uj` is only readable by root on current kernels, so the sampler
+    is run with `sudo -n` if `rapl_sudo` is set. The performance stage fails if
+    the sampler failed or a node has no sample file.
+    """
+
+    # seconds between samples
+    rapl_sample_interval = variable(float, value=0.1)
+    # number of samples kept in the ring buffer of each node
+    rapl_sample_capacity = variable(int, value=65536)
+    rapl_sysfs_root = variable(str, value=POWERCAP_ROOT)
+    # read the RAPL counters with `sudo -n`, as the node setup does
+    rapl_sudo = variable(bool, value=False)
+
+    def _rapl_instrument_node_prefix(self) -> str:
+        if self.num_nodes > 1:
+            # runs alongside the benchmark's own job step
+            n = self.num_nodes
+            return f"srun --overlap --ntasks-per-node=1 -n{n} -N{n} "
+        return ""
+
+    def _rapl_instrument_cmd(self, *args) -> str:
+        sudo = ["sudo", "-n"] if self.rapl_sudo else []
+        return " ".join([*sudo, "python3", RAPL_SCRIPT, *args])
+
+    @blt.run_before("run", always_last=True)
+    def _rapl_instrument_start_sampler(self):
+        sampler = self._rapl_instrument_cmd(
+            f"--sysfs-root {self.rapl_sysfs_root}",
+            f"--interval {self.rapl_sample_interval}",
+            "sample",
+            f"--output {RAPL_SAMPLES_FORMAT}",
+            f"--capacity {self.rapl_sample_capacity}",
+            f"--stop-file {RAPL_STOP_FILE}",
+        )
+        # the sampler spans the whole job, and the launch itself is marked so
+        # that the energies can be taken over just the run
+        start_cmds = [
+            f"rm -f {RAPL_STOP_FILE}",
+            f"{self._rapl_instrument_node_prefix()}{sampler} &",
+            "SRFM_RAPL_PID=$!",
+        ]
+        stop_cmds = [
+            f"touch {RAPL_STOP_FILE}",
+            # the exit status of the sampler, or of `srun` for every node
+            f"wait $SRFM_RAPL_PID; echo $? > {RAPL_STATUS_FILE}",
+        ]
+
+        self.prerun_cmds = start_cmds + (self.prerun_cmds or [])
+        self.postrun_cmds = (self.postrun_cmds or []) + stop_cmds
+        phases.add_launch_markers(self)
+
+    def _rapl_instrument_samples(self) -> dict:
+        samples = getattr(self, "_rapl_instrument_parsed", None)
+        if samples is None:
+            samples = {}
+            for path in sorted(
+                glob.glob(os.path.join(self.stagedir, RAPL_SAMPLES_GLOB))
+            ):
+                logger.debug("Reading RAPL samples from %s", path)
+                samples[_host_of(path)] = read_rapl_samples(path)
+            self._rapl_instrument_parsed = samples
+
+        return samples
+
+    def _rapl_instrument_check_sampler(self):
+        path = os.path.join(self.stagedir, RAPL_STATUS_FILE)
+        if not os.path.isfile(path):
+            raise PerformanceError("The RAPL sampler did not finish")
+        with open(path) as f:
+            status = f.read().strip()
+        if status != "0":
+            hint = "" if self.rapl_sudo else ", energy_uj may need rapl_sudo"
+            raise PerformanceError(f"The RAPL sampler exited with {status}{hint}")
+
+        samples = self._rapl_instrument_samples()
+        if len(samples) < self.num_nodes:
+            raise PerformanceError(
+                f"Only {len(samples)} of {self.num_nodes} nodes wrote RAPL samples"
+            )
+
+    def _rapl_instrument_launch_window(self, samples: RAPLSamples):
+        window = phases.read_launch_window(
+            os.path.join(self.stagedir, phases.PHASES_FILE)
+        )
+        if window is None:
+            return samples.first[0], samples.times[-1]
+        return window
+
+    def _rapl_instrument_energy_at(self, samples: RAPLSamples, t, domain: int):
+        times = np.concatenate(([samples.first[0]], samples.times))
+        energies = np.concatenate(
+            ([samples.first[1][domain]], samples.energies[:, domain])
+        )
+        if samples.wrapped and np.any(np.asarray(t) < samples.times[0]):
+            logger.warn("RAPL ring buffer wrapped, interpolating over the lost samples")
+        # the counters are cumulative, so interpolate between samples
+        return np.interp(t, times, energies)
+
+    @blt.performance_function("J")
+    def _rapl_instrument_extract_energy(self, host=None, domain=None):
+        samples = self._rapl_instrument_samples()[host]
+        index = samples.domains.index(domain)
+
+        power = np.diff(samples.energies[:, index]) / np.diff(samples.times)
+        self.time_series.add(f"RAPL/{host}", domain, samples.times[1:], power)
+
+        start, end = self._rapl_instrument_launch_window(samples)
+        energies = self._rapl_instrument_energy_at(samples, [start, end], index)
+        return float(energies[1] - energies[0])
+
+    @blt.run_before("performance", always_last=True)
+    def _rapl_instrument_set_variables(self):
+        self._rapl_instrument_check_sampler()
+
+        rapl_variables = {}
+        for host, samples in self._rapl_instrument_samples().items():
+            if len(samples.times) == 0:
+                # stopped before the first sample
+                logger.warn("No RAPL samples were recorded on %s", host)
+                continue
+            for domain in samples.domains:
+                rapl_variables[f"RAPL/{host}/{domain}"] = (
+                    self._rapl_instrument_extract_energy(host, domain)
+                )
+
+        if self.perf_variables:
+            self.perf_variables = {**self.perf_variables, **rapl_variables}
+        else:
+            self.perf_variables = rapl_variables
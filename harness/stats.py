@@ -0,0 +1,85 @@
+import math
+import logging
+
+import numpy as np
+
+# shared with the convergence check that runs in the jobs
+from harness.converge import t_quantile, DEFAULT_CONFIDENCE
+
+logger = logging.getLogger(__name__)
+
+BOOTSTRAP_SAMPLES = 10000
+
+
+def mean_ci(samples, confidence: float = DEFAULT_CONFIDENCE):
+    """
+    Returns the mean of `samples` and the half-width of its two-sided
+    confidence interval from the t distribution. The half-width is infinite
+    for fewer than two samples.
+    """
+    x = np.asarray(samples, dtype=np.float64)
+    mean = float(np.mean(x)) if len(x) else math.nan
+    if len(x) < 2:
+        return mean, math.inf
+
+    sem = float(np.std(x, ddof=1)) / math.sqrt(len(x))
+    return mean, t_quantile(0.5 + confidence / 2, len(x) - 1) * sem
+
+
+def relative_difference_ci(
+    baseline,
+    treated,
+    confidence: float = DEFAULT_CONFIDENCE,
+    num_samples: int = BOOTSTRAP_SAMPLES,
+    seed=0,
+):
+    """
+    The relative difference of the means, `mean(treated) / mean(baseline) -
+    1`, and its percentile bootstrap confidence interval as `(value, low,
+    high)`. The two sets of samples are resampled independently.
+    """
+    a = np.asarray(baseline, dtype=np.float64)
+    b = np.asarray(treated, dtype=np.float64)
+    value = float(np.mean(b) / np.mean(a) - 1)
+    if len(a) < 2 or len(b) < 2:
+        return value, -math.inf, math.inf
+
+    rng = np.random.default_rng(seed)
+    # resample all bootstrap replicas at once
+    ma = a[rng.integers(0, len(a), (num_samples, len(a)))].mean(axis=1)
+    mb = b[rng.integers(0, len(b), (num_samples, len(b)))].mean(axis=1)
+    ratios = mb / ma - 1
+
+    alpha = (1 - confidence) / 2
+    low, high = np.quantile(ratios, [alpha, 1 - alpha])
+    return value, float(low), float(high)
+
+
+def robust_spread(samples) -> tuple:
+    """
+    The median of `samples` and their median absolute deviation, scaled to be
+    comparable to a standard deviation but not moved by outliers. The
+    deviation is floored at a thousandth of the median, so a very repeatable
+    history does not make noise look significant.
+    """
+    x = np.asarray(samples, dtype=np.float64)
+    if len(x) == 0:
+        return math.nan, math.nan
+
+    median = float(np.median(x))
+    # makes the MAD a consistent estimate of the standard deviation
+    mad = 1.4826 * float(np.median(np.abs(x - median)))
+    return median, max(mad, 1e-3 * abs(median))
+
+
+def robust_zscore(value: float, history) -> float:
+    """
+    How far `value` is from the median of `history`, in units of its
+    `robust_spread`.
+    """
+    median, spread = robust_spread(history)
+    if math.isnan(median):
+        return math.nan
+    if spread == 0:
+        return 0.0 if value == median else math.inf
+    return (value - median) / spread
@@ -0,0 +1,267 @@
+import os
+import re
+import logging
+import pathlib
+
+import reframe.utility.typecheck as typ
+import reframe.utility.sanity as sn
+
+import reframe as rfm
+import reframe.core.builtins as blt
+from reframe.core.exceptions import BuildSystemError
+
+import harness.utils as utils
+from harness.build import (
+    SPEChpcBuild,
+    CONTORL_FILENAME,
+    ISOLATED_TREE_NAME,
+    RANKS_DIR_FORMAT,
+    check_num_ranks,
+    read_control_file,
+)
+
+logger = logging.getLogger(__name__)
+
+SUITE_MAKEFILE_NAME = "suite.mk"
+BUILD_TIMES_NAME = "build_times.txt"
+
+
+def _make_escape(cmd: str) -> str:
+    return cmd.replace("$", "$$")
+
+
+class SPEChpcSuiteBuild(SPEChpcBuild):
+    """
+    Builds several SPEChpc benchmarks at once. A single `runhpc` call sets up
+    every benchmark, and the `specmake` invocations are then driven by one GNU
+    make, so they all share the same jobserver sized to the build node's cores.
+
+    The build products of each benchmark are copied into a sub-directory of
+    the stage directory named after the benchmark, and the start and end time
+    of each `specmake` is written to `BUILD_TIMES_NAME`.
+    """
+
+    spechpc_benchmarks = variable(typ.List[str], value=[])
+    # benchmark name to the input files to copy alongside the executable
+    spechpc_additional_inputs = variable(typ.Dict[str, typ.List[str]], value={})
+    # benchmarks that do not have a control file
+    spechpc_no_control_file = variable(typ.List[str], value=[])
+    # size of the jobserver, or `None` for the number of cores on the build node
+    spechpc_build_jobs = variable(int, type(None), value=None)
+
+    def _check_preconditions(self):
+        if not self.spechpc_benchmarks:
+            raise BuildSystemError("No benchmarks given to the suite build.")
+
+        # the executable is per-benchmark, so only check the rest
+        self.executable = self.executable or utils.benchmark_binary_name(
+            self.spechpc_benchmarks[0]
+        )
+        super()._check_preconditions()
+
+    def _benchmarks(self) -> typ.List[str]:
+        return self.spechpc_benchmarks
+
+    def _benchmark_products(self, benchmark: str) -> typ.List[str]:
+        products = []
+        if benchmark not in self.spechpc_no_control_file:
+            products.append(CONTORL_FILENAME)
+        products += self.spechpc_additional_inputs.get(benchmark, [])
+        return products
+
+    def _benchmark_recipe(self, tree: str, benchmark: str) -> str:
+        outdir = os.path.join(self.stagedir, benchmark)
+        times = os.path.join(self.stagedir, BUILD_TIMES_NAME)
+        build_dir = os.path.join(tree, "benchspec", "HPC", benchmark, "build")
+        executable = utils.benchmark_binary_name(benchmark)
+
+        cmds = [
+            f'mkdir -p "{outdir}"',
+            f'cd "{build_dir}"',
+            'cd "$(ls -d *.* | sort -n | head -n 1)"',
+            "RUNID=$(basename $(pwd) | cut -d. -f2)",
+            self._detect_rank_dependence(outdir),
+            "START=$(date +%s.%N)",
+            # no -j here, so that specmake joins the parent jobserver
+            "specmake",
+            f'echo "{benchmark} $START $(date +%s.%N)" >> "{times}"',
+            f'cp "{executable}" "{outdir}"',
+            f'cd "../../run/run_{self.spechpc_tune}_ref_intel_mpi.$RUNID"',
+        ]
+        cmds += [f'cp "{f}" "{outdir}"' for f in self._benchmark_products(benchmark)]
+
+        return _make_escape(" && ".join(cmds))
+
+    def _write_suite_makefile(self, tree: str) -> str:
+        lines = [
+            ".PHONY: all " + " ".join(self.spechpc_benchmarks),
+            "all: " + " ".join(self.spechpc_benchmarks),
+            "",
+        ]
+        for benchmark in self.spechpc_benchmarks:
+            lines += [
+                f"{benchmark}:",
+                # `+` so the recipe is given the jobserver even under -n
+                "\t+@" + self._benchmark_recipe(tree, benchmark),
+                "",
+            ]
+
+        path = os.path.join(self.stagedir, SUITE_MAKEFILE_NAME)
+        pathlib.Path(path).write_text("\n".join(lines))
+        return path
+
+    def _setup_spechpc(self) -> typ.List[str]:
+        tree = os.path.join(self.stagedir, ISOLATED_TREE_NAME)
+        makefile = self._write_suite_makefile(tree)
+        jobs = self.spechpc_build_jobs or "$(nproc)"
+
+        return [
+            *self._clone_spechpc_tree(tree),
+            f'cp "{self.spechpc_config}" "{os.path.join(tree, "config")}"',
+            f'cd "{tree}"',
+            "source shrc",
+            # set up every benchmark in one go
+            self._create_spechpc_build_command(),
+            f'rm -f "{os.path.join(self.stagedir, BUILD_TIMES_NAME)}"',
+            f'make -f "{makefile}" -j {jobs} all',
+            *[
+                c
+                for b in self.spechpc_benchmarks
+                if b not in self.spechpc_no_control_file
+                for c in self._reuse_ranks_cmds(tree, b, os.path.join(self.stagedir, b))
+            ],
+            f'cd "{self.stagedir}"',
+        ]
+
+    def emit_build_commands(self, environ):
+        self._check_preconditions()
+
+        if not self.spechpc_config:
+            logger.debug("Generating SPEChpc configuration from system environment")
+            self.spechpc_config = self._generate_spechpc_config(environ)
+
+        # todo: the build cache is per-benchmark, so is not used here
+        return self._setup_spechpc()
+
+
+class SPEChpcSuiteBinary:
+    """
+    The build products of a single benchmark from a suite build, with the same
+    interface as `build_SPEChpc_benchmark_Base` so they can be used by the run
+    tests in its place.
+    """
+
+    def __init__(self, suite, benchmark: str):
+        if benchmark not in suite.spechpc_benchmarks:
+            raise ValueError(f"{benchmark} is not part of the suite build")
+
+        self.suite = suite
+        self.spechpc_benchmark = benchmark
+        self.stagedir = os.path.join(suite.stagedir, benchmark)
+        self.executable = utils.benchmark_binary_name(benchmark)
+        self.num_runtime_ranks = suite.num_runtime_ranks
+        self.reuse_ranks = suite.reuse_ranks
+        self.additional_inputs = suite.spechpc_additional_inputs.get(benchmark, [])
+        self.use_control_file = benchmark not in suite.spechpc_no_control_file
+
+    @property
+    def executable_path(self):
+        return self.relpath(self.executable)
+
+    def relpath(self, path):
+        return os.path.join(self.stagedir, path)
+
+    def check_num_ranks(self, num_ranks: int):
+        check_num_ranks(
+            self.spechpc_benchmark,
+            self.stagedir,
+            self.num_runtime_ranks,
+            self.reuse_ranks,
+            num_ranks,
+        )
+
+    def read_executable_opts(self, num_ranks=None) -> typ.List[str]:
+        if not self.use_control_file:
+            return []
+
+        if (num_ranks is None) or (num_ranks == self.num_runtime_ranks):
+            return read_control_file(self.stagedir)
+        return read_control_file(self.relpath(RANKS_DIR_FORMAT.format(num_ranks)))
+
+
+class build_SPEChpc_suite_Base(rfm.CompileOnlyRegressionTest):
+    """
+    Builds several benchmarks with a single `runhpc` setup and a shared make
+    jobserver. The build time of each benchmark is reported as a performance
+    variable. Run tests select their benchmark with `binary`.
+    """
+
+    modules = ["rhel8/default-icl", "intel-oneapi-mkl/2022.1.0/intel/mngj3ad6"]
+
+    build_system = SPEChpcSuiteBuild()
+    sourcesdir = "../support/"
+
+    # must be set by downstream classes
+    spechpc_benchmarks = variable(typ.List[str])
+    spechpc_additional_inputs = variable(typ.Dict[str, typ.List[str]], value={})
+    spechpc_no_control_file = variable(typ.List[str], value=[])
+    spechpc_dir = variable(str, type(None), value=None)
+    spechpc_num_nodes = variable(int, value=1)
+    # as for `build_SPEChpc_benchmark_Base`
+    spechpc_reuse_num_nodes = variable(typ.List[int], value=[])
+    spechpc_build_jobs = variable(int, type(None), value=None)
+
+    @blt.run_before("compile")
+    def set_build_variables(self):
+        if not self.spechpc_dir:
+            self.spechpc_dir = utils.lookup_spechpc_root_dir(self.current_system.name)
+
+        # TODO: currently assume the ranks are fully allocated across the nodes
+        num_cpus = self.current_partition.processor.num_cpus
+        self.num_runtime_ranks = num_cpus * self.spechpc_num_nodes
+        self.reuse_ranks = [
+            num_cpus * n
+            for n in self.spechpc_reuse_num_nodes
+            if n != self.spechpc_num_nodes
+        ]
+
+        self.build_system.spechpc_dir = self.spechpc_dir
+        self.build_system.spechpc_num_ranks = self.num_runtime_ranks
+        self.build_system.spechpc_reuse_ranks = self.reuse_ranks
+        self.build_system.partition_name = self.current_partition.name
+        self.build_system.stagedir = self.stagedir
+        self.build_system.spechpc_benchmarks = self.spechpc_benchmarks
+        self.build_system.spechpc_additional_inputs = self.spechpc_additional_inputs
+        self.build_system.spechpc_no_control_file = self.spechpc_no_control_file
+        self.build_system.spechpc_build_jobs = self.spechpc_build_jobs
+
+    @blt.sanity_function
+    def validate_build(self):
+        return sn.all(
+            sn.assert_found(rf"^{re.escape(b)} ", BUILD_TIMES_NAME)
+            for b in self.spechpc_benchmarks
+        )
+
+    @blt.performance_function("s")
+    def extract_build_time(self, benchmark=None):
+        query = rf"^{re.escape(benchmark)} (?P<start>\S+) (?P<end>\S+)"
+        start = sn.extractsingle(query, BUILD_TIMES_NAME, "start", float)
+        end = sn.extractsingle(query, BUILD_TIMES_NAME, "end", float)
+        return end - start
+
+    @blt.performance_function("s")
+    def extract_suite_build_time(self):
+        starts = sn.extractall(r"^\S+ (\S+) \S+", BUILD_TIMES_NAME, 1, float)
+        ends = sn.extractall(r"^\S+ \S+ (\S+)", BUILD_TIMES_NAME, 1, float)
+        return sn.max(ends) - sn.min(starts)
+
+    @blt.run_before("performance")
+    def set_performance_variables(self):
+        self.perf_variables = {
+            f"{b}/build time": self.extract_build_time(b)
+            for b in self.spechpc_benchmarks
+        }
+        self.perf_variables["Suite build time"] = self.extract_suite_build_time()
+
+    def binary(self, benchmark: str) -> SPEChpcSuiteBinary:
+        return SPEChpcSuiteBinary(self, benchmark)
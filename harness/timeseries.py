@@ -0,0 +1,276 @@
+import os
+import logging
+
+import numpy as np
+
+import harness.compression as compression
+
+logger = logging.getLogger(__name__)
+
+# separates the source and column names in the flat export formats
+KEY_SEPARATOR = "::"
+TIME_COLUMN = "__time__"
+
+
+class _Source:
+    __slots__ = ("times", "columns")
+
+    def __init__(self, times: np.array):
+        self.times = times
+        self.columns = {}
+
+
+def _readonly_view(a: np.array) -> np.array:
+    v = a.view()
+    v.flags.writeable = False
+    return v
+
+
+class TimeSeriesStore:
+    """
+    Columnar store for the time series measured during a run.
+
+    Each source (e.g. `perf/<node>` or `BMC/<node>`) has a single float64
+    timestamp index that is shared by all of its columns, and each column is a
+    float64 array. Arrays are kept as given where possible, so adding the
+    fields of a parsed perf record array does not copy, and `view` hands out
+    read-only views rather than copies.
+
+    Only a summary of the store goes into the ReFrame report. The data itself is
+    exported with `to_npz`, `to_packed` or `to_parquet`, and `downsampled` gives
+    a column at a fixed number of points for plotting.
+    """
+
+    def __init__(self):
+        self._sources = {}
+        self.filename = None
+
+    def __contains__(self, source: str) -> bool:
+        return source in self._sources
+
+    def __len__(self) -> int:
+        return len(self._sources)
+
+    def sources(self) -> list:
+        return list(self._sources.keys())
+
+    def columns(self, source: str) -> list:
+        return list(self._sources[source].columns.keys())
+
+    @property
+    def nbytes(self) -> int:
+        total = 0
+        for s in self._sources.values():
+            total += s.times.nbytes + sum(c.nbytes for c in s.columns.values())
+        return total
+
+    def add(self, source: str, column: str, times, values):
+        """
+        Adds a column to a source. If the source already has a different
+        timestamp index, both are aligned on the union of the timestamps and
+        the missing values are filled with NaN.
+        """
+        times = np.asarray(times, dtype=np.float64)
+        values = np.asarray(values, dtype=np.float64)
+
+        if times.shape != values.shape or times.ndim != 1:
+            raise ValueError(
+                f"Times and values must be 1D and of equal length for {source}/{column}"
+            )
+
+        entry = self._sources.get(source, None)
+        if entry is None:
+            self._sources[source] = entry = _Source(times)
+        elif not (entry.times is times or np.array_equal(entry.times, times)):
+            logger.debug("Re-indexing time series source %s", source)
+            union = np.union1d(entry.times, times)
+            for name, col in entry.columns.items():
+                entry.columns[name] = _reindex(entry.times, col, union)
+            values = _reindex(times, values, union)
+            entry.times = union
+
+        entry.columns[column] = values
+
+    def view(self, source: str, column: str):
+        """
+        Returns read-only `(times, values)` views of a single column.
+        """
+        entry = self._sources[source]
+        return _readonly_view(entry.times), _readonly_view(entry.columns[column])
+
+    def downsampled(self, source: str, column: str, max_points: int):
+        """
+        Returns `(times, values)` of a column reduced to at most `max_points`
+        with `lttb_indices`, leaving out non-finite values.
+        """
+        times, values = self.view(source, column)
+        finite = np.flatnonzero(np.isfinite(values))
+        index = finite[lttb_indices(times[finite], values[finite], max_points)]
+        return times[index], values[index]
+
+    def items(self):
+        """
+        Iterates over `(source, column, times, values)` of every column.
+        """
+        for source, entry in self._sources.items():
+            for column in entry.columns:
+                yield (source, column, *self.view(source, column))
+
+    def to_npz(self, path: str, compressed: bool = True):
+        arrays = {}
+        for source, entry in self._sources.items():
+            arrays[source + KEY_SEPARATOR + TIME_COLUMN] = entry.times
+            for column, values in entry.columns.items():
+                arrays[source + KEY_SEPARATOR + column] = values
+
+        if compressed:
+            np.savez_compressed(path, **arrays)
+        else:
+            np.savez(path, **arrays)
+        self.filename = os.path.basename(path)
+
+    def to_packed(self, path: str, level: int = compression.DEFAULT_LEVEL):
+        """
+        Writes the same layout as `to_npz`, but with every array losslessly
+        compressed by `compression.encode`, which is several times smaller for
+        archiving. Read back with `from_npz`.
+        """
+        arrays = {}
+        for source, entry in self._sources.items():
+            arrays[source + KEY_SEPARATOR + TIME_COLUMN] = _packed(
+                entry.times, compression.CODEC_DELTA2, level
+            )
+            for column, values in entry.columns.items():
+                arrays[source + KEY_SEPARATOR + column] = _packed(
+                    values, compression.CODEC_XOR, level
+                )
+
+        # already compressed, so not zipped again
+        np.savez(path, **arrays)
+        self.filename = os.path.basename(path)
+
+    @classmethod
+    def from_npz(cls, path: str) -> "TimeSeriesStore":
+        """
+        Reads a store written by either `to_npz` or `to_packed`.
+        """
+
+        def _load(key):
+            a = data[key]
+            return compression.decode(a) if compression.is_encoded(a) else a
+
+        store = cls()
+        with np.load(path, allow_pickle=False) as data:
+            keys = [k.split(KEY_SEPARATOR, 1) for k in data.files]
+            for source, column in keys:
+                if column == TIME_COLUMN:
+                    store._sources[source] = _Source(
+                        _load(source + KEY_SEPARATOR + column)
+                    )
+            for source, column in keys:
+                if column != TIME_COLUMN:
+                    store._sources[source].columns[column] = _load(
+                        source + KEY_SEPARATOR + column
+                    )
+
+        store.filename = path
+        return store
+
+    def to_parquet(self, path: str):
+        """
+        Writes the store in long format (`source`, `column`, `time`, `value`).
+        Requires `pyarrow`.
+        """
+        try:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+        except ImportError as e:
+            raise ImportError("Writing parquet files requires `pyarrow`") from e
+
+        sources, columns, times, values = [], [], [], []
+        for source, column, t, v in self.items():
+            sources.append(np.full(len(t), source, dtype=object))
+            columns.append(np.full(len(t), column, dtype=object))
+            times.append(t)
+            values.append(v)
+
+        def _cat(arrays, dtype):
+            return np.concatenate(arrays) if arrays else np.array([], dtype=dtype)
+
+        table = pa.table(
+            {
+                "source": pa.array(
+                    _cat(sources, object), pa.string()
+                ).dictionary_encode(),
+                "column": pa.array(
+                    _cat(columns, object), pa.string()
+                ).dictionary_encode(),
+                "time": _cat(times, np.float64),
+                "value": _cat(values, np.float64),
+            }
+        )
+        pq.write_table(table, path)
+        self.filename = os.path.basename(path)
+
+    def __rfm_json_encode__(self):
+        # keep the report small: only say what was measured and where it went
+        return {
+            "filename": self.filename,
+            "sources": {
+                source: {"length": len(entry.times), "columns": list(entry.columns)}
+                for (source, entry) in self._sources.items()
+            },
+        }
+
+
+def _reindex(times: np.array, values: np.array, index: np.array) -> np.array:
+    out = np.full(len(index), np.nan)
+    out[np.searchsorted(index, times)] = values
+    return out
+
+
+def _packed(values: np.array, codec: int, level: int) -> np.array:
+    return np.frombuffer(compression.encode(values, codec, level), dtype=np.uint8)
+
+
+def lttb_indices(times: np.array, values: np.array, max_points: int) -> np.array:
+    """
+    The indices of at most `max_points` samples that keep the shape of the
+    series, by Largest-Triangle-Three-Buckets: the first and last samples are
+    kept, the rest are split into equal buckets, and from each bucket the
+    sample forming the largest triangle with the sample kept from the bucket
+    before and the mean of the bucket after is kept.
+    """
+    n = len(times)
+    if max_points >= n:
+        return np.arange(n)
+    if max_points < 3:
+        raise ValueError("Need at least 3 points to keep the shape")
+
+    t = np.asarray(times, dtype=np.float64)
+    v = np.asarray(values, dtype=np.float64)
+
+    # `max_points - 2` buckets between the first and last samples
+    edges = np.linspace(1, n - 1, max_points - 1).astype(np.int64)
+    counts = np.diff(edges)
+    mean_t = np.add.reduceat(t[:-1], edges[:-1]) / counts
+    mean_v = np.add.reduceat(v[:-1], edges[:-1]) / counts
+    # the point after each bucket, with the last sample after the last bucket
+    next_t = np.append(mean_t[1:], t[-1])
+    next_v = np.append(mean_v[1:], v[-1])
+
+    selected = np.empty(max_points, dtype=np.int64)
+    selected[0] = 0
+    selected[-1] = n - 1
+    a = 0
+    for i in range(max_points - 2):
+        lo, hi = edges[i], edges[i + 1]
+        # twice the triangle areas, which is enough to compare them
+        area = np.abs(
+            (t[a] - next_t[i]) * (v[lo:hi] - v[a])
+            - (t[a] - t[lo:hi]) * (next_v[i] - v[a])
+        )
+        a = lo + int(np.argmax(area))
+        selected[i + 1] = a
+
+    return selected
@@ -3,10 +3,12 @@ import os
 import re
 import datetime
 
+import numpy as np
+
 from harness.config import SPECHPC_ROOT_LOOKUP
 
 import reframe.utility.osext as osext
-import reframe.utility.sanity as sn
+import reframe.utility.typecheck as typ
 
 logger = logging.getLogger(__name__)
 
@@ -22,8 +24,8 @@ if not SPECHPC_DIR_PATH:
     )
 
 
-def subtract_cooldown(s: str, cooldown: int) -> str:
-    date = datetime.datetime.strptime(s, DATETIME_FORMAT)
+def subtract_cooldown(s: str, cooldown: float) -> str:
+    date = parse_date(s)
     date = date - datetime.timedelta(seconds=cooldown)
     return date.strftime(DATETIME_FORMAT)
 
@@ -50,18 +52,109 @@ def benchmark_binary_name(benchmark_name: str) -> str:
     return os.path.join(".", benchmark_name.split(".")[1].split("_")[0])
 
 
-def extract_perf_values_for_host(socket, key, fd, group, host_index):
-    query = rf"(?P<time>\S+)\s+S{socket}\s+\d+\s+(?P<energy>\S+) \w+ {key}"
+PERF_INTERVAL_DTYPE = np.dtype(
+    [
+        ("host", np.int32),
+        ("socket", np.int32),
+        ("event", np.int32),
+        ("step", np.int32),
+        ("time", np.float64),
+        ("value", np.float64),
+    ]
+)
+
+# marker written to stderr at the start of each step of a batched run
+STEP_MARKER = "SRFM_STEP"
+
+PERF_INTERVAL_REGEX = re.compile(
+    rf"^{STEP_MARKER} (?P<step>\d+) start (?P<epoch>\S+)$"
+    # perf right-aligns the times, so the lines may start with spaces
+    r"|^\s*(?:\[(?P<host>\d+)\]\s+)?(?P<time>\S+)\s+S(?P<socket>\d+)\s+\d+\s+"
+    r"(?P<value>\S+) \w+ (?P<event>\S+)",
+    re.MULTILINE,
+)
+
+
+def read_perf_intervals(path: str, events: typ.List[str]) -> np.array:
+    """
+    Reads the `perf stat -I --per-socket` output in a single pass, returning a
+    structured array with fields `host`, `socket`, `event`, `step`, `time` and
+    `value`. The `event` field is the index of the event in `events`, and lines
+    for any other event are skipped. The `host` field is the MPI rank prefix
+    added by the launcher in multi-node mode, or -1 if there is none.
+
+    For batched runs, each step starts with a `STEP_MARKER` line carrying the
+    step index and its start time as a unix timestamp. Records after a marker
+    get that step index, and their times are offset by the start time so that
+    they are unix timestamps too. Otherwise `step` is -1 and the times are
+    relative to the start of perf.
+    """
+    event_index = {e: i for (i, e) in enumerate(events)}
+
+    with open(path) as f:
+        text = f.read()
+
+    step = -1
+    offset = 0.0
+
+    rows = []
+    for match in PERF_INTERVAL_REGEX.finditer(text):
+        if match.group("step") is not None:
+            step = int(match.group("step"))
+            offset = float(match.group("epoch"))
+            continue
+
+        event = event_index.get(match.group("event"), None)
+        if event is None:
+            continue
+
+        try:
+            time = float(match.group("time"))
+            value = float(match.group("value"))
+        except ValueError:
+            # e.g. `<not counted>`
+            continue
+
+        host = match.group("host")
+        rows.append(
+            (
+                -1 if host is None else int(host),
+                int(match.group("socket")),
+                event,
+                step,
+                time + offset,
+                value,
+            )
+        )
 
-    # if looking for hostname index then prepend it
-    if not host_index is None:
-        query = rf"\[{host_index}\]\s+" + query
+    return np.array(rows, dtype=PERF_INTERVAL_DTYPE)
 
-    return sn.extractall(
-        query,
-        fd,
-        group,
-        float,
+
+STEP_TIMES_DTYPE = np.dtype(
+    [("step", np.int32), ("start", np.float64), ("end", np.float64)]
+)
+
+
+def read_step_times(path: str) -> np.array:
+    """
+    Reads the `STEP_MARKER start|end` lines of a batched run, returning a
+    structured array of `step`, `start` and `end` unix timestamps for every
+    step that finished.
+    """
+    starts = {}
+    ends = {}
+    with open(path) as f:
+        for line in f:
+            parts = line.split()
+            if len(parts) != 4 or parts[0] != STEP_MARKER:
+                continue
+            times = starts if parts[2] == "start" else ends
+            times[int(parts[1])] = float(parts[3])
+
+    steps = sorted(s for s in starts if s in ends)
+    return np.array(
+        [(s, starts[s], ends[s]) for s in steps],
+        dtype=STEP_TIMES_DTYPE,
     )
 
 
@@ -112,8 +205,16 @@ def format_date(date: datetime.datetime) -> str:
     return date.strftime(DATETIME_FORMAT)
 
 
+def parse_date(s: str) -> datetime.datetime:
+    return datetime.datetime.strptime(s, DATETIME_FORMAT)
+
+
+def now() -> datetime.datetime:
+    return datetime.datetime.now()
+
+
 def time_now(start: bool = True) -> str:
-    date = datetime.datetime.now()
+    date = now()
 
     if start:
         date = date - DATETIME_QUERY_DELTA
@@ -0,0 +1,402 @@
+"""
+A local store of every run, so that runs can be queried without loading the
+ReFrame reports they came from. The scalar metrics of each run go into an
+indexed SQLite database, and its time series into a columnar side file.
+
+Runs are added either as they finish, with the `WarehouseSink` mixin and
+`SRFM_WAREHOUSE_DIR` set, or in bulk from existing reports:
+
+    python -m harness.warehouse <dir> import report.json [report.json ...]
+    python -m harness.warehouse <dir> query --benchmark Lbm_t --partition sapphire \\
+        --min-frequency 1200 --max-frequency 1600 --metric "Core time"
+"""
+
+import os
+import sys
+import shutil
+import sqlite3
+import logging
+import argparse
+import datetime
+import collections
+
+import reframe as rfm
+import reframe.core.builtins as blt
+
+import harness.report as report
+from harness.timeseries import TimeSeriesStore
+
+logger = logging.getLogger(__name__)
+
+SRFM_WAREHOUSE_DIR = os.environ.get("SRFM_WAREHOUSE_DIR", None)
+
+DATABASE_FILE = "runs.sqlite"
+SERIES_DIR = "series"
+# the time series side files are converted to this format where possible
+SERIES_FORMAT = ".parquet"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    id INTEGER PRIMARY KEY,
+    key TEXT UNIQUE NOT NULL,
+    name TEXT NOT NULL,
+    benchmark TEXT,
+    system TEXT,
+    partition TEXT,
+    frequency REAL,
+    powercap REAL,
+    num_nodes INTEGER,
+    completion_time REAL,
+    series TEXT
+);
+CREATE TABLE IF NOT EXISTS nodes (
+    run INTEGER NOT NULL REFERENCES runs(id),
+    node TEXT NOT NULL,
+    PRIMARY KEY (node, run)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS metrics (
+    run INTEGER NOT NULL REFERENCES runs(id),
+    name TEXT NOT NULL,
+    value REAL,
+    unit TEXT,
+    PRIMARY KEY (run, name)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS runs_benchmark
+    ON runs (benchmark, partition, frequency, powercap);
+CREATE INDEX IF NOT EXISTS runs_partition ON runs (partition, frequency, powercap);
+CREATE INDEX IF NOT EXISTS runs_time ON runs (completion_time);
+"""
+
+Run = collections.namedtuple(
+    "Run",
+    [
+        "id",
+        "name",
+        "benchmark",
+        "system",
+        "partition",
+        "frequency",
+        "powercap",
+        "num_nodes",
+        "completion_time",
+        "series",
+        "metrics",
+    ],
+)
+
+
+def _run_key(testcase: dict) -> str:
+    # the same run is recognised whether it came from the sink or a report
+    return "{}@{}:{}@{}".format(
+        testcase.get("display_name", testcase["name"]),
+        testcase.get("system"),
+        testcase.get("partition"),
+        testcase.get("job_completion_time_unix"),
+    )
+
+
+def _number(value):
+    # unset variables are reported as `<undefined>`
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def _series_path(testcase: dict):
+    ts = testcase.get("time_series")
+    outputdir = testcase.get("outputdir")
+    if not isinstance(ts, dict) or not ts.get("filename") or not outputdir:
+        return None
+    path = os.path.join(outputdir, os.path.basename(ts["filename"]))
+    return path if os.path.isfile(path) else None
+
+
+class Warehouse:
+    """
+    The SQLite database and time series side files in a directory. Runs are
+    keyed on their name, partition and completion time, so adding the same
+    run twice keeps the first.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        os.makedirs(os.path.join(path, SERIES_DIR), exist_ok=True)
+
+        self.db = sqlite3.connect(os.path.join(path, DATABASE_FILE), timeout=60)
+        self.db.executescript(SCHEMA)
+        self._warned_parquet = False
+
+    def close(self):
+        self.db.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def _store_series(self, run_id: int, source: str) -> str:
+        name = str(run_id)
+        _, ext = os.path.splitext(source)
+        if ext != SERIES_FORMAT:
+            try:
+                dest = os.path.join(self.path, SERIES_DIR, name + SERIES_FORMAT)
+                TimeSeriesStore.from_npz(source).to_parquet(dest)
+                return os.path.relpath(dest, self.path)
+            except ImportError:
+                if not self._warned_parquet:
+                    logger.warn("Keeping time series as %s, as pyarrow is missing", ext)
+                    self._warned_parquet = True
+
+        dest = os.path.join(self.path, SERIES_DIR, name + ext)
+        shutil.copyfile(source, dest)
+        return os.path.relpath(dest, self.path)
+
+    def _insert(self, testcase: dict, series: str = None):
+        cursor = self.db.execute(
+            "INSERT OR IGNORE INTO runs (key, name, benchmark, system, partition,"
+            " frequency, powercap, num_nodes, completion_time)"
+            " VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (
+                _run_key(testcase),
+                testcase["name"],
+                report.benchmark_name(testcase),
+                testcase.get("system"),
+                testcase.get("partition"),
+                _number(testcase.get("cpu_frequency")),
+                _number(testcase.get("powercap_value")),
+                testcase.get("num_nodes"),
+                testcase.get("job_completion_time_unix"),
+            ),
+        )
+        if cursor.rowcount == 0:
+            return None
+
+        run_id = cursor.lastrowid
+        nodes = testcase.get("nodelist") or []
+        self.db.executemany(
+            "INSERT OR IGNORE INTO nodes (run, node) VALUES (?, ?)",
+            [(run_id, n) for n in nodes],
+        )
+
+        units = report.perf_units(testcase)
+        self.db.executemany(
+            "INSERT OR REPLACE INTO metrics (run, name, value, unit) VALUES (?, ?, ?, ?)",
+            [
+                (run_id, k, v, units.get(k))
+                for (k, v) in report.perf_values(testcase).items()
+            ],
+        )
+
+        if series:
+            self.db.execute(
+                "UPDATE runs SET series = ? WHERE id = ?",
+                (self._store_series(run_id, series), run_id),
+            )
+        return run_id
+
+    def add(self, testcase: dict, series: str = None):
+        """
+        Adds a test case in the format of the ReFrame report, with the time
+        series from `series` if given. Returns the new run id, or `None` if
+        the run was already in the warehouse.
+        """
+        with self.db:
+            return self._insert(testcase, series)
+
+    def import_report(self, path: str) -> int:
+        """
+        Adds every successful test case of a report in a single transaction,
+        with the time series from their output directories. Returns the
+        number of new runs.
+        """
+        r = report.load_report(path)
+        added = 0
+        with self.db:
+            for tc in report.iter_testcases(r):
+                if tc.get("fixture"):
+                    continue
+                if self._insert(tc, _series_path(tc)) is not None:
+                    added += 1
+        return added
+
+    def query(
+        self,
+        benchmark: str = None,
+        partition: str = None,
+        system: str = None,
+        frequency: tuple = (None, None),
+        powercap: tuple = (None, None),
+        node: str = None,
+        since: float = None,
+        until: float = None,
+        metrics: list = None,
+    ) -> list:
+        """
+        Returns the runs matching every given filter, with their metrics, or
+        only the named `metrics`. The ranges are inclusive `(low, high)`
+        tuples where either end may be `None`, and the times are unix
+        timestamps of the job completion.
+        """
+        clauses, args = [], []
+
+        def _equal(column, value):
+            if value is not None:
+                clauses.append(f"runs.{column} = ?")
+                args.append(value)
+
+        def _range(column, low, high):
+            if low is not None:
+                clauses.append(f"runs.{column} >= ?")
+                args.append(low)
+            if high is not None:
+                clauses.append(f"runs.{column} <= ?")
+                args.append(high)
+
+        _equal("benchmark", benchmark)
+        _equal("partition", partition)
+        _equal("system", system)
+        _range("frequency", *frequency)
+        _range("powercap", *powercap)
+        _range("completion_time", since, until)
+        if node is not None:
+            clauses.append("runs.id IN (SELECT run FROM nodes WHERE node = ?)")
+            args.append(node)
+
+        where = (" WHERE " + " AND ".join(clauses)) if clauses else ""
+        rows = self.db.execute(
+            "SELECT id, name, benchmark, system, partition, frequency, powercap,"
+            " num_nodes, completion_time, series FROM runs"
+            + where
+            + " ORDER BY completion_time",
+            args,
+        ).fetchall()
+        if not rows:
+            return []
+
+        # fetch the metrics of every run in one go
+        ids = [row[0] for row in rows]
+        metric_clause = ""
+        metric_args = []
+        if metrics is not None:
+            metric_clause = f" AND name IN ({','.join('?' * len(metrics))})"
+            metric_args = list(metrics)
+
+        values = collections.defaultdict(dict)
+        for chunk in range(0, len(ids), 500):
+            part = ids[chunk : chunk + 500]
+            for run_id, name, value in self.db.execute(
+                f"SELECT run, name, value FROM metrics WHERE run IN ({','.join('?' * len(part))})"
+                + metric_clause,
+                part + metric_args,
+            ):
+                values[run_id][name] = value
+
+        return [Run(*row, values[row[0]]) for row in rows]
+
+    def time_series(self, run: Run):
+        """
+        Returns the path of the time series side file of a run, or `None`.
+        """
+        if not run.series:
+            return None
+        return os.path.join(self.path, run.series)
+
+
+class WarehouseSink(rfm.RegressionMixin):
+    """
+    Adds every finished run to the warehouse in `warehouse_dir`, which
+    defaults to `SRFM_WAREHOUSE_DIR`. Does nothing if neither is set.
+    """
+
+    warehouse_dir = variable(str, type(None), value=SRFM_WAREHOUSE_DIR)
+
+    def _warehouse_sink_testcase(self) -> dict:
+        # the same fields as the ReFrame report would have
+        testcase = {
+            "name": self.name,
+            "display_name": self.display_name,
+            "system": self.current_system.name,
+            "partition": self.current_partition.name,
+            "job_completion_time_unix": self.job.completion_time,
+            "nodelist": list(self.job.nodelist or []),
+            "num_nodes": getattr(self, "num_nodes", None),
+            "spechpc_benchmark": getattr(self, "spechpc_benchmark", None),
+            "cpu_frequency": getattr(self, "cpu_frequency", None),
+            "powercap_value": getattr(self, "powercap_value", None),
+            "perfvalues": {k: list(v) for (k, v) in self.perfvalues.items()},
+        }
+        return testcase
+
+    @blt.run_after("performance", always_last=True)
+    def _warehouse_sink_add(self):
+        if not self.warehouse_dir:
+            return
+
+        series = None
+        store = getattr(self, "time_series", None)
+        if store is not None and store.filename:
+            series = os.path.join(self.stagedir, store.filename)
+
+        with Warehouse(self.warehouse_dir) as w:
+            run_id = w.add(self._warehouse_sink_testcase(), series)
+        logger.debug("Added run %s to the warehouse in %s", run_id, self.warehouse_dir)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog="python -m harness.warehouse",
+        description="Import runs into or query the results warehouse.",
+    )
+    parser.add_argument("warehouse")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    importer = commands.add_parser("import", help="Import ReFrame reports")
+    importer.add_argument("reports", nargs="+")
+
+    query = commands.add_parser("query", help="List the matching runs")
+    query.add_argument("--benchmark")
+    query.add_argument("--partition")
+    query.add_argument("--system")
+    query.add_argument("--min-frequency", type=float)
+    query.add_argument("--max-frequency", type=float)
+    query.add_argument("--min-powercap", type=float)
+    query.add_argument("--max-powercap", type=float)
+    query.add_argument("--node")
+    query.add_argument("--since", help="e.g. 2024-06-01T00:00:00")
+    query.add_argument("--until")
+    query.add_argument("--metric", action="append", dest="metrics")
+    args = parser.parse_args(argv)
+
+    with Warehouse(args.warehouse) as w:
+        if args.command == "import":
+            for path in args.reports:
+                print(f"{path}: {w.import_report(path)} new runs")
+            return
+
+        def _timestamp(s):
+            return datetime.datetime.fromisoformat(s).timestamp() if s else None
+
+        runs = w.query(
+            benchmark=args.benchmark,
+            partition=args.partition,
+            system=args.system,
+            frequency=(args.min_frequency, args.max_frequency),
+            powercap=(args.min_powercap, args.max_powercap),
+            node=args.node,
+            since=_timestamp(args.since),
+            until=_timestamp(args.until),
+            metrics=args.metrics,
+        )
+        for run in runs:
+            metrics = " ".join(f"{k}={v:g}" for (k, v) in sorted(run.metrics.items()))
+            print(
+                f"{run.id:>6} {run.benchmark:<16} {run.partition or '':<12}"
+                f" {run.frequency or '':>8} {run.powercap or '':>6} {metrics}"
+            )
+        print(f"{len(runs)} runs")
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,49 @@
+import logging
+
+import reframe as rfm
+import reframe.core.builtins as blt
+
+import harness
+
+logger = logging.getLogger(__name__)
+
+# perf sampling intervals in milliseconds, where 0 runs without perf
+POLL_INTERVALS = [0, 100, 500, 1000, 10000]
+REPETITIONS = 5
+
+
+@rfm.simple_test
+class PerfOverhead(
+    harness.SPEChpcBase,
+    harness.PerfInstrument,
+    harness.SetupPerfEvents,
+):
+    """
+    Runs each tiny benchmark without perf and with perf at each of the
+    `POLL_INTERVALS`. Summarise the Core time overheads with
+
+        python -m harness.overhead <report.json>
+    """
+
+    num_nodes = 1
+    # all benchmarks come from one build
+    spechpc_binary = fixture(harness.build_Tiny_suite, scope="environment")
+
+    overhead_benchmark = parameter(harness.TINY_BENCHMARKS)
+    overhead_poll_interval = parameter(POLL_INTERVALS)
+    overhead_repetition = parameter(range(REPETITIONS))
+
+    # only the runtimes matter here
+    time_series_format = ""
+
+    @blt.run_after("init")
+    def set_benchmark(self):
+        self.spechpc_benchmark = self.overhead_benchmark
+
+    @blt.run_before("run")
+    def set_perf_interval(self):
+        if self.overhead_poll_interval == 0:
+            # skips the perf wrapper altogether
+            self.perf_events = []
+        else:
+            self.perf_poll_interval = self.overhead_poll_interval
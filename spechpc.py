@@ -1,7 +1,6 @@
 import logging
 
 import reframe as rfm
-import reframe.core.builtins as blt
 
 import harness
 import harness.config as config
@@ -11,39 +10,15 @@ F_MHZ = config.F_MHZ
 logger = logging.getLogger(__name__)
 
 
-class SetupPerfEvents(rfm.RegressionMixin):
-    """
-    Helper mixin that selects the available perf events depending on the
-    partition the job is being run on.
-    """
-
-    @blt.run_after("setup")
-    def set_perf_events(self):
-        partition_name = self.current_partition.name
-        if partition_name in (config.SAPPHIRE, config.ICELAKE):
-            self.perf_events = [
-                harness.PerfEvents.power.energy_ram,
-                harness.PerfEvents.power.energy_pkg,
-            ]
-        elif partition_name == config.CASCADE_LAKE:
-            self.perf_events = [
-                harness.PerfEvents.power.energy_cores,
-                harness.PerfEvents.power.energy_ram,
-                harness.PerfEvents.power.energy_pkg,
-            ]
-        else:
-            self.perf_events = [
-                harness.PerfEvents.power.energy_cores,
-                harness.PerfEvents.power.energy_pkg,
-            ]
-
-
+# the analyses of the harness are opt-in: mix e.g. `harness.PhaseEnergy`,
+# `harness.RunQuality`, `harness.HistoricalReferences` or
+# `harness.WarehouseSink` into a subclass of a check to enable them
 class BenchmarkBase(
     harness.SPEChpcBase,
     harness.PerfInstrument,
     harness.BMCInstrument,
     harness.FrequencySweepAll,
-    SetupPerfEvents,
+    harness.SetupPerfEvents,
 ): ...
 
 
@@ -53,7 +28,6 @@ class Lbm_t(BenchmarkBase):
     spechpc_binary = fixture(
         harness.build_Lbm_t,
         scope="environment",
-        variables={"spechpc_num_nodes": num_nodes},
     )
 
 
@@ -63,13 +37,6 @@ class Soma_t(BenchmarkBase):
     spechpc_binary = fixture(
         harness.build_Soma_t,
         scope="environment",
-        variables={"spechpc_num_nodes": num_nodes},
-    )
-    # using these fixtures to ensure the build process is serial between tests
-    dag_build = fixture(
-        harness.build_Lbm_t,
-        scope="environment",
-        variables={"spechpc_num_nodes": num_nodes},
     )
 
 
@@ -79,12 +46,6 @@ class Tealeaf_t(BenchmarkBase):
     spechpc_binary = fixture(
         harness.build_Tealeaf_t,
         scope="environment",
-        variables={"spechpc_num_nodes": num_nodes},
-    )
-    dag_build = fixture(
-        harness.build_Soma_t,
-        scope="environment",
-        variables={"spechpc_num_nodes": num_nodes},
     )
 
 
@@ -94,12 +55,6 @@ class Clvleaf_t(BenchmarkBase):
     spechpc_binary = fixture(
         harness.build_Clvleaf_t,
         scope="environment",
-        variables={"spechpc_num_nodes": num_nodes},
-    )
-    dag_build = fixture(
-        harness.build_Tealeaf_t,
-        scope="environment",
-        variables={"spechpc_num_nodes": num_nodes},
     )
 
 
@@ -109,12 +64,6 @@ class Pot3d_t(BenchmarkBase):
     spechpc_binary = fixture(
         harness.build_Pot3d_t,
         scope="environment",
-        variables={"spechpc_num_nodes": num_nodes},
-    )
-    dag_build = fixture(
-        harness.build_Clvleaf_t,
-        scope="environment",
-        variables={"spechpc_num_nodes": num_nodes},
     )
 
 
@@ -124,12 +73,6 @@ class Hpgmgfv_Exa_t(BenchmarkBase):
     spechpc_binary = fixture(
         harness.build_Hpgmgfv_Exa_t,
         scope="environment",
-        variables={"spechpc_num_nodes": num_nodes},
-    )
-    dag_build = fixture(
-        harness.build_Pot3d_t,
-        scope="environment",
-        variables={"spechpc_num_nodes": num_nodes},
     )
 
 
@@ -139,10 +82,4 @@ class Weather_t(BenchmarkBase):
     spechpc_binary = fixture(
         harness.build_Weather_t,
         scope="environment",
-        variables={"spechpc_num_nodes": num_nodes},
-    )
-    dag_build = fixture(
-        harness.build_Hpgmgfv_Exa_t,
-        scope="environment",
-        variables={"spechpc_num_nodes": num_nodes},
     )
@@ -0,0 +1,50 @@
+import os
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# the harness is imported from the checkout, as by the ReFrame checks, and the
+# fakes of the offline test bed from `bench`
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, "bench"))
+
+import testbed
+
+
+@pytest.fixture
+def prometheus(monkeypatch):
+    """
+    A fake Prometheus that the database module queries, without a cache.
+    """
+    import harness.database as database
+
+    with testbed.FakePrometheus() as fake:
+        # the database module reads its environment when first imported
+        monkeypatch.setattr(database, "SRFM_PROMETHEUS_ADDRESS", fake.address)
+        monkeypatch.setattr(database, "SRFM_PROMETHEUS_TOKEN", "offline")
+        monkeypatch.setattr(database, "SRFM_PROMETHEUS_OFFLINE", False)
+        monkeypatch.setattr(database, "DATABASE_QUERY_ENABLED", True)
+        monkeypatch.setattr(database, "QUERY_CACHE", None)
+        monkeypatch.setattr(database, "_session", None)
+        yield fake
+
+
+@pytest.fixture
+def sacct(tmp_path, monkeypatch):
+    """
+    The directory of a fake `sacct`, which is put first on the `PATH`.
+    """
+    directory = tmp_path / "bin"
+    directory.mkdir()
+    testbed.write_fake_sacct(str(directory))
+    monkeypatch.setenv("PATH", str(directory) + os.pathsep + os.environ["PATH"])
+    return str(directory)
+
+
+@pytest.fixture
+def stagedir(tmp_path):
+    directory = tmp_path / "stage"
+    directory.mkdir()
+    return str(directory)
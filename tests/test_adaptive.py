@@ -0,0 +1,101 @@
+import pytest
+
+from harness.frequency import partition_frequencies
+from harness.adaptive import (
+    STRATEGIES,
+    FakeRunBackend,
+    Measurement,
+    adaptive_search,
+    make_objective,
+)
+
+PARTITIONS = ["icelake", "sapphire", "cclake"]
+COMPUTE = [0.2, 0.5, 0.7, 0.9]
+TOLERANCE = 100.0
+MAX_RUNS = 6
+
+
+def _optimum(backend, frequencies, objective) -> float:
+    return min(frequencies, key=lambda f: objective(backend.model(f)))
+
+
+def _budget(backend, frequencies, quantile: float) -> float:
+    energies = sorted(backend.model(f).energy for f in frequencies)
+    return energies[int(quantile * len(energies))]
+
+
+@pytest.mark.parametrize("partition", PARTITIONS)
+@pytest.mark.parametrize("strategy", STRATEGIES)
+@pytest.mark.parametrize("objective", ["energy", "edp"])
+@pytest.mark.parametrize("compute", COMPUTE)
+def test_finds_optimum(partition, strategy, objective, compute):
+    frequencies = partition_frequencies(partition)
+    backend = FakeRunBackend(max(frequencies), compute=compute)
+    objective = make_objective(objective)
+
+    result = adaptive_search(backend, frequencies, objective, TOLERANCE, strategy)
+
+    optimum = _optimum(backend, frequencies, objective)
+    assert abs(result.best.frequency - optimum) <= TOLERANCE
+    assert result.num_runs <= MAX_RUNS
+    # every frequency is only run once
+    assert len(backend.runs) == len(set(backend.runs)) == result.num_runs
+
+
+@pytest.mark.parametrize("partition", PARTITIONS)
+@pytest.mark.parametrize("quantile", [0.3, 0.5, 0.7])
+@pytest.mark.parametrize("compute", COMPUTE)
+def test_time_under_budget(partition, quantile, compute):
+    frequencies = partition_frequencies(partition)
+    backend = FakeRunBackend(max(frequencies), compute=compute)
+    objective = make_objective(
+        "time_under_budget", _budget(backend, frequencies, quantile)
+    )
+
+    result = adaptive_search(backend, frequencies, objective, TOLERANCE, "golden")
+
+    optimum = _optimum(backend, frequencies, objective)
+    assert abs(result.best.frequency - optimum) <= TOLERANCE
+    assert result.num_runs <= MAX_RUNS
+
+
+@pytest.mark.parametrize("partition", PARTITIONS)
+def test_time_under_budget_parabolic(partition):
+    # more runs than the golden search, but still the optimum
+    frequencies = partition_frequencies(partition)
+    backend = FakeRunBackend(max(frequencies))
+    objective = make_objective("time_under_budget", _budget(backend, frequencies, 0.5))
+
+    result = adaptive_search(backend, frequencies, objective, TOLERANCE, "parabolic")
+
+    optimum = _optimum(backend, frequencies, objective)
+    assert abs(result.best.frequency - optimum) <= TOLERANCE
+    assert result.num_runs < len(frequencies)
+
+
+def test_time_under_budget_objective():
+    objective = make_objective("time_under_budget", 1000.0)
+
+    # the runtime under the budget, and penalised over it
+    assert objective(Measurement(10.0, 900.0)) == 10.0
+    assert objective(Measurement(10.0, 1000.0)) == 10.0
+    assert objective(Measurement(10.0, 1100.0)) > objective(Measurement(15.0, 900.0))
+
+    with pytest.raises(ValueError):
+        make_objective("time_under_budget")
+
+
+@pytest.mark.parametrize("strategy", STRATEGIES)
+def test_few_frequencies(strategy):
+    backend = FakeRunBackend(2000.0)
+    result = adaptive_search(backend, [1000.0, 2000.0], strategy=strategy)
+
+    assert sorted(backend.runs) == [1000.0, 2000.0]
+    assert result.best.frequency == _optimum(
+        backend, [1000.0, 2000.0], make_objective("energy")
+    )
+
+
+def test_unknown_strategy():
+    with pytest.raises(ValueError):
+        adaptive_search(FakeRunBackend(2000.0), [1000.0, 1500.0, 2000.0], strategy="x")
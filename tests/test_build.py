@@ -0,0 +1,270 @@
+import os
+import subprocess
+
+import pytest
+
+from reframe.core.environments import ProgEnvironment
+
+import harness.build as build
+from harness.build import SPEChpcBuild
+
+
+@pytest.fixture
+def builder(tmp_path, monkeypatch):
+    monkeypatch.setattr(build, "SRFM_BUILD_CACHE_DIR", str(tmp_path / "cache"))
+
+    config = tmp_path / "spechpc.cfg"
+    config.write_text("OPTIMIZE = -O2 -xHOST\n")
+    spechpc = tmp_path / "spechpc"
+    spechpc.mkdir()
+
+    b = SPEChpcBuild()
+    b.spechpc_config = str(config)
+    b.spechpc_dir = str(spechpc)
+    b.spechpc_num_ranks = 76
+    b.spechpc_benchmark = "605.lbm_s"
+    b.partition_name = "icelake"
+    b.partition_fullname = "csd3:icelake"
+    b.build_modules = ["rhel8/default-icl"]
+    b.executable = "lbm"
+    b.stagedir = str(tmp_path / "stage")
+    os.makedirs(b.stagedir)
+    return b
+
+
+def _environ(modules=("intel/2022",)):
+    return ProgEnvironment(
+        "intel", modules=list(modules), cc="fakecc", cxx="fakecxx", ftn="fakeftn"
+    )
+
+
+def test_cache_key_inputs(builder, tmp_path):
+    environ = _environ()
+    key = builder._build_cache_key(environ)
+    assert builder._build_cache_key(environ) == key
+
+    builder.partition_fullname = "csd3:cclake"
+    assert builder._build_cache_key(environ) != key
+    builder.partition_fullname = "csd3:icelake"
+
+    builder.build_modules = ["rhel8/default-ccl"]
+    assert builder._build_cache_key(environ) != key
+    builder.build_modules = ["rhel8/default-icl"]
+
+    assert builder._build_cache_key(_environ(["intel/2023"])) != key
+
+    other = tmp_path / "spechpc-2"
+    other.mkdir()
+    builder.spechpc_dir = str(other)
+    assert builder._build_cache_key(environ) != key
+
+
+def _fake_compilers(bindir, version):
+    for name in ("fakecc", "fakecxx", "fakeftn"):
+        path = bindir / name
+        path.write_text(f"#!/bin/sh\necho '{name} (ICX) {version}'\n")
+        path.chmod(0o755)
+
+
+def _bash(script, bindir):
+    env = dict(os.environ, PATH=f"{bindir}{os.pathsep}{os.environ['PATH']}")
+    return subprocess.run(
+        ["bash", "-c", script], env=env, capture_output=True, text=True, check=True
+    ).stdout
+
+
+def _entry(builder, environ, bindir, version):
+    _fake_compilers(bindir, version)
+    script = (
+        builder._cache_entry_cmd(environ) + f"\necho ${build.BUILD_CACHE_ENTRY_VAR}"
+    )
+    return _bash(script, bindir).strip()
+
+
+@pytest.fixture
+def bindir(tmp_path):
+    directory = tmp_path / "bin"
+    directory.mkdir()
+    return directory
+
+
+def test_cache_entry_includes_compiler_versions(builder, bindir):
+    environ = _environ()
+
+    entry = _entry(builder, environ, bindir, "2022.1.0")
+    assert entry.startswith(
+        os.path.join(build.SRFM_BUILD_CACHE_DIR, builder._build_cache_key(environ))
+    )
+    assert _entry(builder, environ, bindir, "2022.1.0") == entry
+    assert _entry(builder, environ, bindir, "2023.2.0") != entry
+
+
+def test_cache_hit_restores_products(builder, bindir):
+    environ = _environ()
+    entry = _entry(builder, environ, bindir, "2022.1.0")
+    os.makedirs(entry)
+    for name in ("lbm", build.CONTORL_FILENAME, build.BUILD_CACHE_COMPLETE):
+        with open(os.path.join(entry, name), "w") as f:
+            f.write(name)
+
+    out = _bash("\n".join(builder.emit_build_commands(environ)), bindir)
+
+    assert "Restoring 605.lbm_s" in out
+    for name in ("lbm", build.CONTORL_FILENAME):
+        with open(os.path.join(builder.stagedir, name)) as f:
+            assert f.read() == name
+
+
+def _write(path, text=""):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w") as f:
+        f.write(text)
+
+
+def test_clone_spechpc_tree(builder, monkeypatch):
+    monkeypatch.setattr(build, "SRFM_BUILD_CACHE_DIR", None)
+    shared = builder.spechpc_dir
+    for path in (
+        "shrc",
+        "bin/harness/tool.pm",
+        "config/default.cfg",
+        "benchspec/HPC/605.lbm_s/src/lbm.c",
+        "benchspec/HPC/605.lbm_s/build/build_base.0000/Makefile.spec",
+        "benchspec/HPC/605.lbm_s/run/run_base.0000/control",
+    ):
+        _write(os.path.join(shared, path), path)
+
+    tree = os.path.join(builder.stagedir, build.ISOLATED_TREE_NAME)
+    subprocess.run(
+        ["bash", "-e", "-c", "\n".join(builder._clone_spechpc_tree(tree))],
+        check=True,
+    )
+
+    def _same(path):
+        return os.path.samefile(os.path.join(shared, path), os.path.join(tree, path))
+
+    # the sources are shared, and what runhpc may write to is not
+    assert _same("benchspec/HPC/605.lbm_s/src/lbm.c")
+    for path in ("shrc", "bin/harness/tool.pm", "config/default.cfg"):
+        assert not _same(path), path
+    assert not os.path.exists(os.path.join(tree, "benchspec/HPC/605.lbm_s/build"))
+    assert not os.path.exists(os.path.join(tree, "benchspec/HPC/605.lbm_s/run"))
+    for path in ("result", "tmp"):
+        assert os.path.isdir(os.path.join(tree, path))
+
+    # writes in the clone do not reach the shared tree
+    _write(os.path.join(tree, "bin/harness/tool.pm"), "rewritten")
+    with open(os.path.join(shared, "bin/harness/tool.pm")) as f:
+        assert f.read() == "bin/harness/tool.pm"
+
+    # nothing writes into the shared tree, so cloning takes no lock
+    assert not any(n.startswith(".srfm") for n in os.listdir(shared))
+    locks = os.listdir(os.path.dirname(builder.stagedir))
+    assert not any(n.startswith(".srfm.") for n in locks)
+
+
+def test_partition_tree_lock(builder, monkeypatch):
+    monkeypatch.setattr(build, "SRFM_BUILD_CACHE_DIR", None)
+    tree = builder.spechpc_dir + "_" + builder.partition_name
+    script = "\n".join([*builder._lock_cmd(tree, "--exclusive"), "echo locked"])
+
+    holder = subprocess.Popen(
+        ["bash", "-c", script + "\nsleep 5"], stdout=subprocess.PIPE, text=True
+    )
+    try:
+        assert holder.stdout.readline().strip() == "locked"
+        # a second build of the partition waits for the first
+        waiting = subprocess.run(
+            [
+                "bash",
+                "-e",
+                "-c",
+                script.replace("--exclusive", "--exclusive --nonblock"),
+            ],
+            capture_output=True,
+        )
+        assert waiting.returncode != 0
+    finally:
+        holder.kill()
+        holder.wait()
+
+    # the lock is next to the stage directory, not in the tree
+    locks = os.listdir(os.path.dirname(builder.stagedir))
+    assert any(n.startswith(".srfm.") and n.endswith(".lock") for n in locks)
+
+
+def _fake_spechpc(bindir, shared):
+    # `runhpc` sets up the build and run directories of each benchmark for the
+    # given number of ranks, with the ranks in the flags and the control file
+    runhpc = bindir / "runhpc"
+    runhpc.write_text("""#!/bin/bash
+while [ $# -gt 0 ]; do
+    case "$1" in
+        --ranks) RANKS="$2"; shift ;;
+        --size|--tune|--config) shift ;;
+        --*) ;;
+        *) BENCHMARKS="$BENCHMARKS $1" ;;
+    esac
+    shift
+done
+for b in $BENCHMARKS; do
+    n=$(ls -d benchspec/HPC/$b/run/run_* 2>/dev/null | wc -l)
+    id=$(printf %04d $n)
+    mkdir -p benchspec/HPC/$b/build/build_base.$id benchspec/HPC/$b/run/run_base_ref_intel_mpi.$id
+    echo "CFLAGS = -DRANKS_PER_NODE=$RANKS" > benchspec/HPC/$b/build/build_base.$id/Makefile.spec
+    echo "input.txt $RANKS" > benchspec/HPC/$b/run/run_base_ref_intel_mpi.$id/control
+done
+""")
+    specmake = bindir / "specmake"
+    specmake.write_text("#!/bin/sh\necho binary > lbm\n")
+    for path in (runhpc, specmake):
+        path.chmod(0o755)
+    _write(os.path.join(shared, "shrc"))
+
+
+def test_control_files_for_reused_ranks(builder, bindir):
+    environ = _environ()
+    _fake_compilers(bindir, "2022.1.0")
+    _fake_spechpc(bindir, builder.spechpc_dir)
+    builder.spechpc_reuse_ranks = [152, 304]
+
+    _bash("\n".join(builder.emit_build_commands(environ)), bindir)
+
+    def _control(stagedir, ranks=None):
+        directory = stagedir
+        if ranks:
+            directory = os.path.join(stagedir, build.RANKS_DIR_FORMAT.format(ranks))
+        return build.read_control_file(directory)
+
+    # set up by the build, for each number of ranks
+    assert _control(builder.stagedir) == ["input.txt", "76"]
+    for ranks in (152, 304):
+        assert _control(builder.stagedir, ranks) == ["input.txt", str(ranks)]
+    # the flags define the number of ranks
+    with open(os.path.join(builder.stagedir, build.RANK_DEPENDENT_MARKER)) as f:
+        assert f.read().strip() == "-DRANKS_PER_NODE=76"
+
+    # and restored from the cache along with the binary
+    builder.stagedir = builder.stagedir + "-restored"
+    os.makedirs(builder.stagedir)
+    out = _bash("\n".join(builder.emit_build_commands(environ)), bindir)
+    assert "Restoring 605.lbm_s" in out
+    assert _control(builder.stagedir, 304) == ["input.txt", "304"]
+    assert os.path.isfile(os.path.join(builder.stagedir, build.RANK_DEPENDENT_MARKER))
+
+
+def test_check_num_ranks(stagedir, caplog):
+    build.check_num_ranks("605.lbm_s", stagedir, 76, [152], 76)
+
+    # not declared rank-independent
+    with pytest.raises(ValueError, match="spechpc_reuse_num_nodes"):
+        build.check_num_ranks("605.lbm_s", stagedir, 76, [152], 304)
+
+    with caplog.at_level("INFO", logger=build.logger.name):
+        build.check_num_ranks("605.lbm_s", stagedir, 76, [152], 152)
+    assert "no rank define in Makefile.spec" in caplog.text
+
+    # declared, but the build found the ranks in the flags
+    _write(os.path.join(stagedir, build.RANK_DEPENDENT_MARKER), "-DNRANKS=76\n")
+    with pytest.raises(ValueError, match="defines -DNRANKS=76"):
+        build.check_num_ranks("605.lbm_s", stagedir, 76, [152], 152)
@@ -0,0 +1,70 @@
+import os
+import types
+import logging
+
+import pytest
+
+from harness.database import (
+    BMCInstrument,
+    COOLDOWN_BASELINE_FORMAT,
+    COOLDOWN_TIMES_FILE,
+)
+
+
+def _test(stagedir, **attrs):
+    test = types.SimpleNamespace(
+        stagedir=stagedir,
+        num_nodes=2,
+        cooldown_seconds=60,
+        cooldown_adaptive=True,
+        cooldown_sudo=False,
+        cooldown_tolerance=0.05,
+        cooldown_settle_seconds=5.0,
+        cooldown_idle_power=None,
+    )
+    test.__dict__.update(attrs)
+    for name in (
+        "_rapl_cmd",
+        "_cooldown_cmds",
+        "_warn_cooldown_fallback",
+        "_read_cooldown_duration",
+    ):
+        setattr(test, name, types.MethodType(getattr(BMCInstrument, name), test))
+    return test
+
+
+def _write_cooldown(stagedir, seconds, baseline=True):
+    with open(os.path.join(stagedir, COOLDOWN_TIMES_FILE), "w") as f:
+        f.write(f"1000.0 {1000.0 + seconds}\n")
+    if baseline:
+        path = os.path.join(stagedir, COOLDOWN_BASELINE_FORMAT.format(host="cpu-1"))
+        with open(path, "w") as f:
+            f.write("180.0\n")
+
+
+def test_settle_with_sudo_falls_back_to_sleep(stagedir):
+    (settle,) = [
+        c
+        for c in _test(stagedir, cooldown_sudo=True)._cooldown_cmds()
+        if "rapl.py settle" in c
+    ]
+    assert "sudo -n python3" in settle
+    assert settle.endswith("|| sleep 60s")
+
+
+def test_settled_cooldown(stagedir, caplog):
+    _write_cooldown(stagedir, 12.5)
+    with caplog.at_level(logging.WARNING):
+        assert _test(stagedir)._read_cooldown_duration() == pytest.approx(12.5)
+    assert caplog.records == []
+
+
+@pytest.mark.parametrize(
+    "baseline, message",
+    [(False, "energy_uj is only readable by root"), (True, "did not settle")],
+)
+def test_cooldown_fallback_warns(stagedir, caplog, baseline, message):
+    _write_cooldown(stagedir, 60.2, baseline)
+    with caplog.at_level(logging.WARNING):
+        assert _test(stagedir)._read_cooldown_duration() == pytest.approx(60.2)
+    assert message in caplog.text
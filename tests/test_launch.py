@@ -0,0 +1,308 @@
+import os
+import json
+import types
+import socket
+import subprocess
+import itertools
+
+import pytest
+
+from reframe.core.exceptions import SanityError
+
+import testbed
+
+import harness.utils as utils
+import harness.phases as phases
+import harness.quality as quality
+import harness.sampler as sampler
+import harness.frequency as frequency
+import harness.repetition as repetition
+from harness.nodesetup import NodeSetupBase
+
+CPUS = 4
+# the hooks that lay out the launch, as run by ReFrame in some order
+QUALITY_HOOK = "_run_quality_snapshots"
+SAMPLER_HOOK = "_rapl_instrument_start_sampler"
+PHASES_HOOK = "_phase_energy_mark_launch"
+SETUP_HOOK = "apply_node_setup"
+SWEEP_HOOK = "set_cpu_frequency"
+REPEAT_HOOK = "_adaptive_repetition_loop"
+
+
+@pytest.fixture
+def cpu_root(tmp_path):
+    """
+    A fake cpufreq tree, which `nodeagent.py` sets up as a dry run.
+    """
+    root = tmp_path / "cpu"
+    for i in range(CPUS):
+        cpufreq = root / f"cpu{i}" / "cpufreq"
+        cpufreq.mkdir(parents=True)
+        (cpufreq / "scaling_governor").write_text("performance\n")
+        for name in ("scaling_cur_freq", "scaling_min_freq", "scaling_max_freq"):
+            (cpufreq / name).write_text("2000000\n")
+    return str(root)
+
+
+def _borrow(test, cls, *names):
+    for name in names:
+        setattr(test, name, types.MethodType(getattr(cls, name), test))
+
+
+def _test(stagedir: str, cpu_root: str, **attrs):
+    """
+    A test that borrows the run and sanity hooks of the batched mixins, with
+    RunQuality, the RAPL sampler, the launch markers and a powercap setup.
+    """
+    test = types.SimpleNamespace(
+        stagedir=stagedir,
+        display_name="LaunchTest",
+        num_nodes=1,
+        spectimes_path="spectimes.txt",
+        prerun_cmds=["cp ../lbm lbm"],
+        postrun_cmds=["sleep 0"],
+        node_setup_sysfs_root=cpu_root,
+        node_setup_timeout=1.0,
+        node_setup_frequency_tolerance=50.0,
+        quality_sysfs_root=cpu_root,
+        quality_proc_root="/proc",
+        quality_stray_threshold=0.1,
+        rapl_sysfs_root=os.path.join(cpu_root, "powercap"),
+        rapl_sample_interval=0.1,
+        rapl_sample_capacity=16,
+        rapl_sudo=False,
+        sweep_frequencies=[1800.0, 2200.0],
+        sweep_repetitions=2,
+        repeat_target=0.5,
+        repeat_confidence=0.95,
+        repeat_min=3,
+        repeat_max=5,
+        repeat_energy=False,
+        repeat_energy_sudo=False,
+    )
+    test.__dict__.update(attrs)
+    test.node_setup_args = lambda: ["--powercap 400"]
+
+    _borrow(test, NodeSetupBase, SETUP_HOOK, "node_setup_cmd")
+    _borrow(test, quality.RunQuality, QUALITY_HOOK, "_node_state_cmd")
+    _borrow(test, quality.RunQuality, "_run_quality_states")
+    _borrow(
+        test,
+        sampler.RAPLInstrument,
+        SAMPLER_HOOK,
+        "_rapl_instrument_node_prefix",
+        "_rapl_instrument_cmd",
+    )
+    _borrow(test, phases.PhaseEnergy, PHASES_HOOK)
+    _borrow(
+        test,
+        frequency.FrequencySweepBatched,
+        SWEEP_HOOK,
+        "sweep_steps",
+        "_sweep_setup_cmd",
+        "_sweep_setup_results",
+        "check_sweep_steps",
+        "_sweep_step_times",
+    )
+    _borrow(
+        test,
+        repetition.AdaptiveRepetition,
+        REPEAT_HOOK,
+        "_converge_cmd",
+        "_repeat_step_times",
+        "_adaptive_repetition_check_steps",
+    )
+    return test
+
+
+def _run(test, hooks, launch_cmd):
+    for hook in hooks:
+        getattr(test, hook)()
+
+    script = os.path.join(test.stagedir, "job.sh")
+    with open(script, "w") as f:
+        f.write("\n".join([*test.prerun_cmds, launch_cmd, *test.postrun_cmds]))
+    subprocess.run(["bash", script], cwd=test.stagedir, check=True)
+
+
+def _fake_launch(stagedir: str, failing_step: int = None) -> str:
+    with open(os.path.join(stagedir, "passed.txt"), "w") as f:
+        f.write(testbed.spectimes_text(10.0))
+    with open(os.path.join(stagedir, "failed.txt"), "w") as f:
+        f.write(testbed.spectimes_text(10.0, verified=False))
+
+    if failing_step is None:
+        return "cp passed.txt spectimes.txt"
+    return (
+        f'if [ "$SRFM_STEP" = {failing_step} ]; then cp failed.txt spectimes.txt;'
+        " else cp passed.txt spectimes.txt; fi"
+    )
+
+
+@pytest.mark.parametrize("loop_hook", [SWEEP_HOOK, REPEAT_HOOK])
+def test_layout_independent_of_hook_order(stagedir, cpu_root, loop_hook):
+    hooks = [QUALITY_HOOK, SAMPLER_HOOK, PHASES_HOOK, SETUP_HOOK, loop_hook]
+
+    layouts = set()
+    for order in itertools.permutations(hooks):
+        test = _test(stagedir, cpu_root, repeat_energy=True)
+        for hook in order:
+            getattr(test, hook)()
+        layouts.add((tuple(test.prerun_cmds), tuple(test.postrun_cmds)))
+
+    assert len(layouts) == 1
+    prerun_cmds, postrun_cmds = layouts.pop()
+
+    def index(cmds, text):
+        return next(i for (i, c) in enumerate(cmds) if text in c)
+
+    # from the outside in, with the launch markers next to the launch
+    before = [
+        "cp ../lbm lbm",
+        "apply --powercap 400",
+        f"--output {quality.NODE_STATE_FORMAT.split('.{')[0]}",
+        "while true; do" if loop_hook == REPEAT_HOOK else "for SRFM_STEP_SPEC",
+        "rm -f spectimes.txt",
+        f"{utils.STEP_MARKER} $SRFM_STEP start",
+        phases.LAUNCH_START,
+    ]
+    assert [index(prerun_cmds, t) for t in before] == sorted(
+        index(prerun_cmds, t) for t in before
+    )
+    assert prerun_cmds[-1] == phases.launch_marker_cmd(phases.LAUNCH_START)
+    assert prerun_cmds[0].startswith("rm -f")
+
+    after = [
+        phases.LAUNCH_END,
+        f"{utils.STEP_MARKER} $SRFM_STEP end",
+        "cp spectimes.txt",
+        "done",
+        quality.NODE_STATE_AFTER,
+        "sleep 0",
+        sampler.RAPL_STOP_FILE,
+    ]
+    assert [index(postrun_cmds, t) for t in after] == sorted(
+        index(postrun_cmds, t) for t in after
+    )
+
+    if loop_hook == REPEAT_HOOK:
+        # the counters are read inside the step markers, around the launch
+        reads = [i for (i, c) in enumerate(prerun_cmds) if "rapl.py read" in c]
+        assert reads == [len(prerun_cmds) - 2]
+        reads = [i for (i, c) in enumerate(postrun_cmds) if "rapl.py read" in c]
+        assert reads == [1]
+
+
+def test_commands_inside_layers_rejected(stagedir, cpu_root):
+    test = _test(stagedir, cpu_root)
+    test._run_quality_snapshots()
+    test.prerun_cmds.append("echo stray")
+    with pytest.raises(ValueError):
+        test._phase_energy_mark_launch()
+
+
+def _hostname() -> str:
+    return socket.gethostname().split(".")[0]
+
+
+def _snapshot_times(test):
+    states = test._run_quality_states()
+    assert len(states) == 1
+    (host_states,) = states.values()
+    return (
+        host_states[quality.NODE_STATE_BEFORE]["time"],
+        host_states[quality.NODE_STATE_AFTER]["time"],
+    )
+
+
+def test_sweep_with_run_quality(stagedir, cpu_root):
+    test = _test(stagedir, cpu_root)
+    hooks = [SWEEP_HOOK, PHASES_HOOK, QUALITY_HOOK]
+    _run(test, hooks, _fake_launch(stagedir))
+
+    steps = test._sweep_step_times()
+    assert list(steps["step"]) == [0, 1, 2, 3]
+    for i, (f, _) in enumerate(test.sweep_steps()):
+        assert os.path.isfile(
+            os.path.join(stagedir, frequency.SPECTIMES_STEP_FORMAT.format(i))
+        )
+        # the frequency was set and read back for each step
+        (outcome,) = test._sweep_setup_results()[i].values()
+        assert outcome["settings"]["frequency"]["target"] == f
+        assert outcome["ok"]
+
+    # the node state is taken once, around all of the steps
+    before, after = _snapshot_times(test)
+    assert before < steps["start"][0]
+    assert after > steps["end"][-1]
+
+    test.check_sweep_steps()
+
+
+def test_sweep_checks_every_step(stagedir, cpu_root):
+    test = _test(stagedir, cpu_root)
+    _run(test, [SWEEP_HOOK, QUALITY_HOOK], _fake_launch(stagedir, failing_step=1))
+
+    # the last step passed, but not the second
+    with pytest.raises(SanityError, match="Steps 1 "):
+        test.check_sweep_steps()
+
+
+def test_sweep_checks_the_setup_of_every_step(stagedir, cpu_root):
+    test = _test(stagedir, cpu_root)
+    _run(test, [SWEEP_HOOK], _fake_launch(stagedir))
+
+    path = os.path.join(
+        stagedir,
+        frequency.SWEEP_SETUP_FORMAT.format(host=_hostname(), step=2),
+    )
+    with open(path) as f:
+        outcome = json.load(f)
+    outcome["ok"] = False
+    with open(path, "w") as f:
+        json.dump(outcome, f)
+
+    test = _test(stagedir, cpu_root)
+    with pytest.raises(SanityError, match="Steps 2 could not be set up"):
+        test.check_sweep_steps()
+
+
+def test_repetition_with_run_quality(stagedir, cpu_root):
+    test = _test(stagedir, cpu_root)
+    hooks = [QUALITY_HOOK, REPEAT_HOOK, SETUP_HOOK]
+    _run(test, hooks, _fake_launch(stagedir))
+
+    # identical times converge as soon as allowed
+    steps = test._repeat_step_times()
+    assert list(steps["step"]) == [0, 1, 2]
+
+    before, after = _snapshot_times(test)
+    assert before < steps["start"][0]
+    assert after > steps["end"][-1]
+
+    test._adaptive_repetition_check_steps()
+
+
+def test_repetition_checks_every_step(stagedir, cpu_root):
+    test = _test(stagedir, cpu_root)
+    _run(test, [REPEAT_HOOK], _fake_launch(stagedir, failing_step=0))
+
+    with pytest.raises(SanityError, match="Steps 0 "):
+        test._adaptive_repetition_check_steps()
+
+
+def test_failed_setup_ends_the_job(stagedir, cpu_root):
+    # no frequency is close enough, so the setting never takes effect
+    test = _test(
+        stagedir, cpu_root, node_setup_timeout=0.2, node_setup_frequency_tolerance=-1
+    )
+    test.node_setup_args = lambda: ["--frequency 1800"]
+    test.apply_node_setup()
+
+    script = os.path.join(stagedir, "job.sh")
+    with open(script, "w") as f:
+        f.write("\n".join([*test.prerun_cmds, "touch launched", *test.postrun_cmds]))
+    result = subprocess.run(["bash", script], cwd=stagedir)
+
+    assert result.returncode == 1
+    assert not os.path.exists(os.path.join(stagedir, "launched"))
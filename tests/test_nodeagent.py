@@ -0,0 +1,87 @@
+import os
+import sys
+import json
+import subprocess
+
+import pytest
+
+import harness.nodeagent as nodeagent
+
+CPUS = 4
+NODEAGENT_SCRIPT = nodeagent.__file__
+
+
+@pytest.fixture
+def node(tmp_path):
+    """
+    The cpufreq files of a fake node, at 2 GHz with the performance governor.
+    """
+    for i in range(CPUS):
+        cpufreq = tmp_path / f"cpu{i}" / "cpufreq"
+        cpufreq.mkdir(parents=True)
+        (cpufreq / "scaling_governor").write_text("performance\n")
+        for name in ("scaling_cur_freq", "scaling_min_freq", "scaling_max_freq"):
+            (cpufreq / name).write_text("2000000\n")
+    return tmp_path
+
+
+def _apply(node, *args):
+    # run as in the job script
+    output = node / "nodesetup.json"
+    result = subprocess.run(
+        [
+            sys.executable,
+            NODEAGENT_SCRIPT,
+            "--sysfs-root",
+            str(node),
+            "apply",
+            "--timeout",
+            "0.3",
+            "--output",
+            str(output),
+            *args,
+        ],
+        capture_output=True,
+        text=True,
+    )
+    with open(output) as f:
+        return result, json.load(f)
+
+
+def test_dry_run(node):
+    result, outcome = _apply(
+        node, "--governor", "userspace", "--frequency", "1800", "--powercap", "400"
+    )
+    assert result.returncode == 0, result.stderr
+    assert outcome["dry_run"]
+    assert outcome["ok"]
+
+    settings = outcome["settings"]
+    assert settings["governor"]["achieved"] == ["userspace"]
+    assert settings["frequency"]["achieved"] == 1800.0
+    assert settings["powercap"]["achieved"] == 400
+    assert all(s["ok"] for s in settings.values())
+
+    for i in range(CPUS):
+        cpufreq = node / f"cpu{i}" / "cpufreq"
+        assert (cpufreq / "scaling_governor").read_text() == "userspace"
+        assert (cpufreq / "scaling_cur_freq").read_text() == "1800000"
+    assert (node / "racadm" / nodeagent.POWERCAP_ATTRIBUTE).read_text() == "400 W"
+
+
+def test_readback_timeout(node):
+    # the BMC accepts the powercap but never reports it back
+    (node / "racadm").mkdir()
+    os.symlink(os.devnull, node / "racadm" / nodeagent.POWERCAP_ATTRIBUTE)
+
+    result, outcome = _apply(node, "--frequency", "1800", "--powercap", "400")
+
+    # the job script ends on the exit code
+    assert result.returncode == 1
+    assert "powercap did not take effect" in result.stderr
+    assert not outcome["ok"]
+    assert outcome["settings"]["frequency"]["ok"]
+    powercap = outcome["settings"]["powercap"]
+    assert powercap["achieved"] is None
+    assert not powercap["ok"]
+    assert powercap["latency"] >= 0.3
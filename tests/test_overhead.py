@@ -0,0 +1,95 @@
+import math
+
+import numpy as np
+import pytest
+
+import harness.overhead as overhead
+import harness.stats as stats
+
+
+def test_bootstrap_ci_of_known_sample():
+    # a constant baseline, so the interval is that of the mean of 20 draws of
+    # 104 or 106 from 100: 5% with a standard error of 0.1/sqrt(20)%
+    baseline = [100.0] * 20
+    treated = [104.0, 106.0] * 10
+    value, low, high = stats.relative_difference_ci(baseline, treated)
+
+    assert value == pytest.approx(0.05)
+    half_width = 1.96 * 0.01 / math.sqrt(20)
+    assert low == pytest.approx(0.05 - half_width, abs=5e-4)
+    assert high == pytest.approx(0.05 + half_width, abs=5e-4)
+
+    # the same resampling every time
+    assert stats.relative_difference_ci(baseline, treated) == (value, low, high)
+    assert stats.relative_difference_ci([100.0], treated)[1:] == (-math.inf, math.inf)
+
+
+def test_bootstrap_ci_coverage():
+    rng = np.random.default_rng(0)
+    covered = 0
+    trials = 200
+    for seed in range(trials):
+        baseline = rng.normal(100.0, 2.0, 30)
+        treated = rng.normal(103.0, 2.0, 30)
+        _, low, high = stats.relative_difference_ci(
+            baseline, treated, num_samples=2000, seed=seed
+        )
+        covered += low <= 0.03 <= high
+    assert 0.88 <= covered / trials <= 0.99
+
+
+def _report(samples):
+    return {
+        "runs": [
+            {
+                "testcases": [
+                    {
+                        "name": f"Overhead %overhead_poll_interval={interval}",
+                        "result": "success",
+                        overhead.BENCHMARK_KEY: benchmark,
+                        overhead.INTERVAL_KEY: str(interval),
+                        "perfvalues": {
+                            "csd3:icelake:Core time": [t, 0, None, None, "s"]
+                        },
+                    }
+                    for (benchmark, interval, times) in samples
+                    for t in times
+                ]
+            }
+        ]
+    }
+
+
+def test_finest_interval():
+    rng = np.random.default_rng(1)
+
+    def _times(mean):
+        return list(rng.normal(mean, 0.05, 10))
+
+    r = _report(
+        [
+            ("Lbm_t", overhead.PERF_OFF, _times(100.0)),
+            ("Lbm_t", 10, _times(105.0)),
+            ("Lbm_t", 100, _times(100.5)),
+            ("Lbm_t", 1000, _times(100.0)),
+            ("Tealeaf_t", overhead.PERF_OFF, _times(50.0)),
+            ("Tealeaf_t", 100, _times(51.0)),
+            ("Tealeaf_t", 1000, _times(50.0)),
+            # no baseline, so left out
+            ("Soma_t", 100, _times(20.0)),
+        ]
+    )
+    overheads = overhead.compute_overheads(overhead.collect_times([r]))
+    assert [(o.benchmark, o.interval) for o in overheads] == [
+        ("Lbm_t", 10),
+        ("Lbm_t", 100),
+        ("Lbm_t", 1000),
+        ("Tealeaf_t", 100),
+        ("Tealeaf_t", 1000),
+    ]
+    assert all(o.runs == 10 and o.low <= o.overhead <= o.high for o in overheads)
+
+    # 100 ms is fine for lbm, but not for tealeaf
+    assert overhead.finest_interval(overheads) == 1000
+    assert overhead.finest_interval(overheads, threshold=0.03) == 100
+    assert overhead.finest_interval(overheads, threshold=1e-4) is None
@@ -0,0 +1,94 @@
+import numpy as np
+import pytest
+
+import harness.pareto as pareto
+import harness.report as report
+
+
+def _runs(rng, benchmarks=("Lbm_t", "Tealeaf_t", "Soma_t"), settings=12, repeats=3):
+    rows = [
+        (benchmark, partition, setting, rng.uniform(10, 100), rng.uniform(1e3, 1e4))
+        for benchmark in benchmarks
+        for partition in ("icelake", "sapphire")
+        for setting in rng.choice(np.arange(800, 3000, 100), settings, replace=False)
+        for _ in range(repeats)
+    ]
+    return np.array(rows, dtype=pareto.RUN_DTYPE)
+
+
+def _brute_force_front(points):
+    # nothing else in the group is at least as fast and uses at most as much
+    # energy
+    front = []
+    for i, p in enumerate(points):
+        dominated = any(
+            j != i
+            and q["group"] == p["group"]
+            and q["time"] <= p["time"]
+            and q["energy"] <= p["energy"]
+            for (j, q) in enumerate(points)
+        )
+        front.append(not dominated)
+    return np.array(front)
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_front_matches_brute_force(seed):
+    runs = _runs(np.random.default_rng(seed))
+    keys, points = pareto.analyse(runs)
+
+    assert len(keys) == 6
+    assert len(points) == 6 * 12
+    assert np.all(points["runs"] == 3)
+    np.testing.assert_array_equal(points["pareto"], _brute_force_front(points))
+
+    for metric in ("edp", "ed2p"):
+        minima = pareto.group_minima(points, metric)
+        assert len(minima) == len(keys)
+        for i in minima:
+            group = points[points["group"] == points[i]["group"]]
+            assert points[i][metric] == np.min(group[metric])
+            # the optima of either product are on the frontier
+            assert points[i]["pareto"]
+
+
+def test_relative_to_highest_setting():
+    runs = np.array(
+        [
+            ("Lbm_t", "icelake", 1000, 20.0, 800.0),
+            ("Lbm_t", "icelake", 2000, 10.0, 1200.0),
+            ("Lbm_t", "icelake", 2000, 12.0, 1000.0),
+        ],
+        dtype=pareto.RUN_DTYPE,
+    )
+    _, points = pareto.analyse(runs)
+    assert list(points["setting"]) == [1000, 2000]
+    assert list(points["time"]) == [20.0, 11.0]
+    assert points["speedup"][0] == pytest.approx(11.0 / 20.0)
+    assert points["relative_energy"][0] == pytest.approx(800.0 / 1100.0)
+    assert list(points["pareto"]) == [True, True]
+
+
+def test_collect_runs_skips_flagged():
+    def _testcase(frequency, flagged=0):
+        return {
+            "name": "Lbm_t %cpu_frequency_index=0",
+            "partition": "icelake",
+            "cpu_frequency": frequency,
+            "perfvalues": {
+                f"csd3:icelake:{k}": [v, 0, None, None, ""]
+                for (k, v) in (
+                    ("Core time", 10.0),
+                    ("BMC/cpu-p-1", 500.0),
+                    ("BMC/cpu-p-2", 700.0),
+                    (report.QUALITY_FLAG_KEY, flagged),
+                )
+            },
+        }
+
+    runs = pareto.collect_runs(
+        [_testcase(1000), _testcase(2000, flagged=1), _testcase("<undefined>")]
+    )
+    assert len(runs) == 1
+    assert runs[0]["setting"] == 1000
+    assert runs[0]["energy"] == 1200.0
@@ -0,0 +1,172 @@
+import os
+import types
+import subprocess
+
+import numpy as np
+import pytest
+
+import reframe.utility.sanity as sn
+
+import testbed
+
+import harness.phases as phases
+from harness.perf import PerfIntervals
+from harness.sampler import RAPLInstrument, RAPLSamples
+from harness.utils import PERF_INTERVAL_DTYPE
+
+
+def test_groups():
+    records = np.array(
+        [(0, 1, 0, -1, 2.0, 5.0), (0, 0, 1, -1, 1.0, 4.0), (0, 0, 1, -1, 2.0, 3.0)],
+        dtype=PERF_INTERVAL_DTYPE,
+    )
+    intervals = PerfIntervals(records)
+    assert sorted(intervals.groups()) == [(0, 0, 1), (0, 1, 0)]
+    assert list(intervals.select(0, 0, 1)["value"]) == [4.0, 3.0]
+
+
+def test_no_bmc_phases_without_node_names(monkeypatch):
+    monkeypatch.setattr(phases, "DATABASE_QUERY_ENABLED", True)
+    test = types.SimpleNamespace(
+        database_query_node_names=None,
+        _bmc_instrument_node_readings=lambda nodename: None,
+    )
+    sources = types.MethodType(phases.PhaseEnergy._phase_energy_sources_present, test)
+    assert sources() == []
+
+    test.database_query_node_names = ["cpu-p-001"]
+    assert sources() == ["BMC"]
+
+
+LAUNCH = (1000.0, 1060.0)
+# the phases of the launch: 4 s of initialisation, 50 s of core and 4 s of I/O
+# in the 58 s of the SPEChpc total, which ends with the launch
+CORE = (1006.0, 1056.0)
+CORE_POWER = 100.0
+IDLE_POWER = 40.0
+
+
+def _power(t):
+    return np.where((t >= CORE[0]) & (t < CORE[1]), CORE_POWER, IDLE_POWER)
+
+
+def _write_run(stagedir):
+    with open(os.path.join(stagedir, phases.PHASES_FILE), "w") as f:
+        f.write(f"{phases.LAUNCH_START} {LAUNCH[0]}\n")
+        f.write(f"{phases.LAUNCH_END} {LAUNCH[1]}\n")
+    with open(os.path.join(stagedir, "spectimes.txt"), "w") as f:
+        f.write(
+            " Init time:  4.000000\n Core time:  50.000000\n Total time: 58.000000\n"
+        )
+
+
+def _rapl_samples():
+    # one sample a second, from before the launch until after it
+    times = np.arange(990.0, 1071.0)
+    energies = np.concatenate(([0.0], np.cumsum(_power(times[:-1]))))
+    return RAPLSamples(
+        ["package-0"], (times[0], energies[:1]), times, energies[:, None], False
+    )
+
+
+def _perf_intervals():
+    # `perf stat -I 1000` from the start of the launch, with the core energy
+    # counted in the package as well
+    times = np.arange(1.0, 61.0)
+    energies = _power(LAUNCH[0] + times - 1)
+    records = [
+        (-1, 0, event, -1, t, e * scale)
+        for (event, scale) in ((0, 1.0), (1, 0.5))
+        for (t, e) in zip(times, energies)
+    ]
+    return PerfIntervals(np.array(records, dtype=PERF_INTERVAL_DTYPE))
+
+
+def _phase_test(stagedir):
+    bmc_times = np.arange(990.0, 1071.0, 0.5)
+    bmc = np.stack((bmc_times, _power(bmc_times)), axis=1)
+    test = types.SimpleNamespace(
+        stagedir=stagedir,
+        spectimes_path="spectimes.txt",
+        perf_variables={},
+        perf_events=["power/energy-pkg/", "power/energy-cores/"],
+        database_query_node_names=["cpu-p-001"],
+        _bmc_instrument_node_readings=lambda nodename: bmc,
+        _rapl_instrument_samples=lambda: {"cpu-p-001": _rapl_samples()},
+        _perf_instrument_intervals=_perf_intervals,
+    )
+    test._rapl_instrument_energy_at = types.MethodType(
+        RAPLInstrument._rapl_instrument_energy_at, test
+    )
+    for name, value in vars(phases.PhaseEnergy).items():
+        if callable(value) and name.startswith("_phase_energy"):
+            setattr(test, name, types.MethodType(value, test))
+    return test
+
+
+def test_read_launch_window(stagedir):
+    path = os.path.join(stagedir, phases.PHASES_FILE)
+    assert phases.read_launch_window(path) is None
+
+    subprocess.run(
+        ["bash", "-c", phases.launch_marker_cmd(phases.LAUNCH_START)],
+        cwd=stagedir,
+        check=True,
+    )
+    # not marked until the launch has ended
+    assert phases.read_launch_window(path) is None
+
+    subprocess.run(
+        ["bash", "-c", phases.launch_marker_cmd(phases.LAUNCH_END)],
+        cwd=stagedir,
+        check=True,
+    )
+    start, end = phases.read_launch_window(path)
+    assert 0 <= end - start < 5
+
+
+def test_read_spectimes(tmp_path):
+    path = tmp_path / "spectimes.txt"
+    path.write_text(testbed.spectimes_text(50.0, init=4.0))
+    assert phases.read_spectimes(str(path)) == {
+        "Init": 4.0,
+        "Core": 50.0,
+        "Total": 54.0,
+    }
+
+
+def test_phase_windows():
+    w = phases.phase_windows(*LAUNCH, {"Init": 4.0, "Core": 50.0, "Total": 58.0})
+    assert w.launch == LAUNCH
+    assert w.core == CORE
+    assert w.init_io == [(LAUNCH[0], CORE[0]), (CORE[1], LAUNCH[1])]
+
+    # without an `Init`, everything else comes before the core phase
+    w = phases.phase_windows(*LAUNCH, {"Core": 50.0})
+    assert w.core == (1010.0, LAUNCH[1])
+    assert w.init_io == [(LAUNCH[0], 1010.0), (LAUNCH[1], LAUNCH[1])]
+
+
+def test_phase_energies(stagedir, monkeypatch):
+    monkeypatch.setattr(phases, "DATABASE_QUERY_ENABLED", True)
+    _write_run(stagedir)
+    test = _phase_test(stagedir)
+
+    test._phase_energy_set_variables()
+    values = {k: sn.evaluate(v) for (k, v) in test.perf_variables.items()}
+
+    core = CORE_POWER * (CORE[1] - CORE[0])
+    rest = IDLE_POWER * (LAUNCH[1] - LAUNCH[0] - (CORE[1] - CORE[0]))
+    for source in ("BMC", "RAPL", "perf"):
+        core_energy = values[f"Core energy/{source}"]
+        init_io_energy = values[f"Init/IO energy/{source}"]
+        # the phases make up the whole launch
+        assert core_energy + init_io_energy == pytest.approx(core + rest), source
+
+        # the BMC power is interpolated across the edges of the core phase
+        rel = 0.01 if source == "BMC" else 1e-9
+        assert core_energy == pytest.approx(core, rel=rel), source
+        assert values[f"Core power/{source}"] == pytest.approx(CORE_POWER, rel=rel)
+        assert values[f"Init/IO power/{source}"] == pytest.approx(
+            IDLE_POWER, rel=10 * rel
+        )
@@ -0,0 +1,76 @@
+import types
+
+import pytest
+
+import harness.planner as planner
+from harness.frequency import partition_frequencies
+from harness.warehouse import Warehouse
+
+PARTITION = "sapphire"
+BENCHMARK = "Lbm_t"
+
+
+@pytest.fixture(autouse=True)
+def new_session(monkeypatch):
+    monkeypatch.setattr(planner, "_session_plans", {})
+
+
+def _add_uncapped_runs(warehouse_dir: str, power: float, start: int = 0):
+    # low enough a draw that fewer of the caps can bind
+    with Warehouse(warehouse_dir) as w:
+        for i, f in enumerate(partition_frequencies(PARTITION)):
+            w.add(
+                {
+                    "name": f"{BENCHMARK} %cpu_frequency_index={i}",
+                    "system": "csd3",
+                    "partition": PARTITION,
+                    "job_completion_time_unix": start + i,
+                    "num_nodes": 1,
+                    "cpu_frequency": f,
+                    "perfvalues": {
+                        f"csd3:{PARTITION}:Core power/BMC": [power, 0, None, None, "W"]
+                    },
+                }
+            )
+
+
+def _sweep_point(warehouse_dir: str, index: int):
+    def skip(msg):
+        raise RuntimeError(msg)
+
+    test = types.SimpleNamespace(
+        name=f"Lbm_t %sweep_point_index={index}",
+        sweep_point_index=index,
+        current_partition=types.SimpleNamespace(name=PARTITION),
+        planner_benchmark=BENCHMARK,
+        planner_warehouse_dir=warehouse_dir,
+        planner_power_margin=planner.DEFAULT_POWER_MARGIN,
+        planner_static_fraction=planner.DEFAULT_STATIC_FRACTION,
+        skip=skip,
+    )
+    planner.FrequencyPowercapSweep.get_sweep_point(test)
+    return (test.cpu_frequency, test.powercap_value)
+
+
+def test_session_plan_is_kept(tmp_path):
+    warehouse_dir = str(tmp_path / "warehouse")
+    plan = planner.session_plan(PARTITION, BENCHMARK, warehouse_dir)
+
+    _add_uncapped_runs(warehouse_dir, 300.0)
+    assert planner.partition_plan(PARTITION, BENCHMARK, warehouse_dir) != plan
+    assert planner.session_plan(PARTITION, BENCHMARK, warehouse_dir) is plan
+
+
+def test_every_point_runs_once_while_runs_are_added(tmp_path):
+    warehouse_dir = str(tmp_path / "warehouse")
+    plan = planner.partition_plan(PARTITION, BENCHMARK, warehouse_dir)
+
+    points = []
+    for index in range(len(plan)):
+        points.append(_sweep_point(warehouse_dir, index))
+        # the runs of the session reach the warehouse as the sweep goes on
+        _add_uncapped_runs(warehouse_dir, 300.0, start=100 * index)
+
+    assert points == [(p.frequency, p.powercap) for p in plan]
+    with pytest.raises(RuntimeError, match="not in the plan"):
+        _sweep_point(warehouse_dir, len(plan))
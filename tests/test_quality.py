@@ -0,0 +1,88 @@
+import os
+import types
+
+import pytest
+
+import harness.nodestate as nodestate
+from harness.quality import (
+    RunQuality,
+    DEFAULT_MAX_RUNNING,
+    NODE_STATE_FORMAT,
+    NODE_STATE_BEFORE,
+    NODE_STATE_AFTER,
+)
+
+
+@pytest.fixture
+def node(tmp_path):
+    """
+    The roots of a fake node, with an empty process table.
+    """
+    cpu = tmp_path / "cpu"
+    (cpu / "cpu0").mkdir(parents=True)
+    proc = tmp_path / "proc"
+    proc.mkdir()
+    return types.SimpleNamespace(cpu=str(cpu), proc=str(proc))
+
+
+def _snapshots(stagedir, node, loadavg: str):
+    with open(os.path.join(node.proc, "loadavg"), "w") as f:
+        f.write(loadavg + "\n")
+    for label in (NODE_STATE_BEFORE, NODE_STATE_AFTER):
+        output = NODE_STATE_FORMAT.format(host="{host}", label=label)
+        nodestate.main(
+            [
+                f"--sysfs-root={node.cpu}",
+                f"--proc-root={node.proc}",
+                "snapshot",
+                "--interval=0",
+                f"--output={os.path.join(stagedir, output)}",
+            ]
+        )
+
+
+def _test(stagedir):
+    test = types.SimpleNamespace(
+        stagedir=stagedir,
+        display_name="QualityTest",
+        spectimes_path="spectimes.txt",
+        quality_max_running=DEFAULT_MAX_RUNNING,
+        quality_max_stray=0,
+        quality_expect_boost=None,
+        quality_expect_cstates=None,
+        quality_warehouse_dir=None,
+        quality_min_history=5,
+        quality_outlier_threshold=3.5,
+        quality_metric="Core time",
+    )
+    for name in vars(RunQuality):
+        if name.startswith("_run_quality"):
+            setattr(test, name, types.MethodType(getattr(RunQuality, name), test))
+    return test
+
+
+def test_high_load_after_an_earlier_run_is_not_flagged(stagedir, node):
+    # a full node run a minute ago, with only the snapshot itself running
+    _snapshots(stagedir, node, "25.31 18.02 9.45 1/812 4242")
+    assert _test(stagedir)._run_quality_problems() == []
+
+
+def test_running_tasks_are_flagged(stagedir, node):
+    _snapshots(stagedir, node, "0.12 0.05 0.01 4/812 4242")
+    (problem,) = _test(stagedir)._run_quality_problems()
+    assert problem.endswith("had 3 other tasks running")
+
+
+def test_job_helpers_are_not_flagged(stagedir, node):
+    # the snapshot and an `srun` of the job, on an otherwise idle node
+    _snapshots(stagedir, node, "0.08 0.13 0.10 2/1187 48211")
+    assert _test(stagedir)._run_quality_problems() == []
+
+
+def test_running_tasks_read_either_side_of_the_interval(node, monkeypatch):
+    # a helper that was only running for the first read
+    reads = iter([{"load": [0.1] * 3, "running": 5}, {"load": [0.1] * 3, "running": 1}])
+    monkeypatch.setattr(nodestate, "load_average", lambda proc_root: next(reads))
+
+    state = nodestate.snapshot(node.cpu, node.proc, 0, 0.1)
+    assert state["loadavg"]["running"] == 1
@@ -0,0 +1,114 @@
+import os
+import time
+
+import numpy as np
+import pytest
+
+import testbed
+import harness.database as database
+from harness.querycache import QueryCache, CACHE_SUFFIX, BYTES_PER_MB
+
+NODES = ["cpu-p-001", "cpu-p-002", "cpu-p-003"]
+
+
+def _key(i: int) -> str:
+    return QueryCache.key("sapphire", f"node-{i}", "start", "end", "60s")
+
+
+def _values(n: int = 100) -> np.array:
+    return np.stack((np.arange(n, dtype=np.float64), np.full(n, 300.0)), axis=1)
+
+
+def _age(cache: QueryCache, key: str, seconds: float):
+    t = time.time() - seconds
+    os.utime(cache._path(key), (t, t))
+
+
+def test_hit_and_miss(tmp_path):
+    cache = QueryCache(str(tmp_path))
+    assert cache.get(_key(0)) is None
+
+    cache.put(_key(0), _values())
+    np.testing.assert_array_equal(cache.get(_key(0)), _values())
+    assert cache.get(_key(1)) is None
+
+
+def test_corrupt_entry_is_a_miss(tmp_path):
+    cache = QueryCache(str(tmp_path))
+    with open(cache._path(_key(0)), "wb") as f:
+        f.write(b"not an array")
+
+    assert cache.get(_key(0)) is None
+    assert not os.path.exists(cache._path(_key(0)))
+
+
+def test_least_recently_used_is_evicted(tmp_path):
+    entry = _values().nbytes
+    # room for three entries, with space for the headers
+    cache = QueryCache(str(tmp_path), 3.5 * entry / BYTES_PER_MB)
+
+    for i in range(3):
+        cache.put(_key(i), _values())
+        _age(cache, _key(i), 100 - i)
+
+    # reading the oldest makes it the most recently used
+    assert cache.get(_key(0)) is not None
+    cache.put(_key(3), _values())
+
+    assert cache.get(_key(1)) is None
+    for i in (0, 2, 3):
+        assert cache.get(_key(i)) is not None, i
+    assert len([p for p in os.listdir(tmp_path) if p.endswith(CACHE_SUFFIX)]) == 3
+
+
+def _window(hours_ago: float = 2.0):
+    end = time.time() - hours_ago * 3600
+    return testbed._format_date(end - 600), testbed._format_date(end)
+
+
+@pytest.fixture
+def cache(tmp_path, monkeypatch, prometheus):
+    cache = QueryCache(str(tmp_path / "cache"))
+    monkeypatch.setattr(database, "QUERY_CACHE", cache)
+    return cache
+
+
+def test_closed_window_is_served_from_cache(cache, prometheus):
+    start, end = _window()
+    first = database.fetch_pdu_measurements_batched(start, end, "sapphire", NODES)
+    assert prometheus.requests == 1
+
+    second = database.fetch_pdu_measurements_batched(start, end, "sapphire", NODES)
+    assert prometheus.requests == 1
+    for node in NODES:
+        np.testing.assert_array_equal(first[node], second[node])
+
+    # the nodes are cached individually
+    database.fetch_pdu_measurements_batched(start, end, "sapphire", NODES + ["x"])
+    assert prometheus.requests == 2
+
+
+def test_open_window_is_not_cached(cache, prometheus):
+    start, end = _window(0.0)
+    for _ in range(2):
+        database.fetch_pdu_measurements_batched(start, end, "sapphire", NODES)
+    assert prometheus.requests == 2
+
+
+def test_offline_miss(cache, prometheus, monkeypatch):
+    start, end = _window()
+    database.fetch_pdu_measurements_batched(start, end, "sapphire", NODES[:2])
+    assert prometheus.requests == 1
+
+    monkeypatch.setattr(database, "SRFM_PROMETHEUS_OFFLINE", True)
+    readings = database.fetch_pdu_measurements_batched(start, end, "sapphire", NODES)
+    assert sorted(readings) == NODES[:2]
+    np.testing.assert_array_equal(
+        database.fetch_pdu_measurements(start, end, "sapphire", NODES[0]),
+        readings[NODES[0]],
+    )
+    with pytest.raises(ValueError):
+        database.fetch_pdu_measurements(start, end, "sapphire", NODES[2])
+
+    # nothing is asked of the database
+    assert prometheus.requests == 1
@@ -0,0 +1,258 @@
+import os
+import types
+
+import numpy as np
+import pytest
+
+from reframe.core.exceptions import PerformanceError
+
+import harness.rapl as rapl
+import harness.sampler as sampler
+from harness.sampler import RAPLInstrument, read_rapl_samples
+
+MAX_RANGE = 262143328850
+
+
+def _zone(path, name, energy=0, max_range=MAX_RANGE):
+    path.mkdir(parents=True)
+    (path / "name").write_text(name + "\n")
+    (path / "energy_uj").write_text(f"{energy}\n")
+    (path / "max_energy_range_uj").write_text(f"{max_range}\n")
+    return path
+
+
+def _set(zone, energy):
+    # rewritten in place, as the counters keep the files open
+    (zone / "energy_uj").write_text(f"{energy}\n")
+
+
+@pytest.fixture
+def powercap(tmp_path):
+    """
+    A powercap tree of two packages, each with a core and a DRAM sub-zone, and
+    an MMIO zone that duplicates the first package.
+    """
+    root = tmp_path / "powercap"
+    for p in range(2):
+        package = _zone(root / f"intel-rapl:{p}", f"package-{p}")
+        _zone(package / f"intel-rapl:{p}:0", "core")
+        _zone(package / f"intel-rapl:{p}:1", "dram")
+    _zone(root / "intel-rapl-mmio:0", "package-0")
+    return root
+
+
+def test_find_domains(powercap):
+    domains = rapl.find_domains(str(powercap))
+
+    assert [rapl.domain_name(d) for d in domains] == [
+        "package-0",
+        "package-0/dram",
+        "package-1",
+        "package-1/dram",
+    ]
+    assert rapl.find_domains(str(powercap / "missing")) == []
+
+
+def test_counter_overflow(powercap):
+    package = powercap / "intel-rapl:0"
+    _set(package, MAX_RANGE - 1000)
+    counters = rapl.Counters([str(package)])
+
+    _set(package, MAX_RANGE - 200)
+    assert counters.energies() == [800]
+
+    # wraps around at `max_energy_range_uj`
+    _set(package, 300)
+    assert counters.energies() == [800 + 200 + 300]
+
+    _set(package, 400)
+    assert counters.energies() == [1400]
+
+
+def test_unreadable_counters(tmp_path):
+    assert rapl.open_counters(str(tmp_path)) is None
+
+
+def _write_ring(path, capacity, count, domains=("package-0", "package-0/dram")):
+    ring = rapl.RingBuffer(str(path), list(domains), capacity, 0.1)
+    try:
+        for i in range(count):
+            ring.append(1000.0 + i, [i * 10, i * 20][: len(domains)])
+    finally:
+        ring.close()
+
+
+def test_ring_buffer(tmp_path):
+    path = tmp_path / "samples.bin"
+    _write_ring(path, 8, 5)
+
+    samples = read_rapl_samples(str(path))
+    assert samples.domains == ["package-0", "package-0/dram"]
+    assert not samples.wrapped
+    np.testing.assert_array_equal(samples.times, 1000.0 + np.arange(5))
+    np.testing.assert_allclose(samples.energies[:, 1], np.arange(5) * 20 / 1e6)
+
+
+def test_ring_buffer_wrap(tmp_path):
+    path = tmp_path / "samples.bin"
+    _write_ring(path, 4, 10)
+
+    samples = read_rapl_samples(str(path))
+    assert samples.wrapped
+    # the latest samples, oldest first, and the very first one kept aside
+    np.testing.assert_array_equal(samples.times, 1000.0 + np.arange(6, 10))
+    np.testing.assert_allclose(samples.energies[:, 0], np.arange(6, 10) * 10 / 1e6)
+    assert samples.first[0] == 1000.0
+    np.testing.assert_array_equal(samples.first[1], [0.0, 0.0])
+
+
+def test_ring_buffer_wrap_at_capacity(tmp_path):
+    path = tmp_path / "samples.bin"
+    _write_ring(path, 4, 8)
+
+    samples = read_rapl_samples(str(path))
+    np.testing.assert_array_equal(samples.times, 1000.0 + np.arange(4, 8))
+
+
+def test_not_a_sample_file(tmp_path):
+    path = tmp_path / "samples.bin"
+    path.write_bytes(b"\0" * 256)
+    with pytest.raises(ValueError):
+        read_rapl_samples(str(path))
+
+
+def test_sample_command(powercap, tmp_path):
+    output = tmp_path / "samples.bin"
+    rc = rapl.main(
+        [
+            "--sysfs-root",
+            str(powercap),
+            "--interval",
+            "0.01",
+            "sample",
+            "--output",
+            str(output),
+            "--capacity",
+            "4",
+            "--max-seconds",
+            "0.3",
+        ]
+    )
+    assert rc == 0
+
+    samples = read_rapl_samples(str(output))
+    assert samples.domains == [
+        "package-0",
+        "package-0/dram",
+        "package-1",
+        "package-1/dram",
+    ]
+    assert samples.wrapped
+    assert len(samples.times) == 4
+    assert np.all(np.diff(samples.times) > 0)
+
+
+def test_sample_removes_wraparound(powercap, tmp_path):
+    package = powercap / "intel-rapl:0"
+    _set(package, MAX_RANGE - 50)
+    counters = rapl.Counters([str(package)])
+    ring = rapl.RingBuffer(str(tmp_path / "samples.bin"), ["package-0"], 4, 0.1)
+
+    try:
+        for i, value in enumerate([MAX_RANGE - 20, 10, 40, 100, 200]):
+            _set(package, value)
+            ring.append(1000.0 + i, counters.energies())
+    finally:
+        ring.close()
+
+    samples = read_rapl_samples(str(tmp_path / "samples.bin"))
+    # the energy since the first sample keeps growing through the wraparound
+    np.testing.assert_allclose(
+        samples.energies[:, 0] * 1e6, [50 + 10, 50 + 40, 50 + 100, 50 + 200]
+    )
+
+
+def test_read_command(powercap, tmp_path):
+    _set(powercap / "intel-rapl:0", 1234)
+    output = tmp_path / "reads.txt"
+
+    for _ in range(2):
+        assert (
+            rapl.main(["--sysfs-root", str(powercap), "read", "--output", str(output)])
+            == 0
+        )
+
+    lines = output.read_text().splitlines()
+    assert len(lines) == 2
+    fields = lines[0].split()
+    # a time, and the energy and range of each of the four domains
+    assert len(fields) == 1 + 2 * 4
+    assert fields[1:3] == ["1234", str(MAX_RANGE)]
+
+
+def test_read_command_without_counters(tmp_path):
+    output = tmp_path / "reads.txt"
+    assert (
+        rapl.main(["--sysfs-root", str(tmp_path), "read", "--output", str(output)]) == 1
+    )
+    assert not os.path.exists(output)
+
+
+def test_ring_buffer_without_samples(tmp_path):
+    path = tmp_path / "samples.bin"
+    _write_ring(path, 4, 0)
+
+    samples = read_rapl_samples(str(path))
+    assert samples.domains == ["package-0", "package-0/dram"]
+    assert samples.first is None
+    assert len(samples.times) == 0
+    assert samples.energies.shape == (0, 2)
+
+
+def _instrument(stagedir, status="0", num_nodes=1):
+    test = types.SimpleNamespace(
+        stagedir=stagedir, num_nodes=num_nodes, rapl_sudo=False, perf_variables={}
+    )
+    for name in vars(RAPLInstrument):
+        if name.startswith("_rapl_instrument"):
+            attr = getattr(RAPLInstrument, name)
+            # the performance functions are called for their values here
+            attr = getattr(attr, "__wrapped__", attr)
+            setattr(test, name, types.MethodType(attr, test))
+    if status is not None:
+        with open(os.path.join(stagedir, sampler.RAPL_STATUS_FILE), "w") as f:
+            f.write(status + "\n")
+    return test
+
+
+def test_sampler_stopped_before_first_sample(stagedir):
+    _write_ring(os.path.join(stagedir, "rapl_samples.nid001.bin"), 4, 0)
+    _write_ring(os.path.join(stagedir, "rapl_samples.nid002.bin"), 4, 5)
+    test = _instrument(stagedir, num_nodes=2)
+    test.time_series = types.SimpleNamespace(add=lambda *args: None)
+
+    test._rapl_instrument_set_variables()
+    assert sorted(test.perf_variables) == [
+        "RAPL/nid002/package-0",
+        "RAPL/nid002/package-0/dram",
+    ]
+
+
+@pytest.mark.parametrize("status", ["1", None])
+def test_failed_sampler_fails_performance(stagedir, status):
+    test = _instrument(stagedir, status=status)
+    with pytest.raises(PerformanceError):
+        test._rapl_instrument_set_variables()
+
+
+def test_missing_samples_fail_performance(stagedir):
+    _write_ring(os.path.join(stagedir, "rapl_samples.nid001.bin"), 4, 5)
+    test = _instrument(stagedir, num_nodes=2)
+    with pytest.raises(PerformanceError, match="Only 1 of 2"):
+        test._rapl_instrument_set_variables()
+
+
+def test_sampler_sudo():
+    test = types.SimpleNamespace(rapl_sudo=True)
+    cmd = RAPLInstrument._rapl_instrument_cmd(test, "sample")
+    assert cmd.startswith("sudo -n python3 ")
@@ -0,0 +1,90 @@
+import pytest
+
+import harness.report as report
+import harness.references as references
+from harness.warehouse import Warehouse
+
+PARTITION = "sapphire"
+CORE_TIMES = [50.0, 51.0, 49.0, 50.5, 49.5, 50.0, 80.0]
+
+METRICS = ["Core time", "Core energy/BMC", report.QUALITY_FLAG_KEY]
+HEADER = (
+    "result|job_completion_time_unix|system|partition|name|cpu_frequency"
+    "|powercap_value|num_nodes|"
+    + "|".join(
+        f"{m}_value|{m}_unit|{m}_ref|{m}_lower_thres|{m}_upper_thres" for m in METRICS
+    )
+)
+
+
+def _row(i, core_time, frequency=1800, result="pass", flagged=0, energy="None"):
+    values = ((core_time, "s"), (energy, "J"), (flagged, ""))
+    return "|".join(
+        [
+            result,
+            str(1000 + i),
+            "csd3",
+            PARTITION,
+            f"Lbm_t %cpu_frequency={frequency}",
+            str(frequency),
+            "None",
+            "1",
+            *(f"{v}|{unit}|0|None|None" for (v, unit) in values),
+        ]
+    )
+
+
+def _warehouse(tmp_path, rows):
+    perflog = tmp_path / "Lbm_t.log"
+    perflog.write_text("\n".join([HEADER, *rows]) + "\n")
+    w = Warehouse(str(tmp_path / "warehouse"))
+    for tc in report.read_perflog(str(perflog)):
+        w.add(tc)
+    return w
+
+
+def _references(w, **kwargs):
+    return references.historical_references(
+        w, "Lbm_t", "csd3", PARTITION, 1800.0, None, 1, **kwargs
+    )
+
+
+def test_references_from_perflog(tmp_path):
+    rows = [_row(i, t) for (i, t) in enumerate(CORE_TIMES[:-1])]
+    rows += [
+        # none of these count towards the reference
+        _row(10, 200.0, result="fail"),
+        _row(11, 200.0, flagged=1),
+        _row(12, 200.0, frequency=1200),
+    ]
+    with _warehouse(tmp_path, rows) as w:
+        refs = _references(w)
+
+    # the energy was never measured
+    assert list(refs) == ["Core time"]
+    value, lower, upper = refs["Core time"]
+    assert value == 50.0
+    assert lower is None
+    # three scaled median absolute deviations of 0.5 s
+    assert upper == pytest.approx(3 * 1.4826 * 0.5 / 50.0)
+
+
+def test_references_from_latest_runs(tmp_path):
+    rows = [_row(i, t) for (i, t) in enumerate(CORE_TIMES)]
+    with _warehouse(tmp_path, rows) as w:
+        assert _references(w, min_history=len(CORE_TIMES) + 1) == {}
+
+        # only the latest runs, where the median is not moved by the outlier
+        value, _, upper = _references(w, min_history=3, max_history=3)["Core time"]
+        assert value == 50.0
+        assert upper == pytest.approx(3 * 1.4826 * 0.5 / 50.0)
+
+        refs = _references(w, min_history=2, max_history=2, one_sided=False)
+        value, lower, upper = refs["Core time"]
+        assert value == 65.0
+        assert lower == -upper
+
+
+def test_minimum_tolerance():
+    value, lower, upper = references.reference_tuple([10.0] * 5, min_tolerance=0.05)
+    assert (value, lower, upper) == (10.0, None, 0.05)
@@ -0,0 +1,94 @@
+import os
+import types
+
+import pytest
+
+from reframe.core.exceptions import SanityError
+
+import testbed
+
+import harness.utils as utils
+import harness.converge as converge
+import harness.repetition as repetition
+from harness.repetition import AdaptiveRepetition
+
+STEP_SECONDS = 40.0
+
+
+def _write_steps(stagedir: str, start: float, steps: int):
+    with open(os.path.join(stagedir, repetition.REPEAT_STEPS_FILE), "w") as f:
+        for i in range(steps):
+            t = start + i * STEP_SECONDS
+            f.write(f"{utils.STEP_MARKER} {i} start {t}\n")
+            f.write(f"{utils.STEP_MARKER} {i} end {t + STEP_SECONDS - 5}\n")
+    for i in range(steps):
+        path = os.path.join(stagedir, repetition.SPECTIMES_REPEAT_FORMAT.format(i))
+        with open(path, "w") as f:
+            f.write(testbed.spectimes_text(STEP_SECONDS - 10))
+
+
+def _borrow(test):
+    for name in ("_repeat", "_adaptive_repetition_check_steps"):
+        for attr, value in vars(AdaptiveRepetition).items():
+            if callable(value) and attr.startswith(name):
+                setattr(test, attr, types.MethodType(value, test))
+
+
+def _converge(stagedir, *args):
+    pattern = os.path.join(stagedir, repetition.SPECTIMES_REPEAT_FORMAT.format("*"))
+    return converge.main(["--spectimes", pattern, "--min-repeats", "2", *args])
+
+
+def test_converge_fails_without_energies(stagedir):
+    _write_steps(stagedir, 1000.0, 3)
+    assert _converge(stagedir) == 0
+
+    reads = os.path.join(stagedir, repetition.RAPL_READS_FILE)
+    assert _converge(stagedir, "--energies", reads) == 2
+    open(reads, "w").close()
+    assert _converge(stagedir, "--energies", reads) == 2
+
+    with open(reads, "w") as f:
+        for i in range(6):
+            f.write(f"{1000 + i} {i * 1000000} 262143328850\n")
+    assert _converge(stagedir, "--energies", reads) == 0
+
+
+def test_missing_energies_fail_sanity(stagedir):
+    _write_steps(stagedir, 1000.0, 2)
+    test = types.SimpleNamespace(
+        stagedir=stagedir, repeat_energy=True, repeat_energy_sudo=False
+    )
+    _borrow(test)
+
+    with pytest.raises(SanityError, match="Only 0 of 2 repetitions"):
+        test._adaptive_repetition_check_steps()
+
+
+def test_instruments_measure_the_last_repetition(stagedir, sacct, prometheus):
+    run = testbed.OfflineRun(stagedir, samples=10)
+    testbed.add_sacct_job(sacct, testbed.JOB_ID, run.start, run.end)
+    _write_steps(stagedir, run.start + 5, 2)
+    _borrow(run)
+    run.repeat_energy = False
+
+    # the perf output of each repetition follows its step marker
+    stderr = []
+    for i, step in enumerate(run._repeat_step_times()):
+        text, totals = testbed.perf_stat_output(
+            run.perf_events, testbed.SOCKETS, 10, seed=i
+        )
+        stderr.append(f"{utils.STEP_MARKER} {i} start {step['start']}\n{text}")
+    with open(os.path.join(stagedir, run.stderr), "w") as f:
+        f.write("".join(stderr))
+
+    values = run.performance()
+    for (socket, event), total in totals.items():
+        assert values[f"/{socket}/{event}"] == pytest.approx(total)
+
+    host = run.job.nodelist[0]
+    last = run._repeat_last_step()
+    assert last["step"] == 1
+    assert values[f"BMC/{host}"] == pytest.approx(
+        testbed.node_power(host) * (last["end"] - last["start"])
+    )
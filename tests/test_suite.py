@@ -0,0 +1,128 @@
+import os
+import types
+
+import pytest
+
+import harness.build as build
+import harness.suite as suite
+from harness.suite import SPEChpcSuiteBuild, SPEChpcSuiteBinary
+
+from test_build import _bash, _environ, _fake_compilers, _fake_spechpc
+
+BENCHMARKS = ["605.lbm_s", "618.tealeaf_s", "613.soma_s"]
+
+
+@pytest.fixture
+def builder(tmp_path):
+    config = tmp_path / "spechpc.cfg"
+    config.write_text("OPTIMIZE = -O2 -xHOST\n")
+    spechpc = tmp_path / "spechpc"
+    spechpc.mkdir()
+
+    b = SPEChpcSuiteBuild()
+    b.spechpc_config = str(config)
+    b.spechpc_dir = str(spechpc)
+    b.spechpc_num_ranks = 76
+    b.spechpc_benchmarks = BENCHMARKS
+    b.spechpc_no_control_file = ["613.soma_s"]
+    b.spechpc_additional_inputs = {"618.tealeaf_s": ["tea.in"]}
+    b.spechpc_reuse_ranks = [152]
+    b.spechpc_build_jobs = 2
+    b.partition_name = "icelake"
+    b.stagedir = str(tmp_path / "stage")
+    os.makedirs(b.stagedir)
+    return b
+
+
+def _fake_suite(bindir, builder):
+    _fake_compilers(bindir, "2022.1.0")
+    _fake_spechpc(bindir, builder.spechpc_dir)
+    # the executable is named after the benchmark, and some leave inputs in
+    # the run directory
+    specmake = bindir / "specmake"
+    specmake.write_text("""#!/bin/bash
+benchmark=$(basename $(dirname $(dirname $PWD)))
+name=${benchmark#*.}
+echo binary > ${name%%_*}
+for d in ../../run/run_*; do touch $d/tea.in; done
+""")
+
+
+def test_suite_build(builder, tmp_path):
+    bindir = tmp_path / "bin"
+    bindir.mkdir()
+    _fake_suite(bindir, builder)
+
+    _bash("\n".join(builder.emit_build_commands(_environ())), bindir)
+
+    def _products(benchmark):
+        return {
+            os.path.relpath(
+                os.path.join(d, f), os.path.join(builder.stagedir, benchmark)
+            )
+            for (d, _, files) in os.walk(os.path.join(builder.stagedir, benchmark))
+            for f in files
+        }
+
+    assert _products("605.lbm_s") == {
+        build.RANK_DEPENDENT_MARKER,
+        build.CONTORL_FILENAME,
+        "lbm",
+        os.path.join("ranks.152", build.CONTORL_FILENAME),
+    }
+    assert _products("618.tealeaf_s") == {
+        build.RANK_DEPENDENT_MARKER,
+        build.CONTORL_FILENAME,
+        os.path.join("ranks.152", build.CONTORL_FILENAME),
+        "tea.in",
+        "tealeaf",
+    }
+    assert _products("613.soma_s") == {build.RANK_DEPENDENT_MARKER, "soma"}
+
+    # one start and end time for each benchmark
+    with open(os.path.join(builder.stagedir, suite.BUILD_TIMES_NAME)) as f:
+        times = [line.split() for line in f]
+    assert sorted(t[0] for t in times) == sorted(BENCHMARKS)
+    assert all(float(start) <= float(end) for (_, start, end) in times)
+
+
+def test_makefile_escapes_shell_variables(builder):
+    path = builder._write_suite_makefile("/tree")
+    with open(path) as f:
+        text = f.read()
+    assert "RUNID=$$(basename $$(pwd) | cut -d. -f2)" in text
+    assert "$$RUNID" in text
+    for benchmark in BENCHMARKS:
+        assert f"\n{benchmark}:\n\t+@mkdir -p" in text
+
+
+def _suite(stagedir):
+    return types.SimpleNamespace(
+        stagedir=str(stagedir),
+        spechpc_benchmarks=BENCHMARKS,
+        spechpc_additional_inputs={},
+        spechpc_no_control_file=["613.soma_s"],
+        num_runtime_ranks=76,
+        reuse_ranks=[152],
+    )
+
+
+def test_suite_binary(tmp_path):
+    s = _suite(tmp_path)
+    for ranks, directory in ((76, "605.lbm_s"), (152, "605.lbm_s/ranks.152")):
+        os.makedirs(tmp_path / directory, exist_ok=True)
+        (tmp_path / directory / build.CONTORL_FILENAME).write_text(f"lbm.in {ranks}\n")
+
+    binary = SPEChpcSuiteBinary(s, "605.lbm_s")
+    assert os.path.samefile(
+        os.path.dirname(binary.executable_path), tmp_path / "605.lbm_s"
+    )
+    assert binary.read_executable_opts() == ["lbm.in", "76"]
+    assert binary.read_executable_opts(152) == ["lbm.in", "152"]
+    binary.check_num_ranks(152)
+    with pytest.raises(ValueError):
+        binary.check_num_ranks(304)
+
+    assert SPEChpcSuiteBinary(s, "613.soma_s").read_executable_opts() == []
+    with pytest.raises(ValueError, match="not part of the suite"):
+        SPEChpcSuiteBinary(s, "619.clvleaf_s")
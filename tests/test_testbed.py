@@ -0,0 +1,61 @@
+import os
+
+import pytest
+
+import testbed
+
+
+def _run(stagedir, sacct, nodes, mode="leader", **kwargs):
+    run = testbed.OfflineRun(stagedir, nodes, perf_launch_mode=mode, **kwargs)
+    testbed.add_sacct_job(sacct, testbed.JOB_ID, run.start, run.end)
+    return run
+
+
+@pytest.mark.parametrize(
+    "nodes, mode", [(1, "leader"), (1, "mpmd"), (4, "leader"), (4, "mpmd")]
+)
+def test_energies(stagedir, sacct, prometheus, nodes, mode):
+    run = _run(stagedir, sacct, nodes, mode)
+    values = run.performance()
+
+    for key, value in run.expected.items():
+        assert values[key] == pytest.approx(value, rel=1e-9, abs=1e-6), key
+
+    # every node is fetched in the one query
+    assert prometheus.requests == 1
+    # perf and BMC of every node
+    assert len(run.time_series) == 2 * nodes
+
+
+@pytest.mark.parametrize("sockets, events", [(1, 1), (2, 3), (4, 2)])
+def test_sockets_and_events(stagedir, sacct, prometheus, sockets, events):
+    run = _run(stagedir, sacct, 2, sockets=sockets, events=testbed.EVENTS[:events])
+    values = run.performance()
+
+    perf = [k for k in values if k.startswith("/")]
+    assert len(perf) == 2 * sockets * events
+    for key in perf:
+        assert values[key] == pytest.approx(run.expected[key]), key
+
+
+def test_job_window_from_scheduler(stagedir, sacct, prometheus):
+    run = _run(stagedir, sacct, 1)
+    run.performance()
+
+    # the window is the job as reported by `sacct`, less the cooldown
+    start = testbed._parse_date(run.job_start_time)
+    end = testbed._parse_date(run.job_end_time)
+    assert start == run.start
+    assert end == run.end - run.cooldown_seconds
+
+
+def test_missing_leader_output(stagedir, sacct, prometheus):
+    run = _run(stagedir, sacct, 2)
+    host = run.job.nodelist[1]
+    os.remove(os.path.join(stagedir, f"perf.{host}.txt"))
+
+    values = run.performance()
+    first = run.job.nodelist[0]
+    key = f"/{first}/0/{testbed.EVENTS[0]}"
+    assert values[key] == pytest.approx(run.expected[key])
+    assert values[f"/{host}/0/{testbed.EVENTS[0]}"] == 0.0
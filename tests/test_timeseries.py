@@ -0,0 +1,100 @@
+import numpy as np
+import pytest
+
+import harness.compression as compression
+from harness.timeseries import TimeSeriesStore, lttb_indices
+
+
+def _bits(a):
+    return np.asarray(a, dtype=np.float64).view(np.uint64)
+
+
+def _series(rng, n=1000):
+    times = 1.7e9 + np.arange(n) * 0.1
+    # jitter in the timestamps, and the odd missing or unusual value
+    times[::7] += rng.normal(0, 1e-4, len(times[::7]))
+    values = 300.0 + np.cumsum(rng.normal(0, 1, n))
+    values[[3, 500]] = np.nan
+    values[[10, 11]] = [np.inf, -0.0]
+    values[12] = np.frombuffer(np.uint64(0x7FF8DEADBEEF0001).tobytes(), np.float64)[0]
+    return times, values
+
+
+@pytest.mark.parametrize("codec", [compression.CODEC_XOR, compression.CODEC_DELTA2])
+def test_encode_round_trip(codec):
+    times, values = _series(np.random.default_rng(0))
+    for a in (times, values, np.array([]), np.array([42.0])):
+        encoded = compression.encode(a, codec)
+        assert compression.is_encoded(np.frombuffer(encoded, dtype=np.uint8))
+        np.testing.assert_array_equal(_bits(compression.decode(encoded)), _bits(a))
+
+
+def test_not_encoded():
+    assert not compression.is_encoded(np.arange(32, dtype=np.uint8))
+    with pytest.raises(ValueError):
+        compression.decode(b"XXXX" + bytes(compression.HEADER.size))
+
+
+def _store():
+    rng = np.random.default_rng(1)
+    store = TimeSeriesStore()
+    for node in ("cpu-p-1", "cpu-p-2"):
+        times, values = _series(rng)
+        store.add(f"perf/{node}", "power/energy-pkg/", times, values)
+        store.add(f"perf/{node}", "power/energy-ram/", times, values / 10)
+    # on a different index, so re-indexed with NaNs
+    store.add("perf/cpu-p-1", "cpu-clock", np.arange(3.0), np.ones(3))
+    return store
+
+
+@pytest.mark.parametrize("write", ["to_npz", "to_packed"])
+def test_store_round_trip(tmp_path, write):
+    store = _store()
+    path = str(tmp_path / "series.npz")
+    getattr(store, write)(path)
+
+    loaded = TimeSeriesStore.from_npz(path)
+    assert loaded.sources() == store.sources()
+    for source in store.sources():
+        assert loaded.columns(source) == store.columns(source)
+        for column in store.columns(source):
+            for a, b in zip(loaded.view(source, column), store.view(source, column)):
+                np.testing.assert_array_equal(_bits(a), _bits(b))
+
+
+def test_packed_is_smaller(tmp_path):
+    store = _store()
+    store.to_npz(str(tmp_path / "series.npz"))
+    store.to_packed(str(tmp_path / "packed.npz"))
+    assert (tmp_path / "packed.npz").stat().st_size < (
+        tmp_path / "series.npz"
+    ).stat().st_size
+
+
+@pytest.mark.parametrize("max_points", [3, 10, 99, 500])
+def test_lttb_keeps_endpoints(max_points):
+    rng = np.random.default_rng(2)
+    times = np.sort(rng.uniform(0, 100, 1000))
+    values = rng.normal(0, 1, 1000)
+
+    index = lttb_indices(times, values, max_points)
+    assert len(index) == max_points
+    assert index[0] == 0
+    assert index[-1] == len(times) - 1
+    assert np.all(np.diff(index) > 0)
+
+
+def test_lttb_keeps_peak():
+    times = np.arange(1000.0)
+    values = np.zeros(1000)
+    values[637] = 10.0
+    assert 637 in lttb_indices(times, values, 20)
+    # nothing to drop
+    np.testing.assert_array_equal(lttb_indices(times[:5], values[:5], 20), np.arange(5))
+
+
+def test_downsampled_skips_nan():
+    store = _store()
+    times, values = store.downsampled("perf/cpu-p-1", "power/energy-pkg/", 50)
+    assert len(times) == 50
+    assert np.all(np.isfinite(values))
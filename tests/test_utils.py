@@ -0,0 +1,70 @@
+import numpy as np
+
+import harness.utils as utils
+
+EVENTS = ["power/energy-pkg/", "power/energy-ram/"]
+
+# `perf stat -I 1000 --per-socket -a -e power/energy-pkg/,power/energy-ram/`,
+# which right-aligns the times
+PERF_OUTPUT = """\
+#           time socket cpus             counts unit events
+     1.001316563 S0        56              62.75 Joules power/energy-pkg/
+     1.001316563 S1        56              58.92 Joules power/energy-pkg/
+     1.001316563 S0        56               9.20 Joules power/energy-ram/
+     1.001316563 S1        56               8.84 Joules power/energy-ram/
+     2.002689215 S0        56              62.31 Joules power/energy-pkg/
+     2.002689215 S1        56              59.10 Joules power/energy-pkg/
+     2.002689215 S0        56      <not counted> Joules power/energy-ram/
+     2.002689215 S1        56               8.79 Joules power/energy-ram/
+"""
+
+
+def _write(tmp_path, text):
+    path = tmp_path / "perf.txt"
+    path.write_text(text)
+    return str(path)
+
+
+def test_read_perf_intervals_unprefixed(tmp_path):
+    records = utils.read_perf_intervals(_write(tmp_path, PERF_OUTPUT), EVENTS)
+
+    assert len(records) == 7
+    assert set(records["host"]) == {-1}
+    assert set(records["step"]) == {-1}
+
+    pkg = records[(records["socket"] == 0) & (records["event"] == 0)]
+    np.testing.assert_allclose(pkg["time"], [1.001316563, 2.002689215])
+    np.testing.assert_allclose(pkg["value"], [62.75, 62.31])
+
+    # the uncounted interval is skipped
+    ram = records[(records["socket"] == 0) & (records["event"] == 1)]
+    np.testing.assert_allclose(ram["value"], [9.20])
+
+
+def test_read_perf_intervals_rank_prefixed(tmp_path):
+    text = "".join(
+        f"[{rank}] {line}\n" for rank in (0, 1) for line in PERF_OUTPUT.splitlines()
+    )
+    records = utils.read_perf_intervals(_write(tmp_path, text), EVENTS)
+
+    assert len(records) == 14
+    assert sorted(set(records["host"])) == [0, 1]
+    for rank in (0, 1):
+        host = records[(records["host"] == rank) & (records["event"] == 0)]
+        assert np.isclose(host["value"].sum(), 62.75 + 58.92 + 62.31 + 59.10)
+
+
+def test_read_perf_intervals_skips_other_lines(tmp_path):
+    text = "Iteration 1 residual 1.0e-3\n" + PERF_OUTPUT + " done\n"
+    records = utils.read_perf_intervals(_write(tmp_path, text), EVENTS[:1])
+
+    assert len(records) == 4
+    assert set(records["event"]) == {0}
+
+
+def test_read_perf_intervals_steps(tmp_path):
+    text = f"{utils.STEP_MARKER} 3 start 1700000000.5\n" + PERF_OUTPUT
+    records = utils.read_perf_intervals(_write(tmp_path, text), EVENTS)
+
+    assert set(records["step"]) == {3}
+    assert np.isclose(records["time"].min(), 1700000000.5 + 1.001316563)
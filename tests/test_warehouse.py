@@ -0,0 +1,87 @@
+import os
+import json
+
+import numpy as np
+
+import harness.report as report
+from harness.timeseries import TimeSeriesStore
+from harness.warehouse import Warehouse
+
+PARTITION = "sapphire"
+
+
+def _testcase(benchmark, frequency, completion, core_time, nodes=("cpu-q-1",)):
+    return {
+        "name": f"{benchmark} %cpu_frequency={frequency}",
+        "system": "csd3",
+        "partition": PARTITION,
+        "result": "success",
+        "cpu_frequency": frequency,
+        "powercap_value": "<undefined>",
+        "num_nodes": len(nodes),
+        "nodelist": list(nodes),
+        "job_completion_time_unix": completion,
+        "perfvalues": {
+            f"csd3:{PARTITION}:Core time": [core_time, 0, None, None, "s"],
+            f"csd3:{PARTITION}:Core power/BMC": [300.0, 0, None, None, "W"],
+        },
+    }
+
+
+def test_add_and_query(tmp_path):
+    with Warehouse(str(tmp_path)) as w:
+        first = w.add(_testcase("Lbm_t", 1200, 100, 50.0))
+        assert first is not None
+        # the same run is only kept once
+        assert w.add(_testcase("Lbm_t", 1200, 100, 51.0)) is None
+
+        w.add(_testcase("Lbm_t", 1600, 200, 40.0, ("cpu-q-2", "cpu-q-3")))
+        w.add(_testcase("Tealeaf_t", 1600, 150, 30.0))
+
+    # and read back once reopened
+    with Warehouse(str(tmp_path)) as w:
+        runs = w.query(benchmark="Lbm_t")
+        assert [r.frequency for r in runs] == [1200.0, 1600.0]
+        assert runs[0].id == first
+        assert runs[0].powercap is None
+        assert runs[0].metrics == {"Core time": 50.0, "Core power/BMC": 300.0}
+        assert runs[1].num_nodes == 2
+
+        # in order of completion
+        runs = w.query(frequency=(1600, None))
+        assert [r.benchmark for r in runs] == ["Tealeaf_t", "Lbm_t"]
+
+        runs = w.query(node="cpu-q-3", metrics=["Core time"])
+        assert [r.metrics for r in runs] == [{"Core time": 40.0}]
+
+        assert [r.completion_time for r in w.query(since=120, until=180)] == [150]
+        assert w.query(partition="icelake") == []
+
+
+def test_import_report(tmp_path):
+    outputdir = tmp_path / "output"
+    outputdir.mkdir()
+    store = TimeSeriesStore()
+    store.add("BMC/cpu-q-1", "power", np.arange(4.0), np.array([1.0, 2.0, 3.0, 4.0]))
+    store.to_npz(str(outputdir / "series.npz"))
+
+    with_series = _testcase("Lbm_t", 1200, 100, 50.0)
+    with_series["outputdir"] = str(outputdir)
+    with_series["time_series"] = {"filename": "series.npz"}
+    failed = dict(_testcase("Lbm_t", 1600, 200, 40.0), result="failure")
+    fixture = dict(_testcase("build", 1600, 300, 0.0), fixture=True)
+
+    path = tmp_path / "report.json"
+    path.write_text(
+        json.dumps({"runs": [{"testcases": [with_series, failed, fixture]}]})
+    )
+
+    with Warehouse(str(tmp_path / "warehouse")) as w:
+        assert w.import_report(str(path)) == 1
+        # importing the report again adds nothing
+        assert w.import_report(str(path)) == 0
+
+        (run,) = w.query()
+        assert run.metrics == report.perf_values(with_series)
+        # the time series is kept alongside, as parquet where pyarrow is there
+        assert os.path.isfile(w.time_series(run))